@@ -0,0 +1,297 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import alignment_index
+import score_store
+import summaries
+
+CORPUS_FILE = "cleaned_abstracts_by_row.csv"
+CSV_DIR = summaries.CSV_DIR
+
+DIMENSIONS = score_store.SCORE_COLUMNS[1:]
+SCALE = np.array([1, 2, 3, 4, 5], dtype=float)
+
+N_BOOTSTRAP = 1000
+CONFIDENCE = 0.95
+
+
+# Function to load every annotator file as one long table
+# (columns: annotator, model, title key, Title and the four dimensions)
+def load_human_scores(h_evals_dir=score_store.H_EVALS_DIR):
+    frames = []
+    for path in score_store.list_scores_files(h_evals_dir):
+        annotator, model = score_store.parse_scores_file(path)
+        df = score_store.read_scores_file(path)
+        df["annotator"] = annotator
+        df["model"] = score_store.model_suffix(model)
+        frames.append(df)
+    if not frames:
+        return pd.DataFrame(columns=["annotator", "model", "key", "Title"] + DIMENSIONS)
+    scores = pd.concat(frames, ignore_index=True)
+    scores["key"] = scores["Title"].map(alignment_index.normalize_title)
+    for dimension in DIMENSIONS:
+        scores[dimension] = pd.to_numeric(scores[dimension], errors="coerce")
+    return scores
+
+
+# Function to rank each row of a matrix, averaging the ranks of ties
+def rankdata(values):
+    values = np.atleast_2d(values)
+    rows, cols = values.shape
+    order = np.argsort(values, axis=1, kind="stable")
+    ordered = np.take_along_axis(values, order, axis=1)
+    starts = np.ones_like(ordered, dtype=bool)
+    starts[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    flat = starts.ravel()
+    group = np.cumsum(flat) - 1
+    first = np.flatnonzero(flat)
+    last = np.append(first[1:], flat.size) - 1
+    row_offset = (first // cols) * cols
+    average = (first + last) / 2 - row_offset + 1
+    ranks = np.empty_like(ordered, dtype=float)
+    np.put_along_axis(ranks, order, average[group].reshape(rows, cols), axis=1)
+    return ranks
+
+
+# Function to compute the Pearson correlation of matching rows of two matrices
+def _row_pearson(a, b):
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    denominator = np.sqrt((a * a).sum(axis=1) * (b * b).sum(axis=1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (a * b).sum(axis=1) / denominator
+
+
+# Function to compute Spearman's rho for every row pair (one per resample)
+def spearman(x, y):
+    return _row_pearson(rankdata(x), rankdata(y))
+
+
+# Function to compute Kendall's tau-b for every row pair (one per resample)
+def kendall(x, y, chunk=64):
+    x, y = np.atleast_2d(x), np.atleast_2d(y)
+    out = np.empty(len(x))
+    upper = np.triu_indices(x.shape[1], k=1)
+    for start in range(0, len(x), chunk):
+        xs, ys = x[start : start + chunk], y[start : start + chunk]
+        dx = np.sign(xs[:, :, None] - xs[:, None, :])[:, upper[0], upper[1]]
+        dy = np.sign(ys[:, :, None] - ys[:, None, :])[:, upper[0], upper[1]]
+        concordance = (dx * dy).sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[start : start + chunk] = concordance / np.sqrt(
+                (dx != 0).sum(axis=1) * (dy != 0).sum(axis=1)
+            )
+    return out
+
+
+# Function to compute Krippendorff's alpha for a units x coders matrix
+# (NaN marks a missing rating; level is "ordinal", "interval" or "nominal")
+def krippendorff_alpha(ratings, level="ordinal", scale=SCALE):
+    ratings = np.asarray(ratings, dtype=float)
+    counts = np.stack([(ratings == value).sum(axis=1) for value in scale], axis=1)
+    pairable = counts.sum(axis=1)
+    counts = counts[pairable > 1].astype(float)
+    pairable = pairable[pairable > 1]
+    if len(counts) == 0:
+        return float("nan")
+
+    # Coincidence matrix of values rated for the same unit by different coders
+    coincidence = np.einsum("uc,uk->ck", counts / (pairable - 1)[:, None], counts)
+    coincidence -= np.diag((counts / (pairable - 1)[:, None]).sum(axis=0))
+    marginals = coincidence.sum(axis=1)
+    total = marginals.sum()
+
+    if level == "nominal":
+        delta = 1.0 - np.eye(len(scale))
+    elif level == "interval":
+        delta = (scale[:, None] - scale[None, :]) ** 2
+    else:
+        cumulative = np.cumsum(marginals)
+        low = np.minimum.outer(np.arange(len(scale)), np.arange(len(scale)))
+        high = np.maximum.outer(np.arange(len(scale)), np.arange(len(scale)))
+        between = cumulative[high] - np.where(low > 0, cumulative[low - 1], 0)
+        delta = (between - (marginals[low] + marginals[high]) / 2) ** 2
+
+    expected = (np.outer(marginals, marginals) * delta).sum()
+    if expected == 0:
+        return float("nan")
+    return float(1 - (total - 1) * (coincidence * delta).sum() / expected)
+
+
+# Function to compute Cohen's kappa (quadratic weights by default)
+def cohen_kappa(a, b, weights="quadratic", scale=SCALE):
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    keep = ~(np.isnan(a) | np.isnan(b))
+    a, b = a[keep], b[keep]
+    if len(a) == 0:
+        return float("nan")
+    index = {value: i for i, value in enumerate(scale)}
+    observed = np.zeros((len(scale), len(scale)))
+    np.add.at(observed, ([index[v] for v in a], [index[v] for v in b]), 1)
+    observed /= observed.sum()
+    expected = np.outer(observed.sum(axis=1), observed.sum(axis=0))
+    if weights == "quadratic":
+        w = (scale[:, None] - scale[None, :]) ** 2
+    elif weights == "linear":
+        w = np.abs(scale[:, None] - scale[None, :])
+    else:
+        w = 1.0 - np.eye(len(scale))
+    denominator = (w * expected).sum()
+    if denominator == 0:
+        return float("nan")
+    return float(1 - (w * observed).sum() / denominator)
+
+
+# Function to compute a statistic on bootstrap resamples (runs in a worker)
+def _bootstrap_chunk(kind, data, n_resamples, seed):
+    rng = np.random.default_rng(seed)
+    n = len(data[0])
+    indices = rng.integers(0, n, size=(n_resamples, n))
+    if kind == "alpha":
+        return np.array([krippendorff_alpha(data[0][i]) for i in indices])
+    x, y = data[0][indices], data[1][indices]
+    return spearman(x, y) if kind == "spearman" else kendall(x, y)
+
+
+# Function to get a percentile bootstrap interval, chunked across processes
+def bootstrap_ci(kind, data, n_resamples=N_BOOTSTRAP, workers=None, seed=0, chunk=250):
+    sizes = [min(chunk, n_resamples - s) for s in range(0, n_resamples, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers == 1 or len(sizes) == 1:
+        parts = [_bootstrap_chunk(kind, data, n, s) for n, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(
+                pool.map(
+                    _bootstrap_chunk,
+                    [kind] * len(sizes),
+                    [data] * len(sizes),
+                    sizes,
+                    seeds,
+                )
+            )
+    values = np.concatenate(parts)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return float("nan"), float("nan")
+    tail = (1 - CONFIDENCE) / 2 * 100
+    low, high = np.percentile(values, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+# Function to compute inter-annotator agreement per model and dimension
+def agreement_table(scores, n_resamples=N_BOOTSTRAP, workers=None):
+    rows = []
+    for (model, dimension), group in (
+        scores.melt(
+            id_vars=["annotator", "model", "key"],
+            value_vars=DIMENSIONS,
+            var_name="dimension",
+        )
+        .dropna(subset=["value"])
+        .groupby(["model", "dimension"])
+    ):
+        matrix = group.pivot_table(
+            index="key", columns="annotator", values="value", aggfunc="last"
+        )
+        if matrix.shape[1] < 2:
+            continue
+        ratings = matrix.to_numpy(dtype=float)
+        kappas = [
+            cohen_kappa(matrix[a], matrix[b])
+            for a, b in itertools.combinations(matrix.columns, 2)
+        ]
+        low, high = bootstrap_ci("alpha", (ratings,), n_resamples, workers)
+        rows.append(
+            {
+                "model": model,
+                "dimension": dimension,
+                "annotators": matrix.shape[1],
+                "units": int((~np.isnan(ratings)).sum(axis=1).__ge__(2).sum()),
+                "krippendorff_alpha": krippendorff_alpha(ratings),
+                "alpha_low": low,
+                "alpha_high": high,
+                "cohen_kappa_mean": float(np.nanmean(kappas)),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+# Function to load every numeric metric column of abstract_para by title key
+def load_metric_scores(corpus_file=CORPUS_FILE, csv_dir=CSV_DIR):
+    corpus = pd.read_csv(corpus_file, usecols=["No", "Title"])
+    corpus["key"] = corpus["Title"].map(alignment_index.normalize_title)
+    # Titles shared by several abstracts cannot be matched to human scores
+    corpus = corpus[~corpus["key"].duplicated(keep=False)]
+    long = []
+    for csv_name in sorted(f for f in os.listdir(csv_dir) if f.endswith(".csv")):
+        df = pd.read_csv(os.path.join(csv_dir, csv_name))
+        suffixes = [c[len("Abstract_") :] for c in df if c.startswith("Abstract_")]
+        for column in df.columns:
+            metric, model = summaries.split_metric_column(column, suffixes)
+            if metric is None or not pd.api.types.is_numeric_dtype(df[column]):
+                continue
+            part = df[["No", column]].rename(columns={column: "value"})
+            part["metric"], part["model"] = metric, model
+            long.append(part)
+    metrics = pd.concat(long, ignore_index=True)
+    return metrics.merge(corpus[["No", "key"]], on="No")
+
+
+# Function to correlate mean human scores with every automatic metric
+def correlation_table(scores, metrics, n_resamples=N_BOOTSTRAP, workers=None):
+    human = scores.groupby(["model", "key"])[DIMENSIONS].mean().reset_index()
+    rows = []
+    for (model, metric), metric_group in metrics.groupby(["model", "metric"]):
+        joined = human[human["model"] == model].merge(
+            metric_group[["key", "value"]], on="key"
+        )
+        for dimension in DIMENSIONS:
+            pair = joined[[dimension, "value"]].dropna()
+            if len(pair) < 3:
+                continue
+            x, y = pair[dimension].to_numpy(), pair["value"].to_numpy()
+            data = (x, y)
+            rho_low, rho_high = bootstrap_ci("spearman", data, n_resamples, workers)
+            tau_low, tau_high = bootstrap_ci("kendall", data, n_resamples, workers)
+            rows.append(
+                {
+                    "model": model,
+                    "dimension": dimension,
+                    "metric": metric,
+                    "n": len(pair),
+                    "spearman": float(spearman(x, y)[0]),
+                    "spearman_low": rho_low,
+                    "spearman_high": rho_high,
+                    "kendall": float(kendall(x, y)[0]),
+                    "kendall_low": tau_low,
+                    "kendall_high": tau_high,
+                }
+            )
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotator agreement analysis")
+    parser.add_argument("--h-evals-dir", default=score_store.H_EVALS_DIR)
+    parser.add_argument("--resamples", type=int, default=N_BOOTSTRAP)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out-dir", default=None)
+    args = parser.parse_args()
+
+    scores = load_human_scores(args.h_evals_dir)
+    agreement = agreement_table(scores, args.resamples, args.workers)
+    correlations = correlation_table(
+        scores, load_metric_scores(), args.resamples, args.workers
+    )
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+        agreement.to_csv(os.path.join(args.out_dir, "agreement.csv"), index=False)
+        correlations.to_csv(os.path.join(args.out_dir, "correlations.csv"), index=False)
+    print(agreement.to_string(index=False))
+    print(correlations.to_string(index=False))
@@ -0,0 +1,181 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+import corpus_store
+import paged_table
+import profiling
+
+INPUT_FILE = "input.csv"
+
+# Model files larger than this are read row by row instead of being cached
+STREAM_ABOVE_BYTES = 64 * 1024 * 1024
+
+# Built indexes kept in memory, keyed by model file path
+_indexes = {}
+_lock = threading.Lock()
+
+
+# Function to normalize a title before it is used as a join key
+def normalize_title(title):
+    return " ".join(str(title).split()).casefold()
+
+
+# Function to map every (title, occurrence) pair of a frame to its row offset
+# (offsets and seen can be carried over to index a file chunk by chunk)
+def title_offsets(titles, start=0, offsets=None, seen=None):
+    offsets = {} if offsets is None else offsets
+    seen = {} if seen is None else seen
+    for row, title in enumerate(titles, start):
+        title = normalize_title(title)
+        occurrence = seen.get(title, 0)
+        seen[title] = occurrence + 1
+        offsets[(title, occurrence)] = row
+    return offsets
+
+
+# Function to build the join index between input.csv and one model file
+def build_index(model_path, input_path=INPUT_FILE):
+    model_df = corpus_store.load_csv(model_path)
+    return match_offsets(
+        title_offsets(model_df["Title"]), len(model_df), model_path, input_path
+    )
+
+
+# Function to pair input rows with model rows given the model's title offsets
+def match_offsets(model_offsets, model_rows, model_path, input_path=INPUT_FILE):
+    input_df = corpus_store.load_csv(input_path)
+    input_offsets = title_offsets(input_df["Title"])
+
+    # Duplicate titles are paired by occurrence order (k-th with k-th)
+    offsets = [-1] * len(input_df)
+    for key, input_row in input_offsets.items():
+        offsets[input_row] = model_offsets.get(key, -1)
+
+    matched = set(offsets)
+    return {
+        "keys": _file_keys(model_path, input_path),
+        "offsets": offsets,
+        "missing": [row for row, offset in enumerate(offsets) if offset < 0],
+        "extra": [row for row in range(model_rows) if row not in matched],
+        "shifted": [
+            row for row, offset in enumerate(offsets) if offset >= 0 and offset != row
+        ],
+    }
+
+
+# Function to get the path of the persisted index for a model file
+def _index_path(model_path):
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(corpus_store.CACHE_DIR, f"alignment_{name}.json")
+
+
+# Function to get the change markers of both files an index depends on
+def _file_keys(model_path, input_path):
+    return [
+        list(corpus_store.file_key(os.path.abspath(input_path))),
+        list(corpus_store.file_key(os.path.abspath(model_path))),
+    ]
+
+
+# Function to check whether an index still matches the files on disk
+def _is_current(index, model_path, input_path):
+    return index.get("keys") == _file_keys(model_path, input_path)
+
+
+# Function to load the index for a model file, rebuilding it when stale
+def get_index(model_path, input_path=INPUT_FILE):
+    with _lock:
+        index = _indexes.get(model_path)
+        if index is not None and _is_current(index, model_path, input_path):
+            return index
+
+        index_path = _index_path(model_path)
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+            if not _is_current(index, model_path, input_path):
+                index = None
+
+        if index is None:
+            with profiling.timer("alignment_index.build_index"):
+                index = build_index(model_path, input_path)
+            _save_index(model_path, index)
+
+        _indexes[model_path] = index
+        return index
+
+
+# Function to persist an index next to the other derived files
+def _save_index(model_path, index):
+    os.makedirs(corpus_store.CACHE_DIR, exist_ok=True)
+    index_path = _index_path(model_path)
+    with open(index_path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+
+
+# Function to install an index built elsewhere (e.g. while streaming a file in)
+def set_index(model_path, index):
+    with _lock:
+        _save_index(model_path, index)
+        _indexes[model_path] = index
+
+
+# Function to find the model row that pairs with an input row (None if absent)
+def model_offset(model_path, entry_index, input_path=INPUT_FILE):
+    offset = get_index(model_path, input_path)["offsets"][entry_index]
+    return offset if offset >= 0 else None
+
+
+# Function to summarize alignment problems for a model file
+def alignment_report(model_path, input_path=INPUT_FILE):
+    index = get_index(model_path, input_path)
+    return {
+        "missing": len(index["missing"]),
+        "extra": len(index["extra"]),
+        "shifted": len(index["shifted"]),
+    }
+
+
+# Function to find the input rows for a title in O(1)
+def find_title(title, input_path=INPUT_FILE):
+    with _lock:
+        key = ("titles", os.path.abspath(input_path))
+        file_key = corpus_store.file_key(os.path.abspath(input_path))
+        cached = _indexes.get(key)
+        if cached is None or cached[0] != file_key:
+            titles = {}
+            for row, value in enumerate(corpus_store.load_csv(input_path)["Title"]):
+                titles.setdefault(normalize_title(value), []).append(row)
+            cached = (file_key, titles)
+            _indexes[key] = cached
+    return cached[1].get(normalize_title(title), [])
+
+
+# Function to get the model row paired with an input row (None if absent)
+def get_model_row(model_path, entry_index, input_path=INPUT_FILE):
+    offset = model_offset(model_path, entry_index, input_path)
+    if offset is None:
+        return None
+    if os.path.getsize(model_path) > STREAM_ABOVE_BYTES:
+        _, columns = paged_table.csv_columns(model_path)
+        rows = paged_table.csv_rows(model_path, np.array([offset]), columns)
+        return rows.iloc[0].to_dict()
+    return corpus_store.get_row(model_path, offset)
+
+
+# Function to turn a 1-based entry number or a title into an entry index
+def resolve_entry(query, input_path=INPUT_FILE):
+    query = query.strip()
+    if not query:
+        return None
+    if query.isdigit():
+        entry_index = int(query) - 1
+        if 0 <= entry_index < corpus_store.row_count(input_path):
+            return entry_index
+        return None
+    rows = find_title(query, input_path)
+    return rows[0] if rows else None
@@ -1,7 +1,22 @@
 import streamlit as st
 import pandas as pd
 import os
-import base64
+
+import alignment_index
+import columnar_store
+import coordinator
+import copy_detection
+import corpus_store
+import entry_prefetch
+import image_assets
+import model_registry
+import paged_table
+import profiling
+import sampling
+import score_store
+import sentence_alignment
+import summaries
+import user_store
 
 # st.title("Revolutionize AI Assessments: An Intuitive Web Tool for Evaluating LLM Paraphrase Performance ")
 # Define the models and corresponding csv files
@@ -11,8 +26,15 @@ models = {
     "Llama3 70b": "llama3_70b.csv",
 }
 
-# Load the users csv file (assuming it's in the same directory)
-users_df = pd.read_csv("users.csv", dtype={"password": str})
+# Add the models ingested from model_outputs/ (new files show up without a restart)
+model_registry.start_watcher()
+models.update(model_registry.registered_models())
+
+# Image folders shown by the menu pages
+IMAGE_DIRS = ["metrics_images", "models_images", "results_images", "about_us"]
+
+# Hash any new or changed accounts from users.csv into the user store
+user_store.ensure_imported("users.csv")
 
 # Initialize session state for login status (initially False)
 if "loggedin" not in st.session_state:
@@ -26,48 +48,185 @@ if "entry_index" not in st.session_state:
 
 # Function to check user credentials
 def check_login(username, password):
-    # Check if username exists in the dataframe
-    if username in users_df["username"].values:
-        # Get the corresponding row for the username
-        user_row = users_df[users_df["username"] == username]
-        # Validate password
-        if user_row["password"].values[0] == password:
-            return True
-        else:
-            st.error("Incorrect password")
-    else:
+    result = user_store.authenticate(username, password)
+    if result is None:
         st.error("Username not found")
-    return False
+    elif not result:
+        st.error("Incorrect password")
+    return bool(result)
+
+
+# Function to jump to the entry typed into the "Go to Entry" box
+def jump_to_entry():
+    entry_index = alignment_index.resolve_entry(st.session_state["jump_to"])
+    if entry_index is None:
+        st.session_state["jump_error"] = True
+    else:
+        st.session_state["entry_index"] = entry_index
+        st.session_state["jump_error"] = False
+
+
+# Function to move to the previous entry (runs before the rerun the click causes)
+def previous_entry():
+    if st.session_state["entry_index"] > 0:
+        st.session_state["entry_index"] -= 1
+
+
+# Function to move to the next entry (runs before the rerun the click causes)
+def next_entry(total):
+    if st.session_state["entry_index"] < total - 1:
+        st.session_state["entry_index"] += 1
 
 
 # Function to display images in a directory
-def display_images(images_dir):
+# (resized copies are served as static files and loaded lazily)
+@profiling.timed("render.display_images")
+def display_images(images_dir, style="max-width: 100%; height: auto;"):
     if os.path.exists(images_dir):
-        for image_file in os.listdir(images_dir):
-            image_path = os.path.join(images_dir, image_file)
-            st.image(image_path, caption="")
+        assets = image_assets.prepare_dir(images_dir)
+        st.markdown(
+            image_assets.images_html(assets, style=style),
+            unsafe_allow_html=True,
+        )
     else:
         st.error("Images folder not found")
 
 
+# Function to display charts built from the cached score summary
+@profiling.timed("render.display_summary_dashboard")
+def display_summary_dashboard():
+    summary = summaries.refresh()
+    metric_df = summaries.metric_summary(summary)
+    human_df = summaries.human_summary(summary)
+
+    if len(metric_df):
+        st.subheader("Automatic Metrics")
+        metric = st.selectbox("Metric", sorted(metric_df["metric"].unique()))
+        selected = metric_df[metric_df["metric"] == metric].set_index("model")
+        st.bar_chart(selected[["mean"]])
+        st.dataframe(selected.drop(columns=["metric"]))
+
+    if len(human_df):
+        st.subheader("Human Evaluation")
+        dimension = st.selectbox("Dimension", sorted(human_df["metric"].unique()))
+        selected = human_df[human_df["metric"] == dimension].set_index("model")
+        st.bar_chart(selected[["mean"]])
+        st.dataframe(selected.drop(columns=["metric"]))
+
+    unacceptable = pd.concat([metric_df, human_df]).dropna(subset=["unacceptable_pct"])
+    if len(unacceptable):
+        st.subheader("Percentage Unacceptable")
+        st.bar_chart(
+            unacceptable.pivot_table(
+                index="metric", columns="model", values="unacceptable_pct"
+            )
+        )
+
+
 # Function to display CSV files in a directory
+@profiling.timed("render.display_csv_files")
 def display_csv_files(csv_dir):
+    # Read from the columnar store when it has been built (only shown columns)
+    if columnar_store.available():
+        display_columnar_tables()
+        return
     if os.path.exists(csv_dir):
         csv_files = [f for f in os.listdir(csv_dir) if f.endswith(".csv")]
         if csv_files:
             selected_csv = st.selectbox("Select a CSV file", csv_files)
             if selected_csv:
                 csv_path = os.path.join(csv_dir, selected_csv)
-                df = pd.read_csv(csv_path)
-                st.dataframe(df)
+                display_paged_table("csv", csv_path)
         else:
             st.error("No CSV files found in the directory")
     else:
         st.error("CSV folder not found")
 
 
+# Function to display score tables from the columnar store
+@profiling.timed("render.display_columnar_tables")
+def display_columnar_tables():
+    tables = columnar_store.list_tables()
+    if not tables:
+        st.error("No score tables found in the store")
+        return
+    selected_table = st.selectbox("Select a score table", tables)
+    display_paged_table("columnar", selected_table)
+
+
+# Function to display one page of a table with server-side sort and filter
+@profiling.timed("render.display_paged_table")
+def display_paged_table(kind, name):
+    all_columns = paged_table.all_columns(kind, name)
+    columns = st.multiselect(
+        "Columns", all_columns, default=paged_table.default_columns(kind, name)
+    )
+    if not columns:
+        return
+    col1, col2, col3, col4, col5 = st.columns([3, 2, 3, 3, 2])
+    with col1:
+        sort_column = st.selectbox("Sort by", [""] + all_columns)
+    with col2:
+        ascending = st.radio("Order", ["Ascending", "Descending"]) == "Ascending"
+    with col3:
+        filter_column = st.selectbox("Filter column", [""] + all_columns)
+    with col4:
+        filter_value = st.text_input("Filter (e.g. >0.5 or text)")
+    with col5:
+        page_size = st.selectbox("Rows per page", paged_table.PAGE_SIZES)
+    total = paged_table.count_rows(kind, name, filter_column, filter_value)
+    pages = max((total + page_size - 1) // page_size, 1)
+    # A page number left over from a wider filter is pulled back to the last page
+    page_key = f"page:{kind}:{name}"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    page = st.number_input("Page", min_value=1, max_value=pages, key=page_key) - 1
+    total, df = paged_table.query(
+        kind,
+        name,
+        columns,
+        page,
+        page_size,
+        sort_column,
+        ascending,
+        filter_column,
+        filter_value,
+    )
+    st.caption(
+        f"Rows {min(page * page_size + 1, total)}-"
+        f"{min((page + 1) * page_size, total)} of {total}"
+    )
+    with profiling.timer("render.dataframe"):
+        st.dataframe(df)
+
+
+# Function to show the timings of recent reruns to admins
+def display_profiling_panel():
+    reruns = profiling.history()
+    with st.sidebar.expander("Timings"):
+        if not reruns:
+            st.write("No reruns recorded yet")
+            return
+        last = reruns[0]
+        st.write(
+            f"Last rerun ({last['label']}): {last['seconds'] * 1000:.0f} ms, "
+            f"peak RSS {last['peak_rss'] / 2**20:.0f} MB"
+        )
+        st.dataframe(pd.DataFrame(last["steps"]))
+        st.line_chart(
+            pd.DataFrame({"ms": [r["seconds"] * 1000 for r in reversed(reruns)]})
+        )
+        st.download_button(
+            "Prometheus metrics", profiling.prometheus_text(), "metrics.prom"
+        )
+
+
 # Login form displayed only if not logged in
 st.set_page_config(layout="wide")
+profiling.start_rerun()
+
+# Generate the resized image variants once (later reruns only stat the files)
+image_assets.prepare_all(IMAGE_DIRS)
 
 # Define the headings for each menu
 headings = {
@@ -113,8 +272,8 @@ if st.session_state["loggedin"]:
         if st.button("Refresh"):
             st.experimental_rerun()
 
-    # Load the input csv file
-    input_df = pd.read_csv("input.csv")
+    # Load the input csv file (shared across reruns and sessions)
+    input_df = corpus_store.load_csv("input.csv")
 
     # Create the sidebar
     st.sidebar.title("Revolutionize AI Assessments")
@@ -141,8 +300,47 @@ if st.session_state["loggedin"]:
         st.sidebar.subheader("Select Model")
         model = st.sidebar.selectbox("", list(models.keys()))
 
-        # Load the selected model's csv file
-        model_df = pd.read_csv(models[model])
+        # Hand out entries still short of ratings so evaluators don't overlap
+        coordinator.ensure_synced(list(models))
+        # Pick what to rate next from metric and annotator disagreement and
+        # abstract length strata, or by coverage alone
+        strategy = st.sidebar.selectbox(
+            "Pick entries by",
+            list(sampling.STRATEGIES),
+            index=list(sampling.STRATEGIES).index("active"),
+        )
+        if st.sidebar.button("Claim Next Entry"):
+            item = coordinator.claim(username, model, strategy=strategy)
+            if item is None:
+                st.sidebar.info("No entries left to rate for this model")
+            else:
+                st.session_state["entry_index"] = item[1]
+                st.session_state["claimed"] = item
+        if st.session_state.get("claimed"):
+            st.sidebar.caption(
+                f"Assigned: {st.session_state['claimed'][0]}, "
+                f"entry {st.session_state['claimed'][1] + 1}"
+            )
+            reason = sampling.explain(*st.session_state["claimed"])
+            if reason is not None:
+                st.sidebar.caption(
+                    f"Length stratum {reason['stratum']}, {reason['ratings']} ratings, "
+                    f"metric disagreement {reason['metric_disagreement']:.2f}, "
+                    f"annotator disagreement {reason['annotator_disagreement']:.2f}"
+                )
+
+        # Resolve the shown rows, usually already prefetched by a previous rerun
+        input_row, model_row = entry_prefetch.get_entry(
+            models[model], st.session_state["entry_index"]
+        )
+        # Resolve the neighbouring entries in the background for instant navigation
+        entry_prefetch.warm(models[model], st.session_state["entry_index"])
+        report = alignment_index.alignment_report(models[model])
+        if report["missing"] or report["extra"]:
+            st.sidebar.warning(
+                f"{models[model]}: {report['missing']} titles missing, "
+                f"{report['extra']} extra rows"
+            )
 
         # Display the current entry index
         st.markdown(
@@ -153,26 +351,65 @@ if st.session_state["loggedin"]:
         col1, col2 = st.columns(2)
         with col1:
             st.markdown(f"**Input Entry:**")
-            st.markdown(
-                f"**Title:** {input_df.iloc[st.session_state['entry_index']]['Title']}"
-            )
+            st.markdown(f"**Title:** {input_row['Title']}")
             st.text_area(
                 "Abstract:",
-                value=input_df.iloc[st.session_state["entry_index"]]["Abstract"],
+                value=input_row["Abstract"],
                 height=250,
             )
         with col2:
             st.markdown(f"**{model} Entry:**")
-            st.markdown(
-                f"**Title:** {model_df.iloc[st.session_state['entry_index']]['Title']}"
-            )
-            st.text_area(
-                "Paraphrased Abstract:",
-                value=model_df.iloc[st.session_state["entry_index"]][
-                    "ParaphrasedAbstract"
-                ],
-                height=250,
+            if model_row is None:
+                st.warning("No paraphrase found for this title")
+            else:
+                st.markdown(f"**Title:** {model_row['Title']}")
+                st.text_area(
+                    "Paraphrased Abstract:",
+                    value=model_row["ParaphrasedAbstract"],
+                    height=250,
+                )
+
+        # Copied spans between the paraphrase and its source, and the most similar
+        # other document found through the MinHash/LSH index
+        copy_report = None
+        if model_row is not None:
+            copy_report = copy_detection.entry_report(
+                models, model, st.session_state["entry_index"]
             )
+            if copy_report is None:
+                st.caption("The copy-detection index is being built...")
+        if copy_report is not None:
+            if copy_report["CopiedSpan"] >= copy_detection.FLAG_SPAN:
+                st.warning(
+                    f"This paraphrase copies a {copy_report['CopiedSpan']}-token span "
+                    "of its source abstract"
+                )
+            with st.expander("Copy Detection"):
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric(
+                    "Longest Copied Span", f"{copy_report['CopiedSpan']} tokens"
+                )
+                col2.metric(
+                    "Overlap with Source", f"{copy_report['SourceOverlap']:.0%}"
+                )
+                col3.metric("Nearest Other Text", copy_report["NearestDocument"] or "-")
+                col4.metric("Overlap with It", f"{copy_report['NearestOverlap']:.0%}")
+                source_html, paraphrase_html = copy_detection.highlight(
+                    input_row["Abstract"], model_row["ParaphrasedAbstract"]
+                )
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.markdown(
+                        f"<div style='max-height: 300px; overflow-y: auto;'>{source_html}</div>",
+                        unsafe_allow_html=True,
+                    )
+                with col2:
+                    st.markdown(
+                        f"<div style='max-height: 300px; overflow-y: auto;'>{paraphrase_html}</div>",
+                        unsafe_allow_html=True,
+                    )
+                if st.checkbox("Show the copy report of all entries"):
+                    display_paged_table("csv", copy_detection.REPORT_FILE)
 
         # Navigation and index input
         # col1, col2, col3, col4, col5 = st.columns([1, 1, 3, 1, 1])
@@ -196,15 +433,17 @@ if st.session_state["loggedin"]:
         # Navigation buttons
         col1, col2, col3 = st.columns([3, 10, 2])
         with col1:
-            if st.button("Previous Entry"):
-                if st.session_state["entry_index"] > 0:
-                    st.session_state["entry_index"] -= 1
-                    st.experimental_rerun()
+            st.button("Previous Entry", on_click=previous_entry)
+        with col2:
+            st.text_input(
+                "Go to Entry (number or title):",
+                key="jump_to",
+                on_change=jump_to_entry,
+            )
+            if st.session_state.get("jump_error"):
+                st.error("Entry not found")
         with col3:
-            if st.button("Next Entry"):
-                if st.session_state["entry_index"] < len(input_df) - 1:
-                    st.session_state["entry_index"] += 1
-                    st.experimental_rerun()
+            st.button("Next Entry", on_click=next_entry, args=(len(input_df),))
 
         # Evaluation scores
         st.subheader("Evaluation Scores")
@@ -222,60 +461,35 @@ if st.session_state["loggedin"]:
         col1, col2, col3, col4 = st.columns([15, 15, 15, 8])
         with col4:
             if st.button("Save Scores"):
-                scores_df = pd.DataFrame(
+                score_store.save_scores(
+                    username,
+                    model,
+                    input_row["Title"],
                     {
-                        "Title": [
-                            input_df.iloc[st.session_state["entry_index"]]["Title"]
-                        ],
-                        "Semantic/Adequacy Score": [semantic_score],
-                        "Syntactic/Novelty Score": [syntactic_score],
-                        "Fluency Score": [fluency_score],
-                        "Overall Score": [overall_score],
-                    }
+                        "Semantic/Adequacy Score": semantic_score,
+                        "Syntactic/Novelty Score": syntactic_score,
+                        "Fluency Score": fluency_score,
+                        "Overall Score": overall_score,
+                    },
                 )
-                h_evals_dir = "H_Evals"
-                if not os.path.exists(h_evals_dir):
-                    os.makedirs(h_evals_dir)
-                scores_file = f"{username}_{model}_scores.csv"
-                filepath = os.path.join(h_evals_dir, scores_file)
-                if os.path.exists(filepath):
-                    scores_df_existing = pd.read_csv(filepath)
-                    scores_df_existing = scores_df_existing[
-                        scores_df_existing.Title
-                        != input_df.iloc[st.session_state["entry_index"]]["Title"]
-                    ]
-                    scores_df = pd.concat([scores_df_existing, scores_df])
-
-                scores_df.to_csv(filepath, index=False)
+                coordinator.complete(username, model, st.session_state["entry_index"])
+                if st.session_state.get("claimed") == (
+                    model,
+                    st.session_state["entry_index"],
+                ):
+                    st.session_state["claimed"] = None
                 st.write("Scores saved successfully!")
 
     elif menu == "Automatic Evaluation Metrics":
         # st.write("You selected 'Automatic Evaluation Metrics'")
-
-        # st.write("You selected 'Automatic Evaluation Metrics'")
-        images_dir = "metrics_images"
-        if os.path.exists(images_dir):
-            for image_file in os.listdir(images_dir):
-                image_path = os.path.join(images_dir, image_file)
-                with open(image_path, "rb") as img_file:
-                    img_bytes = img_file.read()
-                    img_base64 = base64.b64encode(img_bytes).decode()
-                    st.markdown(
-                        f"<div style='display: flex; justify-content: center;'><img src='data:image/png;base64,{img_base64}' style='padding: 10px; border-radius: 10px; max-width: 100%; height: auto;'></div>",
-                        unsafe_allow_html=True,
-                    )
-        else:
-            st.error("Images folder not found")
+        display_images(
+            "metrics_images",
+            style="padding: 10px; border-radius: 10px; max-width: 100%; height: auto;",
+        )
 
     elif menu == "Language Models":
         # st.write("You selected 'Language Models'")
-        images_dir = "models_images"
-        if os.path.exists(images_dir):
-            for image_file in os.listdir(images_dir):
-                image_path = os.path.join(images_dir, image_file)
-                st.image(image_path, caption="")
-        else:
-            st.error("Images folder not found")
+        display_images("models_images")
     # elif menu == "Results and Findings":
     #     # st.write("You selected 'Results and Findings'")
     #     # Display images from the 'images' folder
@@ -289,7 +503,11 @@ if st.session_state["loggedin"]:
     elif menu == "Results and Findings":
         sub_menu = st.sidebar.selectbox(
             "Select Results Type",
-            ["Abstract Paraphrase Results", "Sentence Paraphrase Results"],
+            [
+                "Abstract Paraphrase Results",
+                "Summary Dashboard",
+                "Sentence Paraphrase Results",
+            ],
         )
 
         if sub_menu == "Abstract Paraphrase Results":
@@ -298,22 +516,55 @@ if st.session_state["loggedin"]:
                 unsafe_allow_html=True,
             )
             display_csv_files("abstract_para")
+        elif sub_menu == "Summary Dashboard":
+            st.markdown(
+                "<h1 style='text-align: center;'>Summary Dashboard</h1>",
+                unsafe_allow_html=True,
+            )
+            display_summary_dashboard()
         elif sub_menu == "Sentence Paraphrase Results":
             st.markdown(
                 "<h1 style='text-align: center;'>Sentence Paraphrase Results</h1>",
                 unsafe_allow_html=True,
             )
+            # Source sentences aligned to their paraphrased counterparts
+            st.subheader("Sentence Alignment")
+            col1, col2 = st.columns([3, 2])
+            with col1:
+                sentence_model = st.selectbox("Model", list(models.keys()))
+            with col2:
+                sentence_entry = st.number_input(
+                    "Entry", min_value=1, max_value=len(input_df), value=1
+                )
+            pairs = sentence_alignment.entry_pairs(
+                models[sentence_model], sentence_entry - 1
+            )
+            st.markdown(f"**Title:** {input_df['Title'].iloc[sentence_entry - 1]}")
+            for pair in pairs.itertuples():
+                col1, col2, col3 = st.columns([5, 5, 2])
+                with col1:
+                    st.markdown(f"**{pair.Source or '-'}** {pair.SourceText}")
+                with col2:
+                    st.markdown(f"**{pair.Paraphrase or '-'}** {pair.ParaphraseText}")
+                with col3:
+                    if pd.isna(pair.rouge1):
+                        st.caption("Unmatched")
+                    else:
+                        st.caption(f"BLEU {pair.bleu:.2f} | ROUGE-1 {pair.rouge1:.2f}")
+            sentence_summary = sentence_alignment.summary(models[sentence_model])
+            if sentence_summary is None:
+                st.caption("The sentence table of this model is being built...")
+            else:
+                st.dataframe(sentence_summary)
+                if st.checkbox("Show all sentence pairs"):
+                    display_paged_table(
+                        "csv", sentence_alignment.table_path(models[sentence_model])
+                    )
             display_images("results_images")
     elif menu == "Contact Us":
         # st.write("You selected 'Results and Findings'")
         # Display images from the 'images' folder
-        images_dir = "about_us"
-        if os.path.exists(images_dir):
-            for image_file in os.listdir(images_dir):
-                image_path = os.path.join(images_dir, image_file)
-                st.image(image_path, caption="")
-        else:
-            st.error("Images folder not found")
+        display_images("about_us")
 
     # Logout button in the top right corner
     if st.sidebar.button("Logout"):
@@ -321,6 +572,11 @@ if st.session_state["loggedin"]:
         st.session_state["username"] = ""
         st.experimental_rerun()
 
+    # Per-rerun timings for admins while profiling is on (PARAWEB_PROFILE=1)
+    profiling.end_rerun(menu)
+    if profiling.ENABLED and profiling.is_admin(username):
+        display_profiling_panel()
+
 
 # BERTScore, BLEU, ROUGE, METEOR, Google-BLEU (GLEU) and
 # T5-STSB
@@ -0,0 +1,302 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import metrics_pipeline
+import ngram_kernels
+import score_store
+import token_cache
+
+# Results of local runs, named by commit (machine specific, so gitignored;
+# compare a run against an earlier one with --baseline)
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+MODEL_FILES = ["gemini_15_pro.csv", "gpt_4o.csv", "llama3_70b.csv"]
+MODEL_NAMES = ["gemini 1.5 pro", "gpt-4o", "Llama3 70b"]
+LINKED = [
+    "metrics_images",
+    "models_images",
+    "results_images",
+    "about_us",
+    ".streamlit",
+    # Shared so resized image assets are not re-encoded for every size
+    "static",
+]
+USER = "bench"
+# Share of the entries each synthetic annotator has scored
+RATED_FRACTION = 0.2
+RERUNS = 5
+
+
+# Function to cycle the rows of a frame up to the requested size
+def grow(df, rows):
+    repeats = -(-rows // len(df))
+    return pd.concat([df] * repeats, ignore_index=True).head(rows)
+
+
+# Function to make cycled titles unique so every entry has its own key
+def unique_titles(titles, period):
+    return [
+        title if i < period else f"{title} [{i // period}]"
+        for i, title in enumerate(titles)
+    ]
+
+
+# Function to write a synthetic workspace of the given size next to the code
+def synthesize(workdir, size, annotators, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(workdir, exist_ok=True)
+    for name in os.listdir(REPO_DIR):
+        if name.endswith(".py") or name in LINKED:
+            os.symlink(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+
+    base = pd.read_csv(os.path.join(REPO_DIR, "input.csv"))
+    titles = unique_titles(grow(base, size)["Title"].tolist(), len(base))
+    input_df = grow(base, size).assign(Title=titles)
+    input_df.to_csv(os.path.join(workdir, "input.csv"), index=False)
+    for model_file in MODEL_FILES:
+        model_df = grow(pd.read_csv(os.path.join(REPO_DIR, model_file)), size)
+        model_df.assign(Title=titles).to_csv(
+            os.path.join(workdir, model_file), index=False
+        )
+
+    corpus = pd.read_csv(os.path.join(REPO_DIR, metrics_pipeline.CORPUS_FILE))
+    grow(corpus, size).assign(No=np.arange(1, size + 1)).to_csv(
+        os.path.join(workdir, metrics_pipeline.CORPUS_FILE), index=False
+    )
+    para_dir = os.path.join(workdir, "abstract_para")
+    os.makedirs(para_dir)
+    source_dir = os.path.join(REPO_DIR, "abstract_para")
+    for csv_name in os.listdir(source_dir):
+        if csv_name.endswith(".csv"):
+            df = grow(pd.read_csv(os.path.join(source_dir, csv_name)), size)
+            if "No" in df.columns:
+                df["No"] = np.arange(1, size + 1)
+            df.to_csv(os.path.join(para_dir, csv_name), index=False)
+
+    h_evals_dir = os.path.join(workdir, score_store.H_EVALS_DIR)
+    os.makedirs(h_evals_dir)
+    rated = max(1, int(size * RATED_FRACTION))
+    for k in range(annotators):
+        for model in MODEL_NAMES:
+            rows = rng.choice(size, rated, replace=False)
+            scores = pd.DataFrame(
+                rng.integers(1, 6, (rated, 4)), columns=score_store.SCORE_COLUMNS[1:]
+            )
+            scores.insert(0, "Title", [titles[row] for row in rows])
+            scores.to_csv(
+                score_store.scores_path(f"annotator{k}", model, h_evals_dir),
+                index=False,
+            )
+
+    pd.DataFrame({"username": [USER], "password": ["bench"]}).to_csv(
+        os.path.join(workdir, "users.csv"), index=False
+    )
+
+
+# Function to time a callable once
+def timed(action):
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+# Function to time the first run of a page and the median of its reruns
+def time_page(at, reruns=RERUNS):
+    cold = timed(at.run)
+    warm = statistics.median(timed(at.run) for _ in range(reruns))
+    if at.exception:
+        raise RuntimeError([e.message for e in at.exception])
+    return cold, warm
+
+
+# Function to time page reruns and Save Scores through Streamlit's AppTest
+def bench_pages(app, reruns=RERUNS):
+    from streamlit.testing.v1 import AppTest
+
+    results = {}
+    at = AppTest.from_file(app, default_timeout=600)
+    at.session_state["loggedin"] = True
+    at.session_state["username"] = USER
+    at.session_state["entry_index"] = 0
+    results["human_evaluation"] = time_page(at, reruns)
+
+    next_button = [b for b in at.button if b.label == "Next Entry"][0]
+    results["next_entry"] = (
+        timed(lambda: next_button.click().run()),
+        statistics.median(
+            timed(
+                lambda: [b for b in at.button if b.label == "Next Entry"][0]
+                .click()
+                .run()
+            )
+            for _ in range(reruns)
+        ),
+    )
+    results["save_scores"] = (
+        timed(
+            lambda: [b for b in at.button if b.label == "Save Scores"][0].click().run()
+        ),
+        statistics.median(
+            timed(
+                lambda: [b for b in at.button if b.label == "Save Scores"][0]
+                .click()
+                .run()
+            )
+            for _ in range(reruns)
+        ),
+    )
+
+    at.sidebar.radio[0].set_value("Results and Findings")
+    results["abstract_results"] = time_page(at, reruns)
+    sub_menu = [s for s in at.sidebar.selectbox if s.label == "Select Results Type"][0]
+    sub_menu.set_value("Summary Dashboard")
+    results["summary_dashboard"] = time_page(at, reruns)
+
+    at.sidebar.radio[0].set_value("Automatic Evaluation Metrics")
+    results["image_page"] = time_page(at, reruns)
+    return results
+
+
+# Function to time score appends directly (without the page around them)
+def bench_save(samples=50):
+    times = []
+    for i in range(samples):
+        scores = dict(zip(score_store.SCORE_COLUMNS[1:], [3, 3, 3, 3]))
+        times.append(
+            timed(lambda: score_store.save_scores(USER, "gpt-4o", f"bench {i}", scores))
+        )
+    return statistics.median(times), max(times)
+
+
+# Function to measure metric throughput on the synthetic corpus
+def bench_metrics(size, workers, pipeline_rows=2000):
+    df = pd.read_csv(metrics_pipeline.CORPUS_FILE)
+    results = {}
+    build = timed(lambda: token_cache.load(metrics_pipeline.CORPUS_FILE))
+    results["token_cache_build"] = (build, size / build)
+    tokens = token_cache.load(metrics_pipeline.CORPUS_FILE)
+    kernels = timed(lambda: ngram_kernels.corpus_scores(df, tokens=tokens))
+    results["ngram_kernels"] = (kernels, size / kernels)
+    subset = df.head(pipeline_rows)
+    pipeline = timed(
+        lambda: metrics_pipeline.compute_scores(subset, workers=workers, tokens=tokens)
+    )
+    results["metrics_pipeline"] = (pipeline, len(subset) / pipeline)
+    return results
+
+
+# Function to get the commit being benchmarked
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+# Function to print the change of every shared benchmark against a baseline
+def compare(baseline_path, results):
+    with open(baseline_path) as f:
+        baseline = {
+            (r["benchmark"], r["size"]): r["seconds"] for r in json.load(f)["results"]
+        }
+    print("benchmark,size,baseline_s,current_s,ratio")
+    for r in results:
+        old = baseline.get((r["benchmark"], r["size"]))
+        if old:
+            print(
+                f"{r['benchmark']},{r['size']},{old:.4f},{r['seconds']:.4f},"
+                f"{r['seconds'] / old:.2f}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app and metrics")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--annotators", type=int, default=5)
+    parser.add_argument("--app", default="app.py")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--reruns", type=int, default=RERUNS)
+    parser.add_argument("--skip-app", action="store_true")
+    parser.add_argument("--out", default=None, help="results json path")
+    parser.add_argument(
+        "--baseline",
+        default=None,
+        help="results json of an earlier run, e.g. benchmarks/results/<commit>.json",
+    )
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = []
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f"paraweb_bench_{size}_")
+        started = os.getcwd()
+        try:
+            synthesize(workdir, size, args.annotators)
+            os.chdir(workdir)
+            timings = {}
+            if not args.skip_app:
+                pages = bench_pages(os.path.join(workdir, args.app), args.reruns)
+                for page, (cold, warm) in pages.items():
+                    timings[f"{page}_cold"] = (cold, None)
+                    timings[f"{page}_warm"] = (warm, None)
+            median, worst = bench_save()
+            timings["save_scores_direct"] = (median, None)
+            timings["save_scores_direct_max"] = (worst, None)
+            timings.update(bench_metrics(size, args.workers))
+        finally:
+            os.chdir(started)
+            shutil.rmtree(workdir, ignore_errors=True)
+        for benchmark, (seconds, per_second) in timings.items():
+            result = {
+                "benchmark": benchmark,
+                "size": size,
+                "annotators": args.annotators,
+                "seconds": round(seconds, 6),
+            }
+            if per_second is not None:
+                result["rows_per_second"] = round(per_second, 1)
+            results.append(result)
+            print(json.dumps(result))
+
+    out = args.out or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "results": results,
+            },
+            f,
+            indent=1,
+        )
+    print(out)
+    if args.baseline:
+        compare(args.baseline, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics_pipeline
+import ngram_kernels
+
+KERNEL_METRICS = ["bleu", "brevity_penalty", "google_bleu", "rouge1", "rouge2"]
+
+
+# Function to score the kernel metrics pair by pair with metrics_pipeline
+def reference_scores(df):
+    suffixes = metrics_pipeline.model_suffixes(df)
+    rows = []
+    for _, row in df.iterrows():
+        ref = metrics_pipeline.prepare(row["Abstract"])
+        scores = {}
+        for suffix in suffixes:
+            hyp = metrics_pipeline.prepare(row[f"Abstract_{suffix}"])
+            matches = metrics_pipeline.clipped_matches(ref[1], hyp[1])
+            bleu, brevity_penalty = metrics_pipeline.bleu(ref, hyp, matches)
+            rouge1, rouge2, _ = metrics_pipeline.rouge(ref, hyp, matches)
+            values = {
+                "bleu": bleu,
+                "brevity_penalty": brevity_penalty,
+                "google_bleu": metrics_pipeline.google_bleu(ref, hyp, matches),
+                "rouge1": rouge1,
+                "rouge2": rouge2,
+            }
+            for metric in KERNEL_METRICS:
+                scores[f"{metric}_{suffix}"] = round(values[metric], 4)
+        rows.append(scores)
+    return pd.DataFrame(rows, index=df.index)
+
+
+# Function to grow the corpus to the requested number of rows
+def synthesize(df, rows):
+    repeats = -(-rows // len(df))
+    return pd.concat([df] * repeats, ignore_index=True).head(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark n-gram kernels")
+    parser.add_argument("--corpus", default=metrics_pipeline.CORPUS_FILE)
+    parser.add_argument("--rows", type=int, nargs="+", default=[200, 2000, 10000])
+    args = parser.parse_args()
+
+    base = pd.read_csv(args.corpus)
+    print("rows,reference_s,kernel_s,speedup,max_abs_diff")
+    for rows in args.rows:
+        df = synthesize(base, rows)
+        start = time.perf_counter()
+        expected = reference_scores(df)
+        reference_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = ngram_kernels.corpus_scores(df)[expected.columns]
+        kernel_time = time.perf_counter() - start
+
+        diff = float(np.abs(actual.to_numpy() - expected.to_numpy()).max())
+        print(
+            f"{rows},{reference_time:.3f},{kernel_time:.3f},"
+            f"{reference_time / kernel_time:.1f},{diff:.6f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
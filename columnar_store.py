@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+
+import pandas as pd
+
+import corpus_store
+
+CORPUS_FILE = "cleaned_abstracts_by_row.csv"
+CSV_DIR = "abstract_para"
+STORE_DIR = "columnar"
+
+TEXTS_TABLE = "texts"
+TEXT_COLUMNS = ["Title", "Abstract"]
+KEY = "No"
+
+# Schema metadata key holding the original csv name and column order
+LAYOUT_KEY = b"paraweb.layout"
+
+# Opened tables, keyed by path, with the file key they were read at
+_tables = {}
+_lock = threading.Lock()
+
+
+# Function to check whether a column holds abstract/title text
+def is_text_column(column):
+    return column in TEXT_COLUMNS or column.startswith("Abstract_")
+
+
+# Function to turn a csv file name into a table name
+def table_name(csv_name):
+    stem = os.path.splitext(csv_name)[0]
+    return stem.replace(" (1)", "").replace(" ", "_")
+
+
+# Function to get the path of a stored table (Arrow IPC, memory-mappable)
+def table_path(name, store_dir=STORE_DIR):
+    return os.path.join(store_dir, f"{name}.arrow")
+
+
+# Function to write a frame as an uncompressed Arrow file with its csv layout
+def write_table(df, name, layout, store_dir=STORE_DIR):
+    import pyarrow as pa
+    import pyarrow.feather as feather
+
+    os.makedirs(store_dir, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[LAYOUT_KEY] = json.dumps(layout).encode("utf-8")
+    table = table.replace_schema_metadata(metadata)
+    path = table_path(name, store_dir)
+    # Uncompressed so reads can map the file instead of decoding it
+    feather.write_feather(table, path + ".tmp", compression="uncompressed")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+# Function to open a stored table through a memory map, once per file version
+# (the file is closed after reading; the table's buffers keep the mapping alive)
+def _open(name, store_dir=STORE_DIR):
+    import pyarrow as pa
+
+    path = os.path.abspath(table_path(name, store_dir))
+    key = corpus_store.file_key(path)
+    with _lock:
+        cached = _tables.get(path)
+        if cached is None or cached[0] != key:
+            with pa.memory_map(path, "r") as source:
+                cached = (key, pa.ipc.open_file(source).read_all())
+            _tables[path] = cached
+    return cached[1]
+
+
+# Function to list the metric tables in the store
+def list_tables(store_dir=STORE_DIR):
+    if not os.path.exists(store_dir):
+        return []
+    return sorted(
+        os.path.splitext(f)[0]
+        for f in os.listdir(store_dir)
+        if f.endswith(".arrow") and f != f"{TEXTS_TABLE}.arrow"
+    )
+
+
+# Function to check whether the store has been built
+def available(store_dir=STORE_DIR):
+    return os.path.exists(table_path(TEXTS_TABLE, store_dir))
+
+
+# Function to read the stored csv layout of a table
+def layout(name, store_dir=STORE_DIR):
+    import pyarrow as pa
+
+    with pa.memory_map(table_path(name, store_dir), "r") as source:
+        schema = pa.ipc.open_file(source).schema
+    return json.loads(schema.metadata[LAYOUT_KEY])
+
+
+# Function to get the metric columns of a table without reading any data
+def metric_columns(name, store_dir=STORE_DIR):
+    return [
+        c
+        for c in layout(name, store_dir)["columns"]
+        if c != KEY and not is_text_column(c)
+    ]
+
+
+# Function to read selected columns of a table, joining texts on No if needed
+def load_table(name, columns=None, store_dir=STORE_DIR):
+    table = _open(name, store_dir)
+    if columns is None:
+        columns = layout(name, store_dir)["columns"]
+    own = [c for c in columns if c in table.column_names]
+    texts = [c for c in columns if c not in table.column_names]
+    if KEY not in own:
+        own = [KEY] + own
+    df = table.select(own).to_pandas()
+    if texts:
+        text_df = _open(TEXTS_TABLE, store_dir).select([KEY] + texts).to_pandas()
+        df = df.merge(text_df, on=KEY, how="left")
+    return df[[c for c in columns if c in df.columns]]
+
+
+# Function to convert the corpus and every abstract_para csv into the store
+def convert_csvs(corpus_file=CORPUS_FILE, csv_dir=CSV_DIR, store_dir=STORE_DIR):
+    corpus = pd.read_csv(corpus_file)
+    texts = corpus[[KEY] + [c for c in corpus.columns if is_text_column(c)]]
+    write_table(
+        texts,
+        TEXTS_TABLE,
+        {"csv": os.path.basename(corpus_file), "columns": list(corpus)},
+        store_dir,
+    )
+
+    written = []
+    for csv_name in sorted(f for f in os.listdir(csv_dir) if f.endswith(".csv")):
+        df = pd.read_csv(os.path.join(csv_dir, csv_name))
+        metrics = df[[KEY] + [c for c in df.columns if not is_text_column(c)]]
+        metrics = metrics.loc[:, ~metrics.columns.duplicated()]
+        name = table_name(csv_name)
+        write_table(
+            metrics, name, {"csv": csv_name, "columns": list(df.columns)}, store_dir
+        )
+        written.append(name)
+    return written
+
+
+# Function to export a table back to its original csv layout
+def export_csv(name, out_dir=CSV_DIR, store_dir=STORE_DIR):
+    table_layout = layout(name, store_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, table_layout["csv"])
+    load_table(name, table_layout["columns"], store_dir).to_csv(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    for name in convert_csvs():
+        print(table_path(name))
@@ -0,0 +1,325 @@
+import argparse
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+
+import alignment_index
+import corpus_store
+import score_store
+
+DB_FILE = os.path.join(corpus_store.CACHE_DIR, "coordinator.db")
+INPUT_FILE = alignment_index.INPUT_FILE
+
+# Number of ratings wanted for each (model, entry) item
+TARGET_RATINGS = int(os.environ.get("PARAWEB_TARGET_RATINGS", "2"))
+# Seconds an evaluator may hold an item before it is handed to someone else
+LEASE_SECONDS = 15 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    model TEXT NOT NULL,
+    entry INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    ratings INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (model, entry)
+);
+CREATE TABLE IF NOT EXISTS ratings (
+    annotator TEXT NOT NULL,
+    model TEXT NOT NULL,
+    entry INTEGER NOT NULL,
+    PRIMARY KEY (annotator, model, entry)
+);
+CREATE TABLE IF NOT EXISTS leases (
+    annotator TEXT NOT NULL,
+    model TEXT NOT NULL,
+    entry INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (model, entry, annotator)
+);
+CREATE INDEX IF NOT EXISTS items_by_coverage ON items (model, ratings, entry);
+CREATE INDEX IF NOT EXISTS leases_by_annotator ON leases (annotator, expires);
+"""
+
+# One connection per database for the whole process, used under its lock
+# (Streamlit runs every rerun on a new thread, so per-thread connections leak)
+_connections = {}
+_connections_lock = threading.Lock()
+# File keys of the input file and of every scores file at the last sync,
+# per (db, models)
+_synced = {}
+_synced_lock = threading.Lock()
+
+
+# Function to hold the process's connection to the coordinator database
+# (operations of this process run one at a time; other processes are kept
+# apart by SQLite's own locking)
+@contextlib.contextmanager
+def connect(db_file=DB_FILE):
+    with _connections_lock:
+        entry = _connections.get(db_file)
+        if entry is None:
+            os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+            connection = sqlite3.connect(
+                db_file, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            # WAL lets sessions read while another one holds the write lock
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            entry = _connections[db_file] = (connection, threading.RLock())
+    with entry[1]:
+        yield entry[0]
+
+
+# Function to run statements in one write transaction
+# (BEGIN IMMEDIATE takes the write lock up front, so claims never interleave)
+def _transaction(db_file, work):
+    with connect(db_file) as connection:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = work(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+
+# Function to read which entries a scores file rated, as (annotator, model,
+# entry) rows (none when its model is not coordinated or it cannot be read)
+def _rated(path, models):
+    annotator, model = score_store.parse_scores_file(path)
+    if model not in models:
+        return []
+    try:
+        df = score_store.read_scores_file(path)
+    except ValueError:
+        return []
+    rated = []
+    for title in df["Title"]:
+        rows = alignment_index.find_title(title)
+        if rows:
+            rated.append((annotator, model, rows[0]))
+    return rated
+
+
+# Function to register every input entry as an item for the given models
+# and record the ratings already present in H_Evals
+def sync(models, db_file=DB_FILE, h_evals_dir=score_store.H_EVALS_DIR):
+    titles = corpus_store.load_csv(INPUT_FILE)["Title"].tolist()
+    rated = []
+    for path in score_store.list_scores_files(h_evals_dir):
+        rated += _rated(path, models)
+
+    def work(connection):
+        connection.executemany(
+            "INSERT OR IGNORE INTO items (model, entry, title) VALUES (?, ?, ?)",
+            [
+                (model, entry, title)
+                for model in models
+                for entry, title in enumerate(titles)
+            ],
+        )
+        connection.executemany(
+            "INSERT OR IGNORE INTO ratings (annotator, model, entry) VALUES (?, ?, ?)",
+            rated,
+        )
+        connection.execute(
+            "UPDATE items SET ratings = (SELECT COUNT(*) FROM ratings r "
+            "WHERE r.model = items.model AND r.entry = items.entry)"
+        )
+
+    _transaction(db_file, work)
+    return len(rated)
+
+
+# Function to record the ratings of the given scores files, counting only the
+# ones not recorded yet (e.g. saved by another app process)
+def _record(models, paths, db_file=DB_FILE):
+    rated = [row for path in paths for row in _rated(path, models)]
+
+    def work(connection):
+        for annotator, model, entry in rated:
+            if connection.execute(
+                "INSERT OR IGNORE INTO ratings (annotator, model, entry) "
+                "VALUES (?, ?, ?)",
+                (annotator, model, entry),
+            ).rowcount:
+                connection.execute(
+                    "UPDATE items SET ratings = ratings + 1 "
+                    "WHERE model = ? AND entry = ?",
+                    (model, entry),
+                )
+
+    _transaction(db_file, work)
+
+
+# Function to bring the coordinator up to date with the files: a full sync when
+# the input file changed, otherwise only the scores files that changed since the
+# last call are read (the app's own saves are already recorded by complete())
+def ensure_synced(models, db_file=DB_FILE, h_evals_dir=score_store.H_EVALS_DIR):
+    key = (db_file, tuple(models))
+    input_key = corpus_store.file_key(INPUT_FILE)
+    files = {
+        path: corpus_store.file_key(path)
+        for path in score_store.list_scores_files(h_evals_dir)
+    }
+    with _synced_lock:
+        synced = _synced.get(key)
+        if synced is None or synced[0] != input_key:
+            sync(models, db_file, h_evals_dir)
+        else:
+            changed = [path for path, k in files.items() if synced[1].get(path) != k]
+            if changed:
+                _record(models, changed, db_file)
+        _synced[key] = (input_key, files)
+
+
+# Function to check whether an annotator may take an item: not rated by them and
+# its ratings plus live leases still below the limit
+def _is_free(connection, annotator, model, entry, limit):
+    row = connection.execute(
+        "SELECT i.ratings + (SELECT COUNT(*) FROM leases l "
+        "WHERE l.model = i.model AND l.entry = i.entry) FROM items i "
+        "WHERE i.model = ? AND i.entry = ? AND NOT EXISTS (SELECT 1 FROM ratings r "
+        "WHERE r.annotator = ? AND r.model = i.model AND r.entry = i.entry)",
+        (model, entry, annotator),
+    ).fetchone()
+    return row is not None and row[0] < limit
+
+
+# Function to pick the first of the sampler's candidates an annotator may take
+# (entries nobody else holds come first, as held items count against the limit,
+# so annotators spread out before doubling up)
+def _first_free(connection, annotator, model, ranked):
+    for spread in (True, False):
+        for entry, limit, rated in ranked:
+            if spread:
+                limit = min(limit, rated + 1)
+            if _is_free(connection, annotator, model, entry, limit):
+                return model, entry
+    return None
+
+
+# Function to lease the next item for an annotator, or None when all is done
+# (items with the fewest ratings plus live leases are handed out first, unless a
+# sampling strategy of the given model decides the order)
+def claim(
+    annotator,
+    model=None,
+    target=TARGET_RATINGS,
+    lease_seconds=LEASE_SECONDS,
+    db_file=DB_FILE,
+    strategy=None,
+):
+    now = time.time()
+    ranked = None
+    if strategy is not None and model is not None:
+        import sampling
+
+        # The sampler runs before the write lock is taken; inside the
+        # transaction its candidates are only checked against leases and counts
+        if sampling.STRATEGIES[strategy] is not None:
+            ranked = sampling.candidates(model, strategy, target, annotator)
+
+    def work(connection):
+        connection.execute("DELETE FROM leases WHERE expires <= ?", (now,))
+        # An annotator keeps the item they already hold until it is saved
+        held = connection.execute(
+            "SELECT model, entry FROM leases WHERE annotator = ? "
+            "AND (? IS NULL OR model = ?) ORDER BY expires LIMIT 1",
+            (annotator, model, model),
+        ).fetchone()
+        if held is None and ranked:
+            held = _first_free(connection, annotator, model, ranked)
+        # With no candidate free (or no strategy), the fewest ratings go first
+        if held is None:
+            held = connection.execute(
+                "SELECT i.model, i.entry FROM items i "
+                "LEFT JOIN (SELECT model, entry, COUNT(*) AS n FROM leases "
+                "GROUP BY model, entry) l "
+                "ON l.model = i.model AND l.entry = i.entry "
+                "WHERE (? IS NULL OR i.model = ?) "
+                "AND i.ratings + IFNULL(l.n, 0) < ? "
+                "AND NOT EXISTS (SELECT 1 FROM ratings r WHERE r.annotator = ? "
+                "AND r.model = i.model AND r.entry = i.entry) "
+                "ORDER BY i.ratings + IFNULL(l.n, 0), i.entry, i.model LIMIT 1",
+                (model, model, target, annotator),
+            ).fetchone()
+            if held is None:
+                return None
+        connection.execute(
+            "INSERT OR REPLACE INTO leases (annotator, model, entry, expires) "
+            "VALUES (?, ?, ?, ?)",
+            (annotator, held[0], held[1], now + lease_seconds),
+        )
+        return held[0], held[1]
+
+    return _transaction(db_file, work)
+
+
+# Function to record a saved rating and drop the annotator's lease on it
+def complete(annotator, model, entry, db_file=DB_FILE):
+    def work(connection):
+        inserted = connection.execute(
+            "INSERT OR IGNORE INTO ratings (annotator, model, entry) VALUES (?, ?, ?)",
+            (annotator, model, entry),
+        ).rowcount
+        connection.execute(
+            "UPDATE items SET ratings = ratings + ? WHERE model = ? AND entry = ?",
+            (inserted, model, entry),
+        )
+        connection.execute(
+            "DELETE FROM leases WHERE annotator = ? AND model = ? AND entry = ?",
+            (annotator, model, entry),
+        )
+
+    _transaction(db_file, work)
+
+
+# Function to give an item back without rating it
+def release(annotator, model, entry, db_file=DB_FILE):
+    with connect(db_file) as connection:
+        connection.execute(
+            "DELETE FROM leases WHERE annotator = ? AND model = ? AND entry = ?",
+            (annotator, model, entry),
+        )
+
+
+# Function to report per-model coverage: items, items at target, live leases
+def progress(target=TARGET_RATINGS, db_file=DB_FILE):
+    with connect(db_file) as connection:
+        rows = connection.execute(
+            "SELECT model, COUNT(*), SUM(ratings >= ?), SUM(ratings) FROM items "
+            "GROUP BY model ORDER BY model",
+            (target,),
+        ).fetchall()
+        leases = dict(
+            connection.execute(
+                "SELECT model, COUNT(*) FROM leases WHERE expires > ? GROUP BY model",
+                (time.time(),),
+            ).fetchall()
+        )
+    return [
+        {
+            "model": model,
+            "items": items,
+            "complete": done or 0,
+            "ratings": ratings or 0,
+            "leased": leases.get(model, 0),
+        }
+        for model, items, done, ratings in rows
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluation work coordinator")
+    parser.add_argument("models", nargs="+", help="model names, e.g. gpt-4o")
+    parser.add_argument("--db", default=DB_FILE)
+    args = parser.parse_args()
+
+    print(f"{sync(args.models, args.db)} existing ratings recorded")
+    for row in progress(db_file=args.db):
+        print(row)
@@ -0,0 +1,509 @@
+import hashlib
+import html
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import alignment_index
+import corpus_store
+import profiling
+import token_cache
+
+INPUT_FILE = alignment_index.INPUT_FILE
+INDEX_FILE = os.path.join(corpus_store.CACHE_DIR, "copy_index.npz")
+# Per paraphrase copy statistics, browsable like the other csv tables
+REPORT_FILE = os.path.join(corpus_store.CACHE_DIR, "copy_report.csv")
+
+# Copied text is found as shared runs of SHINGLE consecutive tokens
+SHINGLE = 5
+# MinHash signature length, split into BANDS bands for locality-sensitive hashing
+# (two documents become candidates if any band matches, which is likely above
+# about (1 / BANDS) ** (1 / rows per band) = 0.5 Jaccard similarity)
+NUM_PERM = 64
+BANDS = 16
+# Largest bucket walked when pairing documents (limits degenerate buckets)
+MAX_BUCKET = 32
+# Document pairs compared exactly at once
+CHUNK_PAIRS = 4096
+# Bump whenever the statistics or the index layout change
+VERSION = "1"
+
+# Reports with a copied span at least this long are flagged in the viewer
+FLAG_SPAN = 12
+
+_BIN_BITS = NUM_PERM.bit_length() - 1
+_DENSIFY_STEP = np.uint32(0x9E3779B1)
+_rng = np.random.default_rng(20240517)
+_BAND_MULT = _rng.integers(1, 2**63, NUM_PERM // BANDS, dtype=np.uint64) | np.uint64(1)
+
+# Loaded index, keyed by the files it was built from
+_index = {}
+_lock = threading.Lock()
+# Thread rebuilding a stale index for the app
+_builder = None
+
+
+# Function to scramble 64-bit integers (splitmix64 finalizer)
+def _mix(x):
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+# Function to collect the documents: every source abstract, then each model's
+# paraphrase of it ("" when the model has no row for that title)
+def collect_documents(models, input_path=INPUT_FILE):
+    input_df = corpus_store.load_csv(input_path)
+    texts = input_df["Abstract"].tolist()
+    labels = ["source"]
+    for name, path in models.items():
+        offsets = np.asarray(alignment_index.get_index(path, input_path)["offsets"])
+        paraphrases = corpus_store.load_csv(path)["ParaphrasedAbstract"].to_numpy()
+        aligned = np.where(
+            offsets >= 0, paraphrases[np.maximum(offsets, 0)], ""
+        ).tolist()
+        texts += aligned
+        labels.append(name)
+    return input_df["Title"].tolist(), labels, texts
+
+
+# Function to give every run of SHINGLE tokens an exact id shared by all documents
+# (returns the shingle ids with their document and start position in the document)
+def shingle_ids(ids, lengths):
+    docs = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.concatenate([[0], np.cumsum(lengths)])[:-1]
+    positions = np.arange(len(ids)) - starts[docs]
+    size = len(ids) - SHINGLE + 1
+    if size <= 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, 0
+    # A shingle starting at i exists if it ends inside the same document
+    valid = positions[:size] + SHINGLE <= lengths[docs[:size]]
+    current = ids[:size].astype(np.int64)
+    types = int(ids.max()) + 1 if len(ids) else 1
+    for n in range(1, SHINGLE):
+        keys = current[valid] * types + ids[n : n + size][valid]
+        dense, uniques = pd.factorize(keys)
+        current = np.zeros(size, dtype=np.int64)
+        current[valid] = dense
+        types = len(uniques)
+    return current[valid], docs[:size][valid], positions[:size][valid], types
+
+
+# Function to hash the shingles by their text, so signatures stay comparable
+# between separately built tables (the dense shingle ids are not)
+def shingle_hashes(ids, vocab, starts):
+    token_hashes = np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(t.encode(), digest_size=8).digest(), "little"
+            )
+            for t in vocab
+        ],
+        dtype=np.uint64,
+    )[ids]
+    hashed = np.zeros(len(starts), dtype=np.uint64)
+    for n in range(SHINGLE):
+        hashed = _mix(hashed * np.uint64(0x100000001B3) + token_hashes[starts + n])
+    return hashed
+
+
+# Function to compute the MinHash signature of every document with one
+# permutation hashing: each shingle hash falls into one of NUM_PERM bins by its
+# top bits and a bin keeps its smallest value, so signing costs one pass over
+# the shingles instead of NUM_PERM passes
+# (empty bins borrow the next filled bin, shifted by the distance, and documents
+# shorter than one shingle keep the all-max signature)
+def signatures(hashed, docs, n_docs):
+    empty = np.iinfo(np.uint32).max
+    sig = np.full(n_docs * NUM_PERM, empty, dtype=np.uint32)
+    if not len(hashed):
+        return sig.reshape(n_docs, NUM_PERM)
+    bins = (hashed >> np.uint64(64 - _BIN_BITS)).astype(np.int64)
+    values = ((hashed >> np.uint64(32 - _BIN_BITS)) & np.uint64(empty)).astype(
+        np.uint32
+    )
+    np.minimum.at(sig, docs * NUM_PERM + bins, values)
+    sig = sig.reshape(n_docs, NUM_PERM)
+
+    filled = sig != empty
+    positions = np.arange(NUM_PERM)
+    nearest = np.where(filled, positions, 2 * NUM_PERM)
+    nearest = np.concatenate([nearest, nearest + NUM_PERM], axis=1)
+    nearest = np.minimum.accumulate(nearest[:, ::-1], axis=1)[:, ::-1][:, :NUM_PERM]
+    has_any = filled.any(axis=1)
+    rows = np.flatnonzero(has_any)
+    source = nearest[rows] % NUM_PERM
+    distance = (nearest[rows] - positions).astype(np.uint32)
+    sig[rows] = np.take_along_axis(sig[rows], source, axis=1) + distance * _DENSIFY_STEP
+    return sig
+
+
+# Function to hash each band of the signatures into one bucket key
+def band_keys(sig):
+    rows = NUM_PERM // BANDS
+    bands = sig.reshape(len(sig), BANDS, rows).astype(np.uint64)
+    return _mix((bands * _BAND_MULT).sum(axis=2) + np.arange(BANDS, dtype=np.uint64))
+
+
+# Function to find every document pair sharing an LSH bucket in some band
+# (pairs come from neighbours in each band's sorted order, so no bucket is
+# enumerated pair by pair)
+def candidate_pairs(keys, active):
+    pairs = []
+    for b in range(BANDS):
+        order = np.flatnonzero(active)
+        order = order[np.argsort(keys[order, b], kind="stable")]
+        sorted_keys = keys[order, b]
+        for shift in range(1, min(MAX_BUCKET, len(order))):
+            same = sorted_keys[shift:] == sorted_keys[:-shift]
+            if not same.any():
+                break
+            pairs.append(np.stack([order[:-shift][same], order[shift:][same]], 1))
+    if not pairs:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    n_docs = len(keys)
+    pairs = np.unique(pairs[:, 0] * n_docs + pairs[:, 1])
+    return np.stack([pairs // n_docs, pairs % n_docs], 1)
+
+
+# Function to estimate the Jaccard similarity of document pairs from signatures
+def estimate_similarity(sig, pairs):
+    return np.concatenate(
+        [
+            (sig[chunk[:, 0]] == sig[chunk[:, 1]]).mean(axis=1)
+            for chunk in np.array_split(pairs, max(len(pairs) // CHUNK_PAIRS, 1))
+        ]
+    )
+
+
+# Function to gather the entries of a per-document segment for several documents
+def _gather(starts, counts, docs):
+    counts = counts[docs]
+    total = int(counts.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    owner = np.repeat(np.arange(len(docs)), counts)
+    first = np.concatenate([[0], np.cumsum(counts)])[:-1]
+    return starts[docs][owner] + np.arange(total) - first[owner], owner
+
+
+# Function to measure how much of each query document is copied from its
+# reference: the share of its tokens inside a shared shingle and the longest
+# run of such tokens (the longest copied span)
+def copy_stats(table, queries, references):
+    lengths = table["lengths"]
+    ratio = np.zeros(len(queries))
+    span = np.zeros(len(queries), dtype=np.int64)
+    for lo in range(0, len(queries), CHUNK_PAIRS):
+        q = queries[lo : lo + CHUNK_PAIRS]
+        r = references[lo : lo + CHUNK_PAIRS]
+        q_at, q_pair = _gather(table["sh_starts"], table["sh_counts"], q)
+        r_at, r_pair = _gather(table["sh_starts"], table["sh_counts"], r)
+        types = table["types"]
+        q_keys = q_pair * types + table["shingles"][q_at]
+        r_keys = np.sort(r_pair * types + table["shingles"][r_at])
+        found = np.minimum(np.searchsorted(r_keys, q_keys), max(len(r_keys) - 1, 0))
+        shared = r_keys[found] == q_keys if len(r_keys) else q_keys < 0
+
+        # Mark the tokens of every shared shingle with a difference array
+        token_counts = lengths[q]
+        offsets = np.concatenate([[0], np.cumsum(token_counts)])
+        marks = np.zeros(offsets[-1] + 1, dtype=np.int64)
+        hits = offsets[q_pair[shared]] + table["positions"][q_at[shared]]
+        np.add.at(marks, hits, 1)
+        np.add.at(marks, hits + SHINGLE, -1)
+        covered = np.cumsum(marks)[:-1] > 0
+
+        owner = np.repeat(np.arange(len(q)), token_counts)
+        copied = np.bincount(owner, weights=covered, minlength=len(q))
+        ratio[lo : lo + len(q)] = np.divide(
+            copied,
+            token_counts,
+            out=np.zeros(len(q)),
+            where=token_counts > 0,
+        )
+
+        # Run length = distance to the last uncovered token (or document start)
+        t = np.arange(len(covered))
+        resets = np.where(covered, -1, t)
+        resets[offsets[:-1][token_counts > 0]] = np.maximum(
+            resets[offsets[:-1][token_counts > 0]],
+            offsets[:-1][token_counts > 0] - 1,
+        )
+        runs = t - np.maximum.accumulate(resets) if len(t) else t
+        longest = np.zeros(len(q), dtype=np.int64)
+        np.maximum.at(longest, owner, runs)
+        span[lo : lo + len(q)] = longest
+    return ratio, span
+
+
+# Function to tokenize the documents and compute everything the index keeps
+def build_table(texts):
+    ids, lengths, vocab = token_cache.encode(texts)
+    shingles, docs, positions, types = shingle_ids(ids, lengths)
+    sh_counts = np.bincount(docs, minlength=len(lengths))
+    token_starts = np.concatenate([[0], np.cumsum(lengths)])[:-1]
+    hashed = shingle_hashes(ids, vocab, token_starts[docs] + positions)
+    return {
+        "lengths": lengths,
+        "shingles": shingles,
+        "positions": positions,
+        "sh_counts": sh_counts,
+        "sh_starts": np.concatenate([[0], np.cumsum(sh_counts)])[:-1],
+        "types": max(types, 1),
+        "sig": signatures(hashed, docs, len(lengths)),
+    }
+
+
+# Function to build the copy report for every model paraphrase
+def build(models, input_path=INPUT_FILE):
+    titles, labels, texts = collect_documents(models, input_path)
+    n = len(titles)
+    table = build_table(texts)
+    n_docs = len(texts)
+    keys = band_keys(table["sig"])
+
+    # Paraphrase against its own source abstract
+    queries = np.arange(n, n_docs)
+    own_source = queries % n
+    source_ratio, source_span = copy_stats(table, queries, own_source)
+
+    # Most similar other document among the LSH candidates
+    pairs = candidate_pairs(keys, table["sh_counts"] > 0)
+    similarity = estimate_similarity(table["sig"], pairs) if len(pairs) else []
+    src = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    dst = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    similarity = np.concatenate([similarity, similarity])
+    keep = (src >= n) & (dst != src % n)
+    src, dst, similarity = src[keep], dst[keep], similarity[keep]
+    order = np.lexsort([-similarity, src])
+    best_src, first = np.unique(src[order], return_index=True)
+    best_dst = dst[order][first]
+    nearest_ratio, nearest_span = copy_stats(table, best_src, best_dst)
+
+    nearest = np.full(n_docs, -1)
+    nearest[best_src] = best_dst
+    near_similarity = np.zeros(n_docs)
+    near_similarity[best_src] = similarity[order][first]
+    near_ratio = np.zeros(n_docs)
+    near_ratio[best_src] = nearest_ratio
+    near_span = np.zeros(n_docs, dtype=np.int64)
+    near_span[best_src] = nearest_span
+
+    report = pd.DataFrame(
+        {
+            "Title": titles * (len(labels) - 1),
+            "Model": np.repeat(labels[1:], n),
+            "Entry": np.tile(np.arange(1, n + 1), len(labels) - 1),
+            "Tokens": table["lengths"][n:],
+            "CopiedSpan": source_span,
+            "SourceOverlap": source_ratio.round(4),
+            "NearestDocument": [
+                f"{labels[d // n]} #{d % n + 1}" if d >= 0 else "" for d in nearest[n:]
+            ],
+            "NearestSimilarity": near_similarity[n:].round(4),
+            "NearestSpan": near_span[n:],
+            "NearestOverlap": near_ratio[n:].round(4),
+        }
+    )
+    return {"sig": table["sig"], "keys": keys, "labels": labels, "report": report}
+
+
+# Function to get the change markers of the input and every model file
+def _file_keys(models, input_path):
+    paths = [input_path] + list(models.values())
+    return [VERSION] + [
+        [os.path.abspath(p)] + list(corpus_store.file_key(p)) for p in paths
+    ]
+
+
+# Function to persist the index and its report
+def _save(index):
+    os.makedirs(corpus_store.CACHE_DIR, exist_ok=True)
+    with open(INDEX_FILE + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            files=np.array(json.dumps(index["files"])),
+            labels=np.array(index["labels"]),
+            sig=index["sig"],
+            keys=index["keys"],
+        )
+    os.replace(INDEX_FILE + ".tmp", INDEX_FILE)
+    index["report"].to_csv(REPORT_FILE + ".tmp", index=False)
+    os.replace(REPORT_FILE + ".tmp", REPORT_FILE)
+
+
+# Function to read the persisted index (None if missing or, when the files it
+# must be built from are given, stale)
+def _read(files=None):
+    if not (os.path.exists(INDEX_FILE) and os.path.exists(REPORT_FILE)):
+        return None
+    with np.load(INDEX_FILE) as data:
+        built_from = json.loads(str(data["files"]))
+        if files is not None and built_from != files:
+            return None
+        return {
+            "files": built_from,
+            "labels": data["labels"].tolist(),
+            "sig": data["sig"],
+            "keys": data["keys"],
+            "report": pd.read_csv(REPORT_FILE, keep_default_na=False),
+        }
+
+
+# Function to get the copy index of the current models, rebuilding it when stale
+def load(models, input_path=INPUT_FILE):
+    files = json.loads(json.dumps(_file_keys(models, input_path)))
+    with _lock:
+        index = _index.get("current")
+        if index is not None and index["files"] == files:
+            return index
+        index = _read(files)
+        if index is None:
+            with profiling.timer("copy_detection.build"):
+                index = build(models, input_path)
+            index["files"] = files
+            _save(index)
+        _index["current"] = index
+        return index
+
+
+# Function run by the background thread: build, save and swap in a fresh index
+def _rebuild(models, input_path, files):
+    try:
+        index = build(models, input_path)
+    except (OSError, KeyError, IndexError, ValueError):
+        return
+    index["files"] = files
+    with _lock:
+        _save(index)
+        _index["current"] = index
+
+
+# Function to get the copy index without waiting for a rebuild: a stale index is
+# rebuilt in a background thread while the last good one is returned (None when
+# no index was ever built)
+def current(models, input_path=INPUT_FILE):
+    global _builder
+    files = json.loads(json.dumps(_file_keys(models, input_path)))
+    with _lock:
+        index = _index.get("current")
+        if index is None:
+            index = _index["current"] = _read()
+        if index is not None and index["files"] == files:
+            return index
+        if _builder is None or not _builder.is_alive():
+            _builder = threading.Thread(
+                target=_rebuild,
+                args=(models, input_path, files),
+                name="copy-index",
+                daemon=True,
+            )
+            _builder.start()
+        return index
+
+
+# Function to get the copy statistics of one model's paraphrase of an entry
+# (None while the index is first built or lacks the model or entry)
+def entry_report(models, model, entry_index, input_path=INPUT_FILE):
+    index = current(models, input_path)
+    if index is None or model not in index["labels"][1:]:
+        return None
+    n = len(index["sig"]) // len(index["labels"])
+    if entry_index >= n:
+        return None
+    row = (index["labels"].index(model) - 1) * n + entry_index
+    return index["report"].iloc[row].to_dict()
+
+
+# Function to find the indexed documents most similar to a new text
+# (only the documents sharing a band bucket are looked at)
+def similar(text, models, limit=5, input_path=INPUT_FILE):
+    index = load(models, input_path)
+    query = build_table([text])
+    if not query["sh_counts"][0]:
+        return []
+    query_keys = band_keys(query["sig"])[0]
+    candidates = set()
+    for b in range(BANDS):
+        candidates.update(np.flatnonzero(index["keys"][:, b] == query_keys[b]))
+    candidates = np.array(sorted(candidates), dtype=np.int64)
+    if not len(candidates):
+        return []
+    scores = (index["sig"][candidates] == query["sig"][0]).mean(axis=1)
+    n = len(index["sig"]) // len(index["labels"])
+    best = np.argsort(-scores, kind="stable")[:limit]
+    return [
+        (f"{index['labels'][d // n]} #{d % n + 1}", float(s))
+        for d, s in zip(candidates[best], scores[best])
+    ]
+
+
+# Function to mark the copied tokens of a text pair for display
+# (returns both texts as html with copied runs wrapped in <mark>)
+def highlight(source_text, paraphrase_text):
+    def shingles(tokens):
+        return {
+            tuple(t[2] for t in tokens[p : p + SHINGLE])
+            for p in range(len(tokens) - SHINGLE + 1)
+        }
+
+    def mark(text, tokens, other):
+        covered = [False] * len(tokens)
+        for p in range(len(tokens) - SHINGLE + 1):
+            if tuple(t[2] for t in tokens[p : p + SHINGLE]) in other:
+                covered[p : p + SHINGLE] = [True] * SHINGLE
+        parts = []
+        position = 0
+        p = 0
+        while p < len(tokens):
+            if not covered[p]:
+                p += 1
+                continue
+            q = p
+            while q + 1 < len(tokens) and covered[q + 1]:
+                q += 1
+            start, end = tokens[p][0], tokens[q][1]
+            parts.append(html.escape(text[position:start]))
+            parts.append(f"<mark>{html.escape(text[start:end])}</mark>")
+            position = end
+            p = q + 1
+        parts.append(html.escape(text[position:]))
+        return "".join(parts)
+
+    source_text = source_text if isinstance(source_text, str) else ""
+    paraphrase_text = paraphrase_text if isinstance(paraphrase_text, str) else ""
+    source_tokens = token_cache.token_spans(source_text)
+    paraphrase_tokens = token_cache.token_spans(paraphrase_text)
+    return (
+        mark(source_text, source_tokens, shingles(paraphrase_tokens)),
+        mark(paraphrase_text, paraphrase_tokens, shingles(source_tokens)),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import model_registry
+
+    parser = argparse.ArgumentParser(description="Build the copy-detection report")
+    parser.add_argument("--query", help="list the documents most similar to a text")
+    args = parser.parse_args()
+
+    models = model_registry.all_models()
+    if args.query:
+        for label, score in similar(args.query, models):
+            print(f"{score:.3f}  {label}")
+    else:
+        report = load(models)["report"]
+        flagged = report[report["CopiedSpan"] >= FLAG_SPAN]
+        print(REPORT_FILE)
+        print(report.groupby("Model")[["CopiedSpan", "SourceOverlap"]].mean())
+        print(f"{len(flagged)} of {len(report)} paraphrases copy {FLAG_SPAN}+ tokens")
@@ -0,0 +1,96 @@
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+import profiling
+
+# Directory used by the helper modules for derived, regenerable files
+CACHE_DIR = ".paraweb_cache"
+
+# Upper bound for the memory held by cached corpora (in bytes)
+MAX_CACHE_BYTES = int(os.environ.get("PARAWEB_CORPUS_CACHE_MB", "512")) * 1024 * 1024
+
+# Process-wide store shared by every Streamlit session: (path, options) -> entry
+_store = OrderedDict()
+_store_bytes = 0
+_lock = threading.RLock()
+
+
+# Function to build the key that invalidates an entry when the file changes
+def file_key(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+# Function to evict least recently used corpora until the store fits the budget
+def _evict(max_bytes):
+    global _store_bytes
+    while _store_bytes > max_bytes and len(_store) > 1:
+        _, entry = _store.popitem(last=False)
+        _store_bytes -= entry["nbytes"]
+
+
+# Function to load a csv file through the shared store
+def load_csv(path, **read_kwargs):
+    global _store_bytes
+    path = os.path.abspath(path)
+    key = file_key(path)
+    name = (path, repr(sorted(read_kwargs.items())))
+    with _lock:
+        entry = _store.get(name)
+        if entry is not None and entry["key"] == key:
+            _store.move_to_end(name)
+            return entry["df"]
+        if entry is not None:
+            _store_bytes -= entry["nbytes"]
+            del _store[name]
+
+    # Parse outside the lock so other sessions are not blocked on a slow read
+    with profiling.timer("corpus_store.read_csv"):
+        df = pd.read_csv(path, **read_kwargs)
+    nbytes = int(df.memory_usage(deep=True).sum())
+
+    with _lock:
+        old = _store.pop(name, None)
+        if old is not None:
+            _store_bytes -= old["nbytes"]
+        _store[name] = {"key": key, "df": df, "nbytes": nbytes}
+        _store_bytes += nbytes
+        _evict(MAX_CACHE_BYTES)
+    return df
+
+
+# Function to get a single row of a cached corpus as a dict
+def get_row(path, index):
+    df = load_csv(path)
+    return df.iloc[index].to_dict()
+
+
+# Function to get the number of rows of a cached corpus
+def row_count(path):
+    return len(load_csv(path))
+
+
+# Function to drop one file (or everything) from the store
+def invalidate(path=None):
+    global _store_bytes
+    with _lock:
+        if path is None:
+            _store.clear()
+            _store_bytes = 0
+            return
+        path = os.path.abspath(path)
+        for name in [name for name in _store if name[0] == path]:
+            _store_bytes -= _store.pop(name)["nbytes"]
+
+
+# Function to report what the store currently holds
+def stats():
+    with _lock:
+        return {
+            "files": len(_store),
+            "bytes": _store_bytes,
+            "max_bytes": MAX_CACHE_BYTES,
+        }
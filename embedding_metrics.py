@@ -0,0 +1,371 @@
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import corpus_store
+import metrics_pipeline
+
+CORPUS_FILE = metrics_pipeline.CORPUS_FILE
+OUTPUT_DIR = metrics_pipeline.OUTPUT_DIR
+
+BERTSCORE_FILE = "bertscore_paraphrase_evaluation.csv"
+STSB_COLA_FILE = "stsb_cola_paraphrase_evaluation (1).csv"
+
+# Same defaults as the bert-score package for English
+BERTSCORE_MODEL = "roberta-large"
+BERTSCORE_LAYER = 17
+
+# T5 checkpoint trained on the GLUE "stsb" and "cola" tasks
+T5_MODEL = "t5-base"
+
+# ONNX exports, kept and reused by model, layer count and quantization
+ONNX_DIR = os.path.join(corpus_store.CACHE_DIR, "onnx")
+
+# ONNX files of an exported model, by the from_pretrained argument that names them
+ONNX_FILES = {
+    "encoder": {"file_name": "model.onnx"},
+    "seq2seq": {
+        "encoder_file_name": "encoder_model.onnx",
+        "decoder_file_name": "decoder_model.onnx",
+        "decoder_with_past_file_name": "decoder_with_past_model.onnx",
+    },
+}
+
+# Token budget per batch (batch size * longest sequence in the batch)
+MAX_BATCH_TOKENS = 8192
+MAX_LENGTH = 512
+
+
+# Function to group texts of similar length into batches under a token budget
+def length_batches(lengths, max_tokens=MAX_BATCH_TOKENS):
+    order = np.argsort(lengths, kind="stable")
+    batches = []
+    batch = []
+    longest = 0
+    for index in order:
+        length = max(int(lengths[index]), 1)
+        if batch and max(longest, length) * (len(batch) + 1) > max_tokens:
+            batches.append(batch)
+            batch, longest = [], 0
+        batch.append(int(index))
+        longest = max(longest, length)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+# Function to load a transformers model on CPU for the requested backend
+# (layers keeps only the first encoder layers of an ONNX export, so its last
+# hidden state, the only output of the export, is that layer's output)
+def load_model(
+    model_name, kind, backend="torch", threads=None, quantize=False, layers=None
+):
+    import torch
+    from transformers import AutoTokenizer
+
+    if threads:
+        torch.set_num_threads(threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    if backend == "onnx":
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        model_class = (
+            ORTModelForFeatureExtraction if kind == "encoder" else ORTModelForSeq2SeqLM
+        )
+        export_dir = onnx_export_dir(model_name, layers, quantize)
+        if not os.path.exists(export_dir):
+            # Built next to its final place, so an interrupted export is redone
+            build_dir = export_dir + ".tmp"
+            shutil.rmtree(build_dir, ignore_errors=True)
+            _export_onnx(model_name, model_class, kind, layers, quantize, build_dir)
+            os.replace(build_dir, export_dir)
+        model = model_class.from_pretrained(
+            export_dir,
+            session_options=options,
+            **_onnx_file_names(export_dir, kind, quantize),
+        )
+        return tokenizer, model
+
+    from transformers import AutoModel, AutoModelForSeq2SeqLM
+
+    model_class = AutoModel if kind == "encoder" else AutoModelForSeq2SeqLM
+    model = model_class.from_pretrained(model_name).eval()
+    if quantize:
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    return tokenizer, model
+
+
+# Function to get the directory of an ONNX export
+def onnx_export_dir(model_name, layers=None, quantize=False):
+    name = model_name.replace("/", "--")
+    if layers is not None:
+        name += f"-{layers}layers"
+    if quantize:
+        name += "-int8"
+    return os.path.join(ONNX_DIR, name)
+
+
+# Function to save a copy of an encoder cut down to its first layers
+# (the same truncation bert-score applies before taking the last layer)
+def _truncated_encoder(model_name, layers, save_dir):
+    from transformers import AutoModel, AutoTokenizer
+
+    model = AutoModel.from_pretrained(model_name)
+    model.encoder.layer = model.encoder.layer[:layers]
+    model.config.num_hidden_layers = layers
+    model.save_pretrained(save_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(save_dir)
+
+
+# Function to export a model to ONNX (optionally truncated and quantized)
+# into the given directory
+def _export_onnx(model_name, model_class, kind, layers, quantize, export_dir):
+    # The truncated copy is only needed until the export is written
+    with tempfile.TemporaryDirectory(prefix="paraweb_encoder_") as truncated:
+        source = model_name
+        if layers is not None:
+            _truncated_encoder(model_name, layers, truncated)
+            source = truncated
+        model_class.from_pretrained(source, export=True).save_pretrained(export_dir)
+    if quantize:
+        _quantize_onnx(export_dir, kind)
+
+
+# Function to apply dynamic int8 quantization to every file of an ONNX export
+# (the quantized files are written next to the originals)
+def _quantize_onnx(export_dir, kind):
+    from optimum.onnxruntime import ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+    for onnx_file in ONNX_FILES[kind].values():
+        if not os.path.exists(os.path.join(export_dir, onnx_file)):
+            continue
+        quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=onnx_file)
+        quantizer.quantize(
+            save_dir=export_dir, quantization_config=config, file_suffix="quantized"
+        )
+
+
+# Function to get the from_pretrained arguments naming the files of an export
+# (a plain export loads with optimum's own defaults)
+def _onnx_file_names(export_dir, kind, quantize):
+    if not quantize:
+        return {}
+    file_names = {}
+    for argument, onnx_file in ONNX_FILES[kind].items():
+        onnx_file = onnx_file.replace(".onnx", "_quantized.onnx")
+        if os.path.exists(os.path.join(export_dir, onnx_file)):
+            file_names[argument] = onnx_file
+    missing = set(ONNX_FILES[kind]) - set(file_names) - {"decoder_with_past_file_name"}
+    if missing:
+        raise ValueError(f"ONNX export in {export_dir} lacks {sorted(missing)}")
+    if kind == "seq2seq" and "decoder_with_past_file_name" not in file_names:
+        file_names["use_cache"] = False
+    return file_names
+
+
+# Function to embed texts as L2-normalized token vectors, batched by length
+# (layer=None takes the last hidden state, the only output of ONNX exports,
+# which load_model cuts down so that it is the wanted layer)
+def embed_texts(
+    texts, tokenizer, model, layer=BERTSCORE_LAYER, max_tokens=MAX_BATCH_TOKENS
+):
+    import torch
+
+    lengths = [len(tokenizer.tokenize(text)) + 2 for text in texts]
+    embeddings = [None] * len(texts)
+    for batch in length_batches(lengths, max_tokens):
+        encoded = tokenizer(
+            [texts[i] for i in batch],
+            padding=True,
+            truncation=True,
+            max_length=MAX_LENGTH,
+            return_tensors="pt",
+        )
+        with torch.no_grad():
+            if layer is None:
+                hidden = model(**encoded)[0]
+            else:
+                hidden = model(**encoded, output_hidden_states=True).hidden_states[
+                    layer
+                ]
+        hidden = torch.nn.functional.normalize(torch.as_tensor(hidden), dim=-1)
+        mask = encoded["attention_mask"].bool()
+        for row, index in enumerate(batch):
+            # Drop the special start and end tokens, as bert-score does
+            vectors = hidden[row][mask[row]][1:-1]
+            embeddings[index] = vectors.numpy().astype(np.float32)
+    return embeddings
+
+
+# Function to compute BERTScore precision, recall and F1 from token embeddings
+def bertscore(ref_embedding, hyp_embedding):
+    if len(ref_embedding) == 0 or len(hyp_embedding) == 0:
+        return 0.0, 0.0, 0.0
+    similarity = hyp_embedding @ ref_embedding.T
+    precision = float(similarity.max(axis=1).mean())
+    recall = float(similarity.max(axis=0).mean())
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+# Function to run T5 task prompts in length-sorted batches
+def generate_texts(prompts, tokenizer, model, max_tokens=MAX_BATCH_TOKENS):
+    import torch
+
+    lengths = [len(tokenizer.tokenize(prompt)) + 1 for prompt in prompts]
+    outputs = [None] * len(prompts)
+    for batch in length_batches(lengths, max_tokens):
+        encoded = tokenizer(
+            [prompts[i] for i in batch],
+            padding=True,
+            truncation=True,
+            max_length=MAX_LENGTH,
+            return_tensors="pt",
+        )
+        with torch.no_grad():
+            generated = model.generate(**encoded, max_new_tokens=5)
+        for index, text in zip(
+            batch, tokenizer.batch_decode(generated, skip_special_tokens=True)
+        ):
+            outputs[index] = text.strip()
+    return outputs
+
+
+# Function to parse a T5 stsb answer ("3.8") into a float (NaN if not numeric)
+def parse_stsb(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+# Function to compute the BERTScore columns, embedding each reference once
+def bertscore_columns(df, backend="torch", threads=None, quantize=False):
+    suffixes = metrics_pipeline.model_suffixes(df)
+    if backend == "onnx":
+        # The export ends at BERTSCORE_LAYER, so its output is that layer
+        tokenizer, model = load_model(
+            BERTSCORE_MODEL, "encoder", backend, threads, quantize, BERTSCORE_LAYER
+        )
+        layer = None
+    else:
+        tokenizer, model = load_model(
+            BERTSCORE_MODEL, "encoder", backend, threads, quantize
+        )
+        layer = BERTSCORE_LAYER
+    references = df["Abstract"].fillna("").tolist()
+    ref_embeddings = embed_texts(references, tokenizer, model, layer)
+    columns = {}
+    for suffix in suffixes:
+        paraphrases = df[f"Abstract_{suffix}"].fillna("").tolist()
+        hyp_embeddings = embed_texts(paraphrases, tokenizer, model, layer)
+        scores = np.array(
+            [bertscore(r, h) for r, h in zip(ref_embeddings, hyp_embeddings)]
+        )
+        for k, name in enumerate(["p", "r", "f1"]):
+            columns[f"bertscore_{name}_{suffix}"] = np.round(scores[:, k], 4)
+    return pd.DataFrame(columns, index=df.index)
+
+
+# Function to compute the T5 cola and stsb columns
+def stsb_cola_columns(df, backend="torch", threads=None, quantize=False):
+    suffixes = metrics_pipeline.model_suffixes(df)
+    tokenizer, model = load_model(T5_MODEL, "seq2seq", backend, threads, quantize)
+    references = df["Abstract"].fillna("").tolist()
+    columns = {}
+    for suffix in suffixes:
+        paraphrases = df[f"Abstract_{suffix}"].fillna("").tolist()
+        columns[f"cola_{suffix}"] = generate_texts(
+            [f"cola sentence: {text}" for text in paraphrases], tokenizer, model
+        )
+    for suffix in suffixes:
+        paraphrases = df[f"Abstract_{suffix}"].fillna("").tolist()
+        answers = generate_texts(
+            [
+                f"stsb sentence1: {ref} sentence2: {hyp}"
+                for ref, hyp in zip(references, paraphrases)
+            ],
+            tokenizer,
+            model,
+        )
+        columns[f"stsb_{suffix}"] = [parse_stsb(answer) for answer in answers]
+    return pd.DataFrame(columns, index=df.index)
+
+
+# Function to score the corpus and write both model-based score files
+def run(
+    corpus_file=CORPUS_FILE,
+    out_dir=OUTPUT_DIR,
+    backend="torch",
+    threads=None,
+    quantize=False,
+    metrics=("bertscore", "stsb_cola"),
+):
+    df = pd.read_csv(corpus_file)
+    suffixes = metrics_pipeline.model_suffixes(df)
+    text_columns = ["No", "Title", "Abstract"] + [f"Abstract_{s}" for s in suffixes]
+    os.makedirs(out_dir, exist_ok=True)
+    report = {}
+    for metric in metrics:
+        start = time.perf_counter()
+        if metric == "bertscore":
+            scores = bertscore_columns(df, backend, threads, quantize)
+            file_name = BERTSCORE_FILE
+        else:
+            scores = stsb_cola_columns(df, backend, threads, quantize)
+            file_name = STSB_COLA_FILE
+        elapsed = time.perf_counter() - start
+        pd.concat([df[text_columns], scores], axis=1).to_csv(
+            os.path.join(out_dir, file_name), index=False
+        )
+        pairs = len(df) * len(suffixes)
+        report[metric] = {
+            "pairs": pairs,
+            "seconds": round(elapsed, 2),
+            "pairs_per_sec": round(pairs / elapsed, 2) if elapsed else None,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute model-based metrics")
+    parser.add_argument("--corpus", default=CORPUS_FILE)
+    parser.add_argument("--out-dir", default=OUTPUT_DIR)
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--quantize", action="store_true")
+    parser.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=["bertscore", "stsb_cola"],
+        default=["bertscore", "stsb_cola"],
+    )
+    args = parser.parse_args()
+    report = run(
+        args.corpus,
+        args.out_dir,
+        args.backend,
+        args.threads,
+        args.quantize,
+        args.metrics,
+    )
+    for metric, stats in report.items():
+        print(
+            f"{metric}: {stats['pairs']} pairs in {stats['seconds']}s "
+            f"({stats['pairs_per_sec']} pairs/sec)"
+        )
@@ -0,0 +1,88 @@
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import alignment_index
+import corpus_store
+
+INPUT_FILE = alignment_index.INPUT_FILE
+
+# Number of entries resolved ahead of and behind the one being viewed
+WINDOW = int(os.environ.get("PARAWEB_PREFETCH_WINDOW", "3"))
+# Resolved (input row, model row) pairs kept across sessions
+MAX_ENTRIES = 512
+
+# (model file, entry index) -> (file keys, input row, model row)
+_entries = OrderedDict()
+_lock = threading.Lock()
+_queue = queue.Queue()
+_worker = None
+
+
+# Function to get the keys that invalidate an entry when either file changes
+def _file_keys(model_path, input_path):
+    return corpus_store.file_key(input_path), corpus_store.file_key(model_path)
+
+
+# Function to resolve an input row and its paired model row
+def _resolve(model_path, index, input_path):
+    input_row = corpus_store.get_row(input_path, index)
+    model_row = alignment_index.get_model_row(model_path, index, input_path)
+    return input_row, model_row
+
+
+# Function to get an entry pair, from the prefetched window when possible
+def get_entry(model_path, index, input_path=INPUT_FILE):
+    key = (model_path, index)
+    keys = _file_keys(model_path, input_path)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == keys:
+            _entries.move_to_end(key)
+            return entry[1], entry[2]
+    input_row, model_row = _resolve(model_path, index, input_path)
+    _store(key, keys, input_row, model_row)
+    return input_row, model_row
+
+
+# Function to remember a resolved pair, dropping the least recently used ones
+def _store(key, keys, input_row, model_row):
+    with _lock:
+        _entries[key] = (keys, input_row, model_row)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+# Function run by the background thread: resolve queued entries not yet cached
+def _work():
+    while True:
+        model_path, index, input_path = _queue.get()
+        try:
+            keys = _file_keys(model_path, input_path)
+            with _lock:
+                entry = _entries.get((model_path, index))
+            if entry is None or entry[0] != keys:
+                _store(
+                    (model_path, index), keys, *_resolve(model_path, index, input_path)
+                )
+        except (OSError, KeyError, IndexError, ValueError):
+            pass
+        finally:
+            _queue.task_done()
+
+
+# Function to queue the neighbours of an entry for background resolution
+# (nearest first, so the next/previous entry is ready soonest)
+def warm(model_path, index, window=WINDOW, input_path=INPUT_FILE):
+    global _worker
+    with _lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_work, name="entry-prefetch", daemon=True)
+            _worker.start()
+    total = corpus_store.row_count(input_path)
+    for distance in range(1, window + 1):
+        for neighbour in (index + distance, index - distance):
+            if 0 <= neighbour < total:
+                _queue.put((model_path, neighbour, input_path))
@@ -0,0 +1,97 @@
+import hashlib
+import html
+import os
+import threading
+
+import corpus_store
+import profiling
+
+# Streamlit serves files under ./static at app/static/ when static serving is
+# enabled in .streamlit/config.toml
+STATIC_DIR = os.path.join("static", "assets")
+STATIC_URL = "app/static/assets"
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".gif")
+MAX_WIDTH = 1400
+QUALITY = 82
+
+# Prepared assets per image file, keyed by path and its mtime/size
+_assets = {}
+_lock = threading.Lock()
+
+
+# Function to hash the content of an image file
+def content_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+# Function to write a resized, compressed copy of an image (once per content)
+def prepare_image(path, max_width=MAX_WIDTH, static_dir=STATIC_DIR):
+    from PIL import Image
+
+    key = (os.path.abspath(path), max_width)
+    file_key = corpus_store.file_key(path)
+    with _lock:
+        entry = _assets.get(key)
+        if entry is not None and entry[0] == file_key:
+            return entry[1]
+
+    digest = content_hash(path)
+    file_name = f"{digest}_{max_width}.webp"
+    out_path = os.path.join(static_dir, file_name)
+    with profiling.timer("image_assets.prepare_image"), Image.open(path) as image:
+        width, height = image.size
+        if width > max_width:
+            height = round(height * max_width / width)
+            width = max_width
+        if not os.path.exists(out_path):
+            os.makedirs(static_dir, exist_ok=True)
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            if image.size != (width, height):
+                image = image.resize((width, height), Image.LANCZOS)
+            image.save(out_path + ".tmp", "WEBP", quality=QUALITY, method=4)
+            os.replace(out_path + ".tmp", out_path)
+
+    asset = {
+        "name": os.path.basename(path),
+        "url": f"{STATIC_URL}/{file_name}",
+        "width": width,
+        "height": height,
+    }
+    with _lock:
+        _assets[key] = (file_key, asset)
+    return asset
+
+
+# Function to prepare every image of a directory, in file name order
+def prepare_dir(images_dir, max_width=MAX_WIDTH):
+    return [
+        prepare_image(os.path.join(images_dir, image_file), max_width)
+        for image_file in sorted(os.listdir(images_dir))
+        if image_file.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+# Function to prepare all image directories (called once at startup)
+def prepare_all(image_dirs, max_width=MAX_WIDTH):
+    for images_dir in image_dirs:
+        if os.path.exists(images_dir):
+            prepare_dir(images_dir, max_width)
+
+
+# Function to build the <img> tags for assets, lazy-loading all but the first
+def images_html(assets, eager=1, style="max-width: 100%; height: auto;"):
+    tags = []
+    for index, asset in enumerate(assets):
+        loading = "eager" if index < eager else "lazy"
+        tags.append(
+            f"<div style='display: flex; justify-content: center;'>"
+            f"<img src='{asset['url']}' alt='{html.escape(asset['name'])}' "
+            f"width='{asset['width']}' height='{asset['height']}' "
+            f"loading='{loading}' decoding='async' style='{style}'></div>"
+        )
+    return "\n".join(tags)
@@ -0,0 +1,364 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import corpus_store
+import token_cache
+
+CORPUS_FILE = "cleaned_abstracts_by_row.csv"
+# Recomputed score files go to the cache; the reference files shipped in
+# abstract_para are only replaced when asked for with an explicit out_dir
+OUTPUT_DIR = os.path.join(corpus_store.CACHE_DIR, "metrics")
+
+MAX_ORDER = 4
+
+# Corpus rows read, scored and written at a time
+CHUNK_ROWS = 10000
+
+# Bump whenever tokenization or a metric formula changes so cached rows rescore
+METRICS_VERSION = "1"
+
+# Per-row content hashes of the last run into each output directory
+HASHES_DIR = os.path.join(corpus_store.CACHE_DIR, "metric_hashes")
+
+# METEOR parameters (same defaults as nltk)
+METEOR_ALPHA = 0.9
+METEOR_BETA = 3.0
+METEOR_GAMMA = 0.5
+
+# Output files and the metric columns written to each, per model suffix
+METRIC_FILES = {
+    "bleu_scores.csv": ["bleu_{m}", "brevity_penalty_{m}"],
+    "google_bleu_scores.csv": ["google_bleu_{m}"],
+    "rouge_scores.csv": ["rouge1_{m}", "rouge2_{m}", "rougeL_{m}"],
+    "meteor_scores.csv": ["meteor_{m}"],
+}
+
+
+# Function to tokenize a document once and count its n-grams for every metric
+# (a list of token ids from token_cache can be passed instead of the text)
+def prepare(text):
+    tokens = text if isinstance(text, list) else token_cache.tokenize(text)
+    counts = [
+        Counter(tuple(tokens[i : i + n]) for i in range(len(tokens) - n + 1))
+        for n in range(1, MAX_ORDER + 1)
+    ]
+    return tokens, counts
+
+
+# Function to count clipped n-gram matches of each order
+def clipped_matches(ref_counts, hyp_counts):
+    matches = []
+    for ref, hyp in zip(ref_counts, hyp_counts):
+        if len(hyp) > len(ref):
+            ref, hyp = hyp, ref
+        matches.append(sum(min(count, ref[gram]) for gram, count in hyp.items()))
+    return matches
+
+
+# Function to compute sentence BLEU and its brevity penalty (no smoothing)
+def bleu(ref, hyp, matches):
+    ref_tokens, _ = ref
+    hyp_tokens, hyp_counts = hyp
+    hyp_len, ref_len = len(hyp_tokens), len(ref_tokens)
+    if hyp_len == 0:
+        return 0.0, 0.0
+    brevity_penalty = 1.0 if hyp_len > ref_len else math.exp(1 - ref_len / hyp_len)
+    totals = [sum(counts.values()) for counts in hyp_counts]
+    if min(matches) == 0 or min(totals) == 0:
+        return 0.0, brevity_penalty
+    log_precision = sum(math.log(m / t) for m, t in zip(matches, totals)) / MAX_ORDER
+    return brevity_penalty * math.exp(log_precision), brevity_penalty
+
+
+# Function to compute sentence-level Google BLEU (GLEU)
+def google_bleu(ref, hyp, matches):
+    hyp_total = sum(sum(counts.values()) for counts in hyp[1])
+    ref_total = sum(sum(counts.values()) for counts in ref[1])
+    if hyp_total == 0 or ref_total == 0:
+        return 0.0
+    return min(sum(matches) / hyp_total, sum(matches) / ref_total)
+
+
+# Function to compute an F-measure from overlap counts
+def _f_measure(overlap, ref_total, hyp_total):
+    if overlap == 0:
+        return 0.0
+    precision = overlap / hyp_total
+    recall = overlap / ref_total
+    return 2 * precision * recall / (precision + recall)
+
+
+# Function to compute the longest common subsequence length of two token lists
+# (bit-parallel Allison-Dix recurrence, one big-int operation per token of b)
+def lcs_length(a, b):
+    masks = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    full = (1 << len(a)) - 1
+    v = full
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+    return len(a) - bin(v).count("1")
+
+
+# Function to compute ROUGE-1, ROUGE-2 and ROUGE-L F-measures
+def rouge(ref, hyp, matches):
+    ref_tokens, ref_counts = ref
+    hyp_tokens, hyp_counts = hyp
+    scores = []
+    for n in (1, 2):
+        scores.append(
+            _f_measure(
+                matches[n - 1],
+                sum(ref_counts[n - 1].values()),
+                sum(hyp_counts[n - 1].values()),
+            )
+        )
+    scores.append(
+        _f_measure(lcs_length(ref_tokens, hyp_tokens), len(ref_tokens), len(hyp_tokens))
+    )
+    return scores
+
+
+# Function to align exact unigram matches in order (as nltk's METEOR does)
+def _align(ref_tokens, hyp_tokens):
+    positions = {}
+    for j, token in enumerate(ref_tokens):
+        positions.setdefault(token, []).append(j)
+    alignment = []
+    used = set()
+    for i, token in enumerate(hyp_tokens):
+        for j in positions.get(token, ()):
+            if j not in used:
+                used.add(j)
+                alignment.append((i, j))
+                break
+    return alignment
+
+
+# Function to compute METEOR with exact matching and the fragmentation penalty
+def meteor(ref, hyp):
+    ref_tokens, _ = ref
+    hyp_tokens, _ = hyp
+    alignment = _align(ref_tokens, hyp_tokens)
+    matches = len(alignment)
+    if matches == 0:
+        return 0.0
+    precision = matches / len(hyp_tokens)
+    recall = matches / len(ref_tokens)
+    fmean = (
+        precision * recall / (METEOR_ALPHA * precision + (1 - METEOR_ALPHA) * recall)
+    )
+    chunks = 1
+    for (i, j), (next_i, next_j) in zip(alignment, alignment[1:]):
+        if next_i != i + 1 or next_j != j + 1:
+            chunks += 1
+    penalty = METEOR_GAMMA * (chunks / matches) ** METEOR_BETA
+    return fmean * (1 - penalty)
+
+
+# Function to score one (reference, paraphrase) pair with every metric
+def score_pair(ref, hyp):
+    matches = clipped_matches(ref[1], hyp[1])
+    bleu_score, brevity_penalty = bleu(ref, hyp, matches)
+    rouge1, rouge2, rouge_l = rouge(ref, hyp, matches)
+    return {
+        "bleu": bleu_score,
+        "brevity_penalty": brevity_penalty,
+        "google_bleu": google_bleu(ref, hyp, matches),
+        "rouge1": rouge1,
+        "rouge2": rouge2,
+        "rougeL": rouge_l,
+        "meteor": meteor(ref, hyp),
+    }
+
+
+# Function to score a chunk of rows (runs inside a worker process)
+def score_rows(rows, model_suffixes):
+    results = []
+    for row in rows:
+        ref = prepare(row["Abstract"])
+        scores = {}
+        for suffix in model_suffixes:
+            pair = score_pair(ref, prepare(row[f"Abstract_{suffix}"]))
+            for metric, value in pair.items():
+                scores[f"{metric}_{suffix}"] = round(value, 4)
+        results.append(scores)
+    return results
+
+
+# Function to find the model suffixes (gpt4o, llama3, ...) of a corpus
+def model_suffixes(df):
+    return [c[len("Abstract_") :] for c in df.columns if c.startswith("Abstract_")]
+
+
+# Function to score every row of a corpus, optionally across a process pool
+# (with the corpus token table, workers get token ids instead of raw text; a
+# pool can be passed in to reuse it across calls)
+def compute_scores(df, workers=None, chunk_size=256, tokens=None, pool=None):
+    suffixes = model_suffixes(df)
+    columns = ["Abstract"] + [f"Abstract_{s}" for s in suffixes]
+    if tokens is None:
+        rows = df[columns].to_dict("records")
+    else:
+        rows = [
+            {c: token_cache.row_ids(tokens, c, row).tolist() for c in columns}
+            for row in df.index
+        ]
+    chunks = [rows[i : i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    if pool is not None and len(chunks) > 1:
+        results = list(pool.map(score_rows, chunks, [suffixes] * len(chunks)))
+    elif workers == 1 or len(chunks) <= 1:
+        results = [score_rows(chunk, suffixes) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(score_rows, chunks, [suffixes] * len(chunks)))
+    return pd.DataFrame(
+        [scores for chunk in results for scores in chunk], index=df.index
+    )
+
+
+# Function to write the score tables in the layout of the abstract_para files
+# (mode "a" appends a chunk of rows without repeating the header)
+def write_score_files(df, scores, out_dir=OUTPUT_DIR, mode="w", suffix=""):
+    os.makedirs(out_dir, exist_ok=True)
+    suffixes = model_suffixes(df)
+    text_columns = ["No", "Abstract"] + [f"Abstract_{s}" for s in suffixes]
+    written = []
+    for file_name, patterns in METRIC_FILES.items():
+        metric_columns = [p.format(m=s) for s in suffixes for p in patterns]
+        out = pd.concat([df[text_columns], scores[metric_columns]], axis=1)
+        path = os.path.join(out_dir, file_name) + suffix
+        out.to_csv(path, mode=mode, header=mode == "w", index=False)
+        written.append(path)
+    return written
+
+
+# Function to hash the texts of one row together with the metric version
+def row_hash(row, suffixes):
+    digest = hashlib.sha1(METRICS_VERSION.encode("utf-8"))
+    for column in ["Abstract"] + [f"Abstract_{s}" for s in suffixes]:
+        digest.update(b"\0" + str(row[column]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Function to get the path of the row hashes of an output directory
+def hashes_path(out_dir):
+    digest = hashlib.sha1(os.path.abspath(out_dir).encode("utf-8")).hexdigest()
+    return os.path.join(HASHES_DIR, f"{digest[:16]}.json")
+
+
+# Function to load the row hashes recorded by the previous run
+def load_hashes(out_dir=OUTPUT_DIR):
+    path = hashes_path(out_dir)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Function to record the row hashes of this run
+def save_hashes(hashes, out_dir=OUTPUT_DIR):
+    os.makedirs(HASHES_DIR, exist_ok=True)
+    path = hashes_path(out_dir)
+    with open(path + ".tmp", "w") as f:
+        json.dump(hashes, f)
+    os.replace(path + ".tmp", path)
+
+
+# Function to read back the metric columns of existing score files (by No)
+def load_existing_scores(out_dir, suffixes):
+    tables = []
+    for file_name, patterns in METRIC_FILES.items():
+        path = os.path.join(out_dir, file_name)
+        columns = [p.format(m=s) for s in suffixes for p in patterns]
+        if not os.path.exists(path):
+            return None
+        table = pd.read_csv(path, usecols=lambda c: c == "No" or c in columns)
+        if len(table.columns) != len(columns) + 1:
+            return None
+        tables.append(table.set_index("No"))
+    return pd.concat(tables, axis=1)
+
+
+# Function to regenerate every automatic metric file from the corpus
+# (incremental runs rescore only rows whose texts changed since the last run;
+# the corpus is streamed chunk_rows at a time and the files replaced at the end)
+def run(
+    corpus_file=CORPUS_FILE,
+    out_dir=OUTPUT_DIR,
+    workers=None,
+    incremental=True,
+    chunk_rows=CHUNK_ROWS,
+):
+    tokens = token_cache.load(corpus_file)
+    suffixes = model_suffixes(pd.read_csv(corpus_file, nrows=0))
+    existing = load_existing_scores(out_dir, suffixes) if incremental else None
+    previous = load_hashes(out_dir) if existing is not None else {}
+    hashes = {}
+    rescored = 0
+    written = []
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        for df in pd.read_csv(corpus_file, chunksize=chunk_rows):
+            chunk_hashes = {
+                str(row["No"]): row_hash(row, suffixes) for _, row in df.iterrows()
+            }
+            changed = df["No"].map(
+                lambda no: previous.get(str(no)) != chunk_hashes[str(no)]
+                or no not in existing.index
+            )
+
+            parts = []
+            if changed.any():
+                parts.append(
+                    compute_scores(df[changed], workers, tokens=tokens, pool=pool)
+                )
+            if not changed.all():
+                kept = existing.loc[df.loc[~changed, "No"]]
+                parts.append(kept.set_index(df.index[~changed]))
+            scores = pd.concat(parts).loc[df.index]
+
+            mode = "a" if written else "w"
+            written = write_score_files(df, scores, out_dir, mode, ".tmp")
+            hashes.update(chunk_hashes)
+            rescored += int(changed.sum())
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    for path in written:
+        os.replace(path, path[: -len(".tmp")])
+    save_hashes(hashes, out_dir)
+    return [path[: -len(".tmp")] for path in written], rescored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute automatic metrics")
+    parser.add_argument("--corpus", default=CORPUS_FILE)
+    parser.add_argument(
+        "--out-dir",
+        default=OUTPUT_DIR,
+        help="where to write the score files (pass abstract_para to replace the "
+        "shipped reference files)",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--full", action="store_true", help="rescore every row, ignoring the cache"
+    )
+    args = parser.parse_args()
+    written, rescored = run(
+        args.corpus, args.out_dir, args.workers, incremental=not args.full
+    )
+    for path in written:
+        print(path)
+    print(f"{rescored} rows rescored")
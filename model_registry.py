@@ -0,0 +1,183 @@
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+import alignment_index
+import corpus_store
+
+# Models shipped with the repository (selectbox name -> csv file)
+DEFAULT_MODELS = {
+    "gemini 1.5 pro": "gemini_15_pro.csv",
+    "gpt-4o": "gpt_4o.csv",
+    "Llama3 70b": "llama3_70b.csv",
+}
+
+# New model outputs are dropped here as Title,ParaphrasedAbstract csv or jsonl
+MODELS_DIR = os.environ.get("PARAWEB_MODELS_DIR", "model_outputs")
+INGESTED_DIR = os.path.join(corpus_store.CACHE_DIR, "models")
+REGISTRY_FILE = os.path.join(corpus_store.CACHE_DIR, "models.json")
+
+COLUMNS = ["Title", "ParaphrasedAbstract"]
+EXTENSIONS = (".csv", ".jsonl")
+# Progress files of unfinished paraphrase_generation runs, never a model
+SKIP_SUFFIXES = (".checkpoint.jsonl",)
+CHUNK_ROWS = 5000
+# Files modified more recently than this are assumed to be still being copied
+SETTLE_SECONDS = 2.0
+SCAN_INTERVAL = 5.0
+
+_lock = threading.Lock()
+_watcher = None
+
+
+# Function to get the model name shown in the selectbox for an output file
+def model_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+# Function to list the model output files in the watched directory
+def discover(models_dir=MODELS_DIR):
+    if not os.path.exists(models_dir):
+        return []
+    return sorted(
+        os.path.join(models_dir, f)
+        for f in os.listdir(models_dir)
+        if f.lower().endswith(EXTENSIONS) and not f.lower().endswith(SKIP_SUFFIXES)
+    )
+
+
+# Function to read an output file as frames of at most chunk_rows rows
+def iter_chunks(path, chunk_rows=CHUNK_ROWS):
+    if path.lower().endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            records = []
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+                if len(records) == chunk_rows:
+                    yield pd.DataFrame.from_records(records)
+                    records = []
+            if records:
+                yield pd.DataFrame.from_records(records)
+        return
+    yield from pd.read_csv(path, chunksize=chunk_rows)
+
+
+# Function to load the registry of ingested models
+def load_registry(registry_file=REGISTRY_FILE):
+    if not os.path.exists(registry_file):
+        return {}
+    with open(registry_file) as f:
+        return json.load(f)
+
+
+# Function to save the registry atomically
+def _save_registry(registry, registry_file=REGISTRY_FILE):
+    os.makedirs(os.path.dirname(registry_file), exist_ok=True)
+    with open(registry_file + ".tmp", "w") as f:
+        json.dump(registry, f, indent=1)
+    os.replace(registry_file + ".tmp", registry_file)
+
+
+# Function to stream an output file into a normalized csv, indexing titles
+# against input.csv on the way so only one chunk is in memory at a time
+def ingest(path, chunk_rows=CHUNK_ROWS, ingested_dir=INGESTED_DIR):
+    os.makedirs(ingested_dir, exist_ok=True)
+    out_path = os.path.join(ingested_dir, f"{model_name(path)}.csv")
+    offsets = {}
+    seen = {}
+    rows = 0
+    with open(out_path + ".tmp", "w", encoding="utf-8", newline="") as out:
+        for chunk in iter_chunks(path, chunk_rows):
+            missing = [c for c in COLUMNS if c not in chunk.columns]
+            if missing:
+                out.close()
+                os.remove(out_path + ".tmp")
+                return {"status": "rejected", "reason": f"missing {missing}"}
+            chunk = chunk[COLUMNS]
+            alignment_index.title_offsets(chunk["Title"], rows, offsets, seen)
+            chunk.to_csv(out, header=rows == 0, index=False)
+            rows += len(chunk)
+    os.replace(out_path + ".tmp", out_path)
+
+    index = alignment_index.match_offsets(offsets, rows, out_path)
+    if len(index["missing"]) == len(index["offsets"]):
+        return {"status": "rejected", "reason": "no titles match input.csv"}
+    alignment_index.set_index(out_path, index)
+    return {
+        "status": "ready",
+        "path": out_path,
+        "rows": rows,
+        "missing": len(index["missing"]),
+        "extra": len(index["extra"]),
+    }
+
+
+# Function to ingest new or changed output files and drop deleted ones
+def scan(models_dir=MODELS_DIR, registry_file=REGISTRY_FILE):
+    with _lock:
+        registry = load_registry(registry_file)
+        changed = False
+        sources = discover(models_dir)
+        for path in sources:
+            key = list(corpus_store.file_key(path))
+            entry = registry.get(model_name(path))
+            if entry is not None and entry["source"] == path and entry["keys"] == key:
+                continue
+            if time.time() - os.path.getmtime(path) < SETTLE_SECONDS:
+                continue
+            try:
+                result = ingest(path)
+            except (ValueError, pd.errors.ParserError) as e:
+                result = {"status": "rejected", "reason": str(e)}
+            result.update({"source": path, "keys": key})
+            registry[model_name(path)] = result
+            changed = True
+        for name in [n for n, e in registry.items() if e["source"] not in sources]:
+            del registry[name]
+            changed = True
+        if changed:
+            _save_registry(registry, registry_file)
+        return registry
+
+
+# Function to get the ingested models ready for evaluation (name -> csv path)
+def registered_models(registry_file=REGISTRY_FILE):
+    return {
+        name: entry["path"]
+        for name, entry in sorted(load_registry(registry_file).items())
+        if entry["status"] == "ready"
+    }
+
+
+# Function to get the shipped models followed by the ingested ones
+def all_models(registry_file=REGISTRY_FILE):
+    models = dict(DEFAULT_MODELS)
+    models.update(registered_models(registry_file))
+    return models
+
+
+# Function to scan the watched directory in a background thread
+def start_watcher(models_dir=MODELS_DIR, interval=SCAN_INTERVAL):
+    global _watcher
+
+    def watch():
+        while True:
+            try:
+                scan(models_dir)
+            except OSError:
+                pass
+            time.sleep(interval)
+
+    with _lock:
+        if _watcher is None or not _watcher.is_alive():
+            _watcher = threading.Thread(target=watch, name="model-watcher", daemon=True)
+            _watcher.start()
+
+
+if __name__ == "__main__":
+    for name, entry in scan().items():
+        print(name, entry)
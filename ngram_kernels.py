@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+
+import metrics_pipeline
+import token_cache
+
+MAX_ORDER = metrics_pipeline.MAX_ORDER
+
+
+# Function to turn documents into one flat array of interned token ids
+def encode_corpus(texts):
+    ids, lengths, vocab = token_cache.encode(texts)
+    return ids.astype(np.int64), lengths, len(vocab)
+
+
+# Function to build dense n-gram ids of every order for a flat token array
+# (order n id = factorize(order n-1 id * vocab size + next token), so ids are
+# exact, collision free and comparable across all documents in the array)
+def ngram_ids(ids, lengths, vocab_size):
+    docs = np.repeat(np.arange(len(lengths)), lengths)
+    orders = [(docs, ids)]
+    previous = ids
+    for n in range(2, MAX_ORDER + 1):
+        size = len(ids) - n + 1
+        if size <= 0:
+            empty = np.zeros(0, dtype=np.int64)
+            orders.append((empty, empty))
+            previous = empty
+            continue
+        # An n-gram starting at i exists if its (n-1)-gram prefix does and
+        # its last token belongs to the same document
+        valid = (previous[:size] >= 0) & (docs[:size] == docs[n - 1 :])
+        keys = previous[:size][valid] * vocab_size + ids[n - 1 :][valid]
+        dense, _ = pd.factorize(keys)
+        current = np.full(size, -1, dtype=np.int64)
+        current[valid] = dense
+        orders.append((docs[:size][valid], current[valid]))
+        previous = current
+    return orders
+
+
+# Function to take the n-grams of a contiguous range of documents
+def slice_docs(orders, first, last):
+    sliced = []
+    for docs, grams in orders:
+        lo, hi = np.searchsorted(docs, [first, last])
+        sliced.append((docs[lo:hi] - first, grams[lo:hi]))
+    return sliced
+
+
+# Function to count (document, n-gram) pairs of every order as sorted keys
+def count_orders(orders, widths, n_docs):
+    counted = []
+    for (docs, grams), width in zip(orders, widths):
+        keys, counts = np.unique(docs * width + grams, return_counts=True)
+        totals = np.bincount(docs, minlength=n_docs).astype(np.float64)
+        counted.append((keys, counts, totals))
+    return counted
+
+
+# Function to compute clipped matches per document for one order
+def clipped_order(ref, hyp, width, n_docs):
+    ref_keys, ref_counts, _ = ref
+    hyp_keys, hyp_counts, _ = hyp
+    common, ref_pos, hyp_pos = np.intersect1d(
+        ref_keys, hyp_keys, assume_unique=True, return_indices=True
+    )
+    clipped = np.minimum(ref_counts[ref_pos], hyp_counts[hyp_pos])
+    return np.bincount(common // width, weights=clipped, minlength=n_docs)
+
+
+# Function to divide elementwise, returning 0 where the denominator is 0
+def _safe_divide(a, b):
+    return np.divide(a, b, out=np.zeros_like(a, dtype=np.float64), where=b > 0)
+
+
+# Function to compute BLEU, GLEU and ROUGE-1/2 for all rows of two columns
+def pair_scores(ref_counted, ref_lengths, hyp_counted, hyp_lengths, widths):
+    n_docs = len(ref_lengths)
+    matches = np.vstack(
+        [
+            clipped_order(ref, hyp, width, n_docs)
+            for ref, hyp, width in zip(ref_counted, hyp_counted, widths)
+        ]
+    )
+    ref_totals = np.vstack([totals for _, _, totals in ref_counted])
+    hyp_totals = np.vstack([totals for _, _, totals in hyp_counted])
+
+    ref_len = ref_lengths.astype(np.float64)
+    hyp_len = hyp_lengths.astype(np.float64)
+    brevity_penalty = np.where(
+        hyp_len > ref_len, 1.0, np.exp(1 - _safe_divide(ref_len, hyp_len))
+    )
+    brevity_penalty[hyp_len == 0] = 0.0
+    precisions = _safe_divide(matches, hyp_totals)
+    with np.errstate(divide="ignore"):
+        log_precision = np.log(precisions).mean(axis=0)
+    bleu = np.where(
+        (matches > 0).all(axis=0), brevity_penalty * np.exp(log_precision), 0.0
+    )
+
+    total_matches = matches.sum(axis=0)
+    google_bleu = np.minimum(
+        _safe_divide(total_matches, hyp_totals.sum(axis=0)),
+        _safe_divide(total_matches, ref_totals.sum(axis=0)),
+    )
+
+    rouge = []
+    for n in (0, 1):
+        precision = _safe_divide(matches[n], hyp_totals[n])
+        recall = _safe_divide(matches[n], ref_totals[n])
+        rouge.append(_safe_divide(2 * precision * recall, precision + recall))
+
+    return {
+        "bleu": bleu,
+        "brevity_penalty": brevity_penalty,
+        "google_bleu": google_bleu,
+        "rouge1": rouge[0],
+        "rouge2": rouge[1],
+    }
+
+
+# Function to score every model column of a corpus in batched array operations
+# (pass the corpus token table to reuse its token ids instead of re-tokenizing)
+def corpus_scores(df, decimals=4, tokens=None):
+    suffixes = metrics_pipeline.model_suffixes(df)
+    columns = ["Abstract"] + [f"Abstract_{suffix}" for suffix in suffixes]
+    n_rows = len(df)
+
+    # Encode the reference and every model column as one corpus so n-gram ids
+    # are shared; column k occupies documents [k * n_rows, (k + 1) * n_rows)
+    if tokens is None:
+        texts = [text for column in columns for text in df[column].tolist()]
+        ids, lengths, vocab_size = encode_corpus(texts)
+    else:
+        encoded = [token_cache.column_ids(tokens, c, df.index) for c in columns]
+        ids = np.concatenate([column_ids for column_ids, _ in encoded])
+        lengths = np.concatenate([column_lengths for _, column_lengths in encoded])
+        vocab_size = len(tokens["vocab"])
+    orders = ngram_ids(ids, lengths, max(vocab_size, 1))
+    widths = [int(grams.max(initial=0)) + 1 for _, grams in orders]
+
+    # Reference n-grams are counted once and reused for every model column
+    ref_counted = count_orders(slice_docs(orders, 0, n_rows), widths, n_rows)
+    ref_lengths = lengths[:n_rows]
+    scores = {}
+    for k, suffix in enumerate(suffixes, start=1):
+        hyp_orders = slice_docs(orders, k * n_rows, (k + 1) * n_rows)
+        hyp_counted = count_orders(hyp_orders, widths, n_rows)
+        hyp_lengths = lengths[k * n_rows : (k + 1) * n_rows]
+        for metric, values in pair_scores(
+            ref_counted, ref_lengths, hyp_counted, hyp_lengths, widths
+        ).items():
+            scores[f"{metric}_{suffix}"] = np.round(values, decimals)
+    return pd.DataFrame(scores, index=df.index)
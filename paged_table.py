@@ -0,0 +1,205 @@
+import io
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import columnar_store
+import corpus_store
+import profiling
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+# Row offsets, single columns and the last filter of each file, keyed by file
+# and checked against its mtime/size
+_cache = {}
+_lock = threading.Lock()
+
+
+# Function to remember derived data until the underlying file changes
+def _cached(path, name, build):
+    key = (os.path.abspath(path), name)
+    file_key = corpus_store.file_key(path)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == file_key:
+            return entry[1]
+    value = build()
+    with _lock:
+        _cache[key] = (file_key, value)
+    return value
+
+
+# Function to find the byte offset where each csv record starts
+# (newlines inside quoted fields, e.g. multi-line abstracts, are skipped)
+def row_offsets(path):
+    def build():
+        offsets = []
+        position = 0
+        in_quotes = False
+        with open(path, "rb") as f:
+            for line in f:
+                # Blank lines outside quotes are skipped by pandas as well
+                if not in_quotes and line.strip():
+                    offsets.append(position)
+                if line.count(b'"') % 2:
+                    in_quotes = not in_quotes
+                position += len(line)
+        offsets.append(position)
+        return np.asarray(offsets, dtype=np.int64)
+
+    return _cached(path, "offsets", build)
+
+
+# Function to get the header line and column names of a csv file
+def csv_columns(path):
+    offsets = row_offsets(path)
+    with open(path, "rb") as f:
+        header = f.read(int(offsets[1]))
+    return header, list(pd.read_csv(io.BytesIO(header)).columns)
+
+
+# Function to count the data rows of a csv file without parsing it
+def csv_row_count(path):
+    offsets = row_offsets(path)
+    return max(len(offsets) - 2, 0)
+
+
+# Function to read one column of a csv file (used for sorting and filtering)
+def csv_column(path, column):
+    return _cached(
+        path, ("column", column), lambda: pd.read_csv(path, usecols=[column])[column]
+    )
+
+
+# Function to parse only the given data rows (and columns) of a csv file
+def csv_rows(path, rows, columns):
+    offsets = row_offsets(path)
+    header, _ = csv_columns(path)
+    parts = [header]
+    with open(path, "rb") as f:
+        # Read contiguous runs of rows with a single seek each
+        runs = (
+            np.split(rows, np.flatnonzero(np.diff(rows) != 1) + 1) if len(rows) else []
+        )
+        for run in runs:
+            start, end = offsets[run[0] + 1], offsets[run[-1] + 2]
+            f.seek(int(start))
+            chunk = f.read(int(end - start))
+            parts.append(chunk if chunk.endswith(b"\n") else chunk + b"\n")
+    df = pd.read_csv(io.BytesIO(b"".join(parts)), usecols=columns)
+    df.index = rows
+    return df[columns]
+
+
+# Function to keep the rows of a column matching a filter expression
+# (">0.5", "<=3", "=acceptable" or plain text matched case-insensitively)
+def filter_mask(series, expression):
+    expression = expression.strip()
+    match = re.fullmatch(r"(<=|>=|<|>|=|!=)\s*(.+)", expression)
+    if match and pd.api.types.is_numeric_dtype(series):
+        operator, value = match.groups()
+        try:
+            value = float(value)
+        except ValueError:
+            return np.zeros(len(series), dtype=bool)
+        compare = {
+            "<": np.less,
+            "<=": np.less_equal,
+            ">": np.greater,
+            ">=": np.greater_equal,
+            "=": np.equal,
+            "!=": np.not_equal,
+        }[operator]
+        return compare(series.to_numpy(dtype=float), value)
+    if match and match.group(1) == "=":
+        return (series.astype(str) == match.group(2)).to_numpy()
+    return (
+        series.astype(str).str.contains(expression, case=False, regex=False).to_numpy()
+    )
+
+
+# Function to get the source's columns, row count, column/row readers and the
+# file its cached data depends on
+def _source(kind, name):
+    if kind == "columnar":
+        columns = columnar_store.layout(name)["columns"]
+        table = columnar_store.load_table(name, [columnar_store.KEY])
+        return (
+            columns,
+            len(table),
+            lambda column: columnar_store.load_table(name, [column])[column],
+            lambda rows, cols: columnar_store.load_table(name, cols).iloc[rows],
+            columnar_store.table_path(name),
+        )
+    return (
+        csv_columns(name)[1],
+        csv_row_count(name),
+        lambda column: csv_column(name, column),
+        lambda rows, cols: csv_rows(name, rows, cols),
+        name,
+    )
+
+
+# Function to get the columns shown by default (text columns hidden)
+def default_columns(kind, name):
+    columns = _source(kind, name)[0]
+    return [c for c in columns if not columnar_store.is_text_column(c)]
+
+
+# Function to get all columns of a source
+def all_columns(kind, name):
+    return _source(kind, name)[0]
+
+
+# Function to get the row numbers that pass the filter (the last filter of each
+# file is kept, so counting the rows and fetching a page filter only once)
+def _filtered_rows(kind, name, filter_column, filter_value):
+    _, total, read_column, _, path = _source(kind, name)
+    if not (filter_column and filter_value):
+        return np.arange(total)
+    key = (os.path.abspath(path), "filter")
+    marker = (corpus_store.file_key(path), filter_column, filter_value)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == marker:
+            return entry[1]
+    rows = np.flatnonzero(filter_mask(read_column(filter_column), filter_value))
+    with _lock:
+        _cache[key] = (marker, rows)
+    return rows
+
+
+# Function to count the rows that pass the filter
+def count_rows(kind, name, filter_column=None, filter_value=""):
+    return len(_filtered_rows(kind, name, filter_column, filter_value))
+
+
+# Function to fetch one page of a csv file or columnar table
+# (sorting and filtering read only the columns they use)
+@profiling.timed("paged_table.query")
+def query(
+    kind,
+    name,
+    columns,
+    page=0,
+    page_size=PAGE_SIZES[0],
+    sort_column=None,
+    ascending=True,
+    filter_column=None,
+    filter_value="",
+):
+    _, _, read_column, read_rows, _ = _source(kind, name)
+    rows = _filtered_rows(kind, name, filter_column, filter_value)
+    # A page left over from before the filter narrowed shows the last page
+    page = min(page, max((len(rows) - 1) // page_size, 0))
+    if sort_column:
+        values = read_column(sort_column).iloc[rows].reset_index(drop=True)
+        order = values.sort_values(ascending=ascending, kind="stable").index
+        rows = rows[order.to_numpy()]
+    page_rows = rows[page * page_size : (page + 1) * page_size]
+    # Keep the requested order after reading the page rows in file order
+    df = read_rows(np.sort(page_rows), list(columns))
+    return len(rows), df.loc[page_rows]
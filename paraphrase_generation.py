@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import email.utils
+import hashlib
+import importlib
+import json
+import os
+import random
+import time
+
+import pandas as pd
+
+import corpus_store
+
+INPUT_FILE = "input.csv"
+# Checkpoints of unfinished runs (kept out of model_outputs, which is watched
+# for new model files)
+CHECKPOINT_DIR = os.path.join(corpus_store.CACHE_DIR, "checkpoints")
+
+PROMPT = (
+    "Paraphrase the following scientific abstract. Keep its meaning, change the "
+    "wording and sentence structure, and answer with the paraphrase only.\n\n"
+    "{abstract}"
+)
+
+CONCURRENCY = 8
+REQUESTS_PER_SECOND = 5.0
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+
+# Rough token count used for tokens-per-minute limits (about 4 chars a token)
+CHARS_PER_TOKEN = 4
+
+
+# Function to build a token bucket refilled at rate tokens/second up to burst
+def make_bucket(rate, burst=None):
+    burst = burst or max(rate, 1.0)
+    return {"rate": rate, "burst": burst, "tokens": burst, "updated": time.monotonic()}
+
+
+# Function to wait until a bucket holds the given number of tokens and take them
+async def take(bucket, amount=1.0):
+    amount = min(amount, bucket["burst"])
+    while True:
+        now = time.monotonic()
+        bucket["tokens"] = min(
+            bucket["burst"],
+            bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"],
+        )
+        bucket["updated"] = now
+        if bucket["tokens"] >= amount:
+            bucket["tokens"] -= amount
+            return
+        await asyncio.sleep((amount - bucket["tokens"]) / bucket["rate"])
+
+
+# Function to build the offline backend: a deterministic rewrite after a delay
+# (failure_rate makes some calls raise so retries can be exercised)
+def mock_backend(latency=0.05, failure_rate=0.0, seed=0, **_):
+    rng = random.Random(seed)
+
+    async def generate(prompt, model):
+        await asyncio.sleep(latency * (0.5 + rng.random()))
+        if rng.random() < failure_rate:
+            raise ConnectionError("mock backend: transient failure")
+        abstract = prompt.rsplit("\n\n", 1)[-1]
+        sentences = [s.strip() for s in abstract.split(". ") if s.strip()]
+        return ". ".join(reversed(sentences))
+
+    return generate
+
+
+# Function to build a backend for an OpenAI-compatible chat completions API
+def openai_backend(base_url=None, api_key=None, timeout=120, **_):
+    import httpx
+
+    base_url = base_url or os.environ.get(
+        "OPENAI_BASE_URL", "https://api.openai.com/v1"
+    )
+    api_key = api_key or os.environ["OPENAI_API_KEY"]
+    client = httpx.AsyncClient(
+        base_url=base_url,
+        headers={"Authorization": f"Bearer {api_key}"},
+        timeout=timeout,
+    )
+
+    async def generate(prompt, model):
+        response = await client.post(
+            "/chat/completions",
+            json={"model": model, "messages": [{"role": "user", "content": prompt}]},
+        )
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"].strip()
+
+    # Closed by run once every request is done
+    generate.aclose = client.aclose
+    return generate
+
+
+BACKENDS = {"mock": mock_backend, "openai": openai_backend}
+
+
+# Function to get a backend factory by name or as "module:function"
+def get_backend(name):
+    if name in BACKENDS:
+        return BACKENDS[name]
+    module, _, attribute = name.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+# Function to write the requests as an OpenAI batch jsonl file instead
+def write_batch_requests(input_file, out_path, model):
+    df = pd.read_csv(input_file)
+    with open(out_path, "w", encoding="utf-8") as f:
+        for row, abstract in enumerate(df["Abstract"]):
+            request = {
+                "custom_id": str(row),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": [
+                        {"role": "user", "content": PROMPT.format(abstract=abstract)}
+                    ],
+                },
+            }
+            f.write(json.dumps(request) + "\n")
+    return len(df)
+
+
+# Function to get the checkpoint path of an output file (named after its
+# absolute path, so a rerun with the same output resumes from it)
+def checkpoint_path(out_path):
+    digest = hashlib.sha1(os.path.abspath(out_path).encode("utf-8")).hexdigest()
+    name = f"{os.path.basename(out_path)}.{digest[:16]}.checkpoint.jsonl"
+    return os.path.join(CHECKPOINT_DIR, name)
+
+
+# Function to paraphrase the pending rows, then close the backend if it holds
+# resources (e.g. the openai backend's http client)
+async def _generate_and_close(generate, *args, **options):
+    try:
+        return await generate_rows(*args, **options)
+    finally:
+        close = getattr(generate, "aclose", None)
+        if close is not None:
+            await close()
+
+
+# Function to read the rows finished by an earlier run from its checkpoint
+# (a row whose title no longer matches, e.g. after input.csv was edited, is
+# generated again)
+def load_checkpoint(checkpoint_path, titles):
+    done = {}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut short if the run was killed
+                    continue
+                row = record["row"]
+                if 0 <= row < len(titles) and record.get("Title") == titles[row]:
+                    done[row] = record["ParaphrasedAbstract"]
+    return done
+
+
+# Function to get the seconds to wait before retrying a failed request, or None
+# when the error is not transient (bad requests, auth errors, malformed answers
+# and bugs fail the row at once)
+def _retry_delay(error, attempt):
+    backoff = BACKOFF_SECONDS * 2**attempt * (0.5 + random.random())
+    if isinstance(error, ConnectionError):
+        return backoff
+    try:
+        import httpx
+    except ImportError:
+        return None
+    if isinstance(error, httpx.TransportError):
+        return backoff
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if status != 429 and status < 500:
+            return None
+        # Retry-After holds either seconds or an HTTP date
+        retry_after = error.response.headers.get("Retry-After")
+        if retry_after is None:
+            return backoff
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            when = email.utils.parsedate_to_datetime(retry_after).timestamp()
+        except (TypeError, ValueError):
+            return backoff
+        return max(when - time.time(), 0.0)
+    return None
+
+
+# Function to request one paraphrase, retrying transient errors with
+# exponential backoff (every attempt waits for the rate limits)
+async def _request(generate, prompt, model, max_retries, requests, tokens):
+    for attempt in range(max_retries + 1):
+        await take(requests)
+        if tokens is not None:
+            await take(tokens, len(prompt) / CHARS_PER_TOKEN)
+        try:
+            return await generate(prompt, model)
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == max_retries:
+                raise
+            await asyncio.sleep(delay)
+
+
+# Function to paraphrase every pending row with a pool of worker coroutines
+async def generate_rows(
+    df,
+    generate,
+    model,
+    checkpoint_path,
+    concurrency=CONCURRENCY,
+    requests_per_second=REQUESTS_PER_SECOND,
+    tokens_per_minute=None,
+    max_retries=MAX_RETRIES,
+):
+    done = load_checkpoint(checkpoint_path, df["Title"].tolist())
+    queue = asyncio.Queue()
+    for row in range(len(df)):
+        if row not in done:
+            queue.put_nowait(row)
+    requests = make_bucket(requests_per_second)
+    tokens = (
+        make_bucket(tokens_per_minute / 60, tokens_per_minute)
+        if tokens_per_minute
+        else None
+    )
+    failed = []
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+
+        async def worker():
+            while True:
+                try:
+                    row = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                prompt = PROMPT.format(abstract=df["Abstract"].iloc[row])
+                try:
+                    text = await _request(
+                        generate, prompt, model, max_retries, requests, tokens
+                    )
+                except Exception as e:
+                    failed.append((row, repr(e)))
+                    continue
+                done[row] = text
+                record = {
+                    "row": row,
+                    "Title": df["Title"].iloc[row],
+                    "ParaphrasedAbstract": text,
+                }
+                checkpoint.write(json.dumps(record) + "\n")
+                checkpoint.flush()
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done, failed
+
+
+# Function to generate paraphrases for input.csv into the Title,ParaphrasedAbstract
+# layout, resuming from the checkpoint of an interrupted run
+def run(
+    out_path,
+    model,
+    backend="mock",
+    input_file=INPUT_FILE,
+    backend_options=None,
+    **options,
+):
+    df = pd.read_csv(input_file)
+    checkpoint = checkpoint_path(out_path)
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    generate = get_backend(backend)(**(backend_options or {}))
+
+    started = time.perf_counter()
+    done, failed = asyncio.run(
+        _generate_and_close(generate, df, generate, model, checkpoint, **options)
+    )
+    elapsed = time.perf_counter() - started
+
+    # The output is only written once every row has a paraphrase
+    if not failed:
+        out = pd.DataFrame(
+            {
+                "Title": df["Title"],
+                "ParaphrasedAbstract": [done[row] for row in range(len(df))],
+            }
+        )
+        out.to_csv(out_path + ".tmp", index=False)
+        os.replace(out_path + ".tmp", out_path)
+        os.remove(checkpoint)
+    return len(done), failed, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate paraphrases for input.csv")
+    parser.add_argument("out", help="output csv, e.g. model_outputs/new_model.csv")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--backend", default="mock", help="mock, openai or module:fn")
+    parser.add_argument("--input", default=INPUT_FILE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--rps", type=float, default=REQUESTS_PER_SECOND)
+    parser.add_argument("--tpm", type=float, default=None)
+    parser.add_argument("--retries", type=int, default=MAX_RETRIES)
+    parser.add_argument("--mock-latency", type=float, default=0.05)
+    parser.add_argument("--mock-failure-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--batch-file", help="only write an OpenAI batch jsonl request file"
+    )
+    args = parser.parse_args()
+
+    if args.batch_file:
+        count = write_batch_requests(args.input, args.batch_file, args.model)
+        print(f"{count} requests written to {args.batch_file}")
+    else:
+        backend_options = (
+            {"latency": args.mock_latency, "failure_rate": args.mock_failure_rate}
+            if args.backend == "mock"
+            else {}
+        )
+        count, failed, elapsed = run(
+            args.out,
+            args.model,
+            args.backend,
+            args.input,
+            backend_options,
+            concurrency=args.concurrency,
+            requests_per_second=args.rps,
+            tokens_per_minute=args.tpm,
+            max_retries=args.retries,
+        )
+        print(f"{count} rows in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f}/s)")
+        if failed:
+            print(f"{len(failed)} rows failed; rerun to resume: {failed[:3]}")
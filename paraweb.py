@@ -0,0 +1,262 @@
+import argparse
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Modules are imported inside the commands so "--help" and light commands start
+# without loading pandas or numpy (the defaults below repeat theirs for that)
+
+CORPUS_FILE = "cleaned_abstracts_by_row.csv"
+CSV_DIR = "abstract_para"
+METRICS_DIR = os.path.join(".paraweb_cache", "metrics")
+H_EVALS_DIR = "H_Evals"
+
+
+# Function to compute the n-gram (and optionally the model-based) metric files
+def metrics_command(args):
+    import metrics_pipeline
+
+    written, rescored = metrics_pipeline.run(
+        args.corpus,
+        args.out_dir,
+        args.workers,
+        incremental=not args.full,
+        chunk_rows=args.chunk_rows,
+    )
+    for path in written:
+        print(path)
+    print(f"{rescored} rows rescored")
+
+    if args.embeddings:
+        import embedding_metrics
+
+        report = embedding_metrics.run(
+            args.corpus,
+            args.out_dir,
+            args.backend,
+            threads=args.workers,
+            quantize=args.quantize,
+        )
+        for metric, stats in report.items():
+            print(f"{metric}: {stats['pairs']} pairs in {stats['seconds']}s")
+
+
+# Function to merge every annotator's H_Evals scores into one csv
+def merge_command(args):
+    import score_store
+
+    files, rows = score_store.merge_all(args.out, args.h_evals_dir, args.workers)
+    print(f"{rows} scores from {files} files written to {args.out}")
+
+
+# Function to bring the score summary up to date and print or write it
+def summaries_command(args):
+    import summaries
+
+    summary = summaries.refresh(args.csv_dir, args.h_evals_dir, args.workers)
+    tables = {
+        "metric_summary.csv": summaries.metric_summary(summary),
+        "human_summary.csv": summaries.human_summary(summary),
+    }
+    for file_name, table in tables.items():
+        if args.out_dir:
+            os.makedirs(args.out_dir, exist_ok=True)
+            path = os.path.join(args.out_dir, file_name)
+            table.to_csv(path, index=False)
+            print(path)
+        else:
+            print(table.to_string(index=False))
+
+
+# Function to run the model-vs-model significance tests and print or write them
+def significance_command(args):
+    import significance
+
+    results = significance.run(
+        args.csv_dir, args.h_evals_dir, args.resamples, args.workers, args.seed
+    )
+    if args.out:
+        results.to_csv(args.out, index=False)
+        print(args.out)
+    else:
+        print(results.round(4).to_string(index=False))
+
+
+# Function to write the entries to rate next for a model as a sample file
+def sample_command(args):
+    import sampling
+
+    sampling.write_sample(args.model, args.out, args.strategy, args.size, args.target)
+    print(args.out)
+
+
+# Function to convert the corpus and abstract_para files into the columnar store
+def store_command(args):
+    import columnar_store
+
+    for name in columnar_store.convert_csvs(args.corpus, args.csv_dir):
+        print(columnar_store.table_path(name))
+
+
+# Function to write derived tables out as csv files
+def export_command(args):
+    os.makedirs(args.out_dir, exist_ok=True)
+    if args.kind == "tables":
+        import columnar_store
+
+        if not columnar_store.available():
+            sys.exit("The columnar store is empty; run 'paraweb store' first")
+        names = args.names or columnar_store.list_tables()
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            paths = list(
+                pool.map(columnar_store.export_csv, names, [args.out_dir] * len(names))
+            )
+    elif args.kind == "scores":
+        import score_store
+
+        pairs = [
+            score_store.parse_scores_file(path)
+            for path in score_store.list_scores_files(args.h_evals_dir)
+        ]
+        out_paths = [
+            score_store.scores_path(user, model, args.out_dir) for user, model in pairs
+        ]
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            paths = list(
+                pool.map(
+                    score_store.export_csv,
+                    [user for user, _ in pairs],
+                    [model for _, model in pairs],
+                    out_paths,
+                    [args.h_evals_dir] * len(pairs),
+                )
+            )
+    elif args.kind == "sentences":
+        import model_registry
+        import sentence_alignment
+
+        paths = []
+        for name, model_path in model_registry.all_models().items():
+            if args.names and name not in args.names:
+                continue
+            sentence_alignment.load(model_path, workers=args.workers)
+            path = sentence_alignment.table_path(model_path)
+            paths.append(shutil.copy(path, args.out_dir))
+    else:
+        import copy_detection
+        import model_registry
+
+        copy_detection.load(model_registry.all_models())
+        paths = [shutil.copy(copy_detection.REPORT_FILE, args.out_dir)]
+    for path in paths:
+        print(path)
+
+
+# Function to build the command line parser
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="paraweb", description="Batch jobs for the ParaWeb evaluation data"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--workers", type=int, default=None, help="processes (default: all cores)"
+    )
+
+    metrics = commands.add_parser(
+        "metrics", parents=[common], help="compute the automatic metric files"
+    )
+    metrics.add_argument("--corpus", default=CORPUS_FILE)
+    metrics.add_argument(
+        "--out-dir",
+        default=METRICS_DIR,
+        help=f"where to write the score files (pass {CSV_DIR} to replace the "
+        "shipped reference files)",
+    )
+    metrics.add_argument("--chunk-rows", type=int, default=10000)
+    metrics.add_argument(
+        "--full", action="store_true", help="rescore every row, ignoring the cache"
+    )
+    metrics.add_argument(
+        "--embeddings", action="store_true", help="also run BERTScore and T5 metrics"
+    )
+    metrics.add_argument("--backend", choices=["torch", "onnx"], default="torch")
+    metrics.add_argument(
+        "--quantize",
+        action="store_true",
+        help="int8 dynamic quantization for the --embeddings models",
+    )
+    metrics.set_defaults(handler=metrics_command)
+
+    merge = commands.add_parser(
+        "merge", parents=[common], help="merge the H_Evals files into one csv"
+    )
+    merge.add_argument("out", help="merged csv path")
+    merge.add_argument("--h-evals-dir", default=H_EVALS_DIR)
+    merge.set_defaults(handler=merge_command)
+
+    summary = commands.add_parser(
+        "summaries", parents=[common], help="update the cached score summary"
+    )
+    summary.add_argument("--csv-dir", default=CSV_DIR)
+    summary.add_argument("--h-evals-dir", default=H_EVALS_DIR)
+    summary.add_argument("--out-dir", default=None, help="write csv files here")
+    summary.set_defaults(handler=summaries_command)
+
+    tests = commands.add_parser(
+        "significance",
+        parents=[common],
+        help="bootstrap and permutation tests for every pair of models",
+    )
+    tests.add_argument("--csv-dir", default=CSV_DIR)
+    tests.add_argument("--h-evals-dir", default=H_EVALS_DIR)
+    tests.add_argument("--resamples", type=int, default=10000)
+    tests.add_argument("--seed", type=int, default=0)
+    tests.add_argument("--out", default=None, help="csv path for the results")
+    tests.set_defaults(handler=significance_command)
+
+    sample = commands.add_parser(
+        "sample", help="pick the entries annotators should rate next"
+    )
+    sample.add_argument("model", help="model name, e.g. gpt-4o")
+    sample.add_argument(
+        "--strategy",
+        choices=["stratified", "metric", "annotator", "active"],
+        default="active",
+    )
+    sample.add_argument("--size", type=int, default=100)
+    sample.add_argument("--target", type=int, default=2, help="ratings per entry")
+    sample.add_argument("--out", default="sample.csv")
+    sample.set_defaults(handler=sample_command)
+
+    store = commands.add_parser(
+        "store", help="convert the metric csv files into the columnar store"
+    )
+    store.add_argument("--corpus", default=CORPUS_FILE)
+    store.add_argument("--csv-dir", default=CSV_DIR)
+    store.set_defaults(handler=store_command)
+
+    export = commands.add_parser(
+        "export", parents=[common], help="write derived tables as csv files"
+    )
+    export.add_argument(
+        "kind",
+        choices=["tables", "scores", "sentences", "copy"],
+        help="columnar store tables, compacted H_Evals files, aligned sentence "
+        "pairs or the copy-detection report",
+    )
+    export.add_argument("--out-dir", default="export")
+    export.add_argument("--names", nargs="+", help="only these tables or models")
+    export.add_argument("--h-evals-dir", default=H_EVALS_DIR)
+    export.set_defaults(handler=export_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Profiling is off unless PARAWEB_PROFILE=1; timers then cost one flag check
+ENABLED = os.environ.get("PARAWEB_PROFILE") == "1"
+# With PARAWEB_PROFILE_MEMORY=1 steps also record the bytes they allocated
+# (tracemalloc slows everything down, so it is separate from timing)
+TRACE_MEMORY = os.environ.get("PARAWEB_PROFILE_MEMORY") == "1"
+# Users who see the timing panel in the sidebar
+ADMIN_USERS = [u for u in os.environ.get("PARAWEB_ADMINS", "").split(",") if u]
+
+# Written after every rerun while profiling is on (in corpus_store.CACHE_DIR,
+# repeated here because corpus_store imports this module)
+METRICS_FILE = os.path.join(".paraweb_cache", "metrics.prom")
+HISTORY = 100
+
+logger = logging.getLogger("paraweb.profile")
+
+# Finished reruns (newest last) and per-step totals since the process started
+_history = deque(maxlen=HISTORY)
+_totals = {}
+_reruns = [0, 0.0]
+_lock = threading.Lock()
+# Rerun being recorded by the current thread (one per Streamlit session)
+_local = threading.local()
+_disabled = contextlib.nullcontext()
+
+
+# Function to turn profiling on or off at runtime
+def enable(flag=True):
+    global ENABLED
+    ENABLED = flag
+    if flag and TRACE_MEMORY and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+# Function to check whether a user may see the timing panel
+def is_admin(username):
+    return username in ADMIN_USERS
+
+
+# Function to get the peak resident memory of the process in bytes
+def peak_rss():
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# Function to start recording the steps of a rerun on this thread
+def start_rerun():
+    if not ENABLED:
+        return
+    _local.rerun = {"started": time.perf_counter(), "steps": []}
+    _local.depth = 0
+
+
+# Function to finish the rerun of this thread and publish its timings
+# (label names the page that was shown)
+def end_rerun(label=""):
+    rerun = getattr(_local, "rerun", None)
+    if not ENABLED or rerun is None:
+        return None
+    _local.rerun = None
+    rerun["label"] = label
+    rerun["seconds"] = time.perf_counter() - rerun.pop("started")
+    rerun["peak_rss"] = peak_rss()
+    rerun["time"] = time.time()
+    with _lock:
+        _history.append(rerun)
+        _reruns[0] += 1
+        _reruns[1] += rerun["seconds"]
+    logger.info(json.dumps(rerun))
+    write_metrics()
+    return rerun
+
+
+# Function to add a finished step to the rerun and the process totals
+def _record(name, seconds, depth, allocated=None):
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        step = {"step": name, "seconds": round(seconds, 6), "depth": depth}
+        if allocated is not None:
+            step["allocated"] = allocated
+        rerun["steps"].append(step)
+    with _lock:
+        total = _totals.setdefault(name, [0, 0.0, 0.0])
+        total[0] += 1
+        total[1] += seconds
+        total[2] = max(total[2], seconds)
+
+
+# Function to time a block of code as a named step
+@contextlib.contextmanager
+def _timer(name):
+    depth = getattr(_local, "depth", 0)
+    _local.depth = depth + 1
+    tracing = tracemalloc.is_tracing()
+    before = tracemalloc.get_traced_memory()[0] if tracing else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        _local.depth = depth
+        allocated = tracemalloc.get_traced_memory()[0] - before if tracing else None
+        _record(name, seconds, depth, allocated)
+
+
+# Function to get a context manager timing a step (a shared no-op when disabled)
+def timer(name):
+    if not ENABLED:
+        return _disabled
+    return _timer(name)
+
+
+# Function to time every call of a function as a step (decorator)
+def timed(name=None):
+    def decorator(func):
+        step = name or f"{func.__module__}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with _timer(step):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Function to get the recorded reruns, newest first
+def history():
+    with _lock:
+        return list(reversed(_history))
+
+
+# Function to render the process totals in the Prometheus text format
+def prometheus_text():
+    with _lock:
+        totals = {name: list(total) for name, total in sorted(_totals.items())}
+        reruns, rerun_seconds = _reruns
+    lines = [
+        "# HELP paraweb_step_seconds Time spent in instrumented steps.",
+        "# TYPE paraweb_step_seconds summary",
+    ]
+    for name, (count, seconds, _) in totals.items():
+        lines.append(f'paraweb_step_seconds_sum{{step="{name}"}} {seconds:.6f}')
+        lines.append(f'paraweb_step_seconds_count{{step="{name}"}} {count}')
+    lines += [
+        "# HELP paraweb_step_max_seconds Slowest call of each step.",
+        "# TYPE paraweb_step_max_seconds gauge",
+    ]
+    for name, (_, _, slowest) in totals.items():
+        lines.append(f'paraweb_step_max_seconds{{step="{name}"}} {slowest:.6f}')
+    lines += [
+        "# HELP paraweb_rerun_seconds Time spent in whole page reruns.",
+        "# TYPE paraweb_rerun_seconds summary",
+        f"paraweb_rerun_seconds_sum {rerun_seconds:.6f}",
+        f"paraweb_rerun_seconds_count {reruns}",
+        "# HELP paraweb_peak_rss_bytes Peak resident memory of the process.",
+        "# TYPE paraweb_peak_rss_bytes gauge",
+        f"paraweb_peak_rss_bytes {peak_rss()}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+# Function to write the Prometheus text to a file (for a textfile collector)
+def write_metrics(path=None):
+    path = path or METRICS_FILE
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+enable(ENABLED)
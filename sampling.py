@@ -0,0 +1,419 @@
+import argparse
+import heapq
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import agreement
+import alignment_index
+import corpus_store
+import score_store
+import significance
+
+INPUT_FILE = alignment_index.INPUT_FILE
+CORPUS_FILE = agreement.CORPUS_FILE
+CSV_DIR = significance.CSV_DIR
+DIMENSIONS = agreement.DIMENSIONS
+
+# Abstract length strata (quantiles of the source word count)
+N_STRATA = 4
+# Metrics whose percentile ranks are compared: a paraphrase that ranks high on
+# word overlap but low on meaning (or the reverse) is worth a human look
+LEXICAL_METRICS = ["bleu", "google_bleu", "meteor", "rouge1", "rouge2", "rougeL"]
+SEMANTIC_METRICS = ["stsb", "bertscore_f1"]
+# Annotator disagreement (mean std of the dimensions, scaled to 0-1) from which
+# an item that reached its target gets one extra rating to settle it
+ADJUDICATE_AT = 0.25
+# Entries listed per claim (more than the sessions that can hold leases at once)
+CANDIDATES = 64
+
+# How each strategy weighs metric and annotator disagreement, and whether it
+# keeps every abstract length stratum covered in proportion to its size
+# ("coverage" is the coordinator's own fewest-ratings-first order)
+STRATEGIES = {
+    "coverage": None,
+    "stratified": {"metric": 0.0, "annotator": 0.0, "stratify": True},
+    "metric": {"metric": 1.0, "annotator": 0.0, "stratify": False},
+    "annotator": {"metric": 0.0, "annotator": 1.0, "stratify": False},
+    "active": {"metric": 1.0, "annotator": 1.0, "stratify": True},
+}
+
+# Sampling state, keyed by model name
+_states = {}
+_lock = threading.Lock()
+
+
+# Function to split entries into length strata of (nearly) equal size
+def length_strata(abstracts, n_strata=N_STRATA):
+    words = pd.Series([len(str(a).split()) for a in abstracts], dtype=float)
+    if len(words) < n_strata:
+        return np.zeros(len(words), dtype=int)
+    ranks = words.rank(method="first")
+    return pd.qcut(ranks, n_strata, labels=False).to_numpy(dtype=int)
+
+
+# Function to score how much the lexical and semantic metrics disagree on every
+# entry (difference of their mean percentile ranks, 0 when a group is missing)
+def metric_disagreement(model, input_path=INPUT_FILE, csv_dir=CSV_DIR):
+    entries = corpus_store.row_count(input_path)
+    disagreement = np.zeros(entries)
+    if not os.path.exists(csv_dir) or not os.path.exists(CORPUS_FILE):
+        return disagreement
+    suffix = score_store.model_suffix(model)
+    tables = significance.load_metric_tables(csv_dir)
+    groups = []
+    for metrics in (LEXICAL_METRICS, SEMANTIC_METRICS):
+        ranks = [
+            tables[m][suffix].rank(pct=True)
+            for m in metrics
+            if m in tables and suffix in tables[m]
+        ]
+        groups.append(pd.concat(ranks, axis=1).mean(axis=1) if ranks else None)
+    if groups[0] is None or groups[1] is None:
+        return disagreement
+    spread = (groups[0] - groups[1]).abs().dropna()
+
+    corpus = corpus_store.load_csv(CORPUS_FILE).set_index("No")["Title"]
+    for no, value in spread.items():
+        rows = alignment_index.find_title(corpus.get(no, ""), input_path)
+        if rows:
+            disagreement[rows[0]] = value
+    return disagreement
+
+
+# Function to score how much annotators disagree on one item (mean standard
+# deviation of the dimensions, divided by 2, the largest possible on 1-5 scales)
+def annotator_disagreement(vectors):
+    if len(vectors) < 2:
+        return 0.0
+    spread = np.nanstd(np.array(vectors), axis=0)
+    return float(np.nanmean(spread) / 2) if np.isfinite(spread).any() else 0.0
+
+
+# Function to get the change markers of the files the static item data comes from
+def _static_keys(input_path, csv_dir):
+    paths = [input_path, CORPUS_FILE]
+    if os.path.exists(csv_dir):
+        paths += [
+            os.path.join(csv_dir, f)
+            for f in sorted(os.listdir(csv_dir))
+            if f.endswith(".csv")
+        ]
+    return [(p,) + tuple(corpus_store.file_key(p)) for p in paths if os.path.exists(p)]
+
+
+# Function to build the sampling state of a model (no ratings read yet)
+def _build_state(model, input_path, csv_dir, seed):
+    abstracts = corpus_store.load_csv(input_path)["Abstract"]
+    entries = len(abstracts)
+    strata = length_strata(abstracts)
+    return {
+        "keys": _static_keys(input_path, csv_dir),
+        "stratum": strata,
+        "metric": metric_disagreement(model, input_path, csv_dir),
+        # Random tie-break order, so equal priorities form a random sample
+        "tie": np.random.default_rng(seed).permutation(entries),
+        "version": np.zeros(entries, dtype=np.int64),
+        # Per entry: scores file -> dimension vector
+        "ratings": [dict() for _ in range(entries)],
+        # Per scores file: its change marker and entry -> vector
+        "files": {},
+        # Entries with at least one rating, per stratum
+        "rated": np.zeros(N_STRATA, dtype=np.int64),
+        "sizes": np.bincount(strata, minlength=N_STRATA),
+        # Per (strategy, target): one heap per stratum
+        "heaps": {},
+    }
+
+
+# Function to get the rating limit of an entry (one extra to settle disagreement)
+def _limit(state, entry, weights, target):
+    if weights["annotator"] and (
+        annotator_disagreement(list(state["ratings"][entry].values())) >= ADJUDICATE_AT
+    ):
+        return target + 1
+    return target
+
+
+# Function to get the coverage level of an entry with the given ratings count
+# (strategies that weigh annotator disagreement put every rated entry on one
+# level, so settling a dispute comes before a routine second rating)
+def _level(weights, count):
+    return min(count, 1) if weights["annotator"] else count
+
+
+# Function to get the heap key of an entry, or None when it needs no rating
+# (lowest level first, then the most disagreement, then the random order)
+def _priority(state, entry, weights, target):
+    ratings = state["ratings"][entry]
+    if len(ratings) >= _limit(state, entry, weights, target):
+        return None
+    score = weights["metric"] * state["metric"][entry] + weights[
+        "annotator"
+    ] * annotator_disagreement(list(ratings.values()))
+    return (
+        _level(weights, len(ratings)),
+        -round(float(score), 9),
+        int(state["tie"][entry]),
+        entry,
+        int(state["version"][entry]),
+    )
+
+
+# Function to push the current key of an entry onto every built heap
+def _push(state, entry):
+    for (strategy, target), heaps in state["heaps"].items():
+        key = _priority(state, entry, STRATEGIES[strategy], target)
+        if key is not None:
+            heapq.heappush(heaps[state["stratum"][entry]], key)
+
+
+# Function to build the heaps of a strategy and target
+def _heaps(state, strategy, target):
+    heaps = state["heaps"].get((strategy, target))
+    if heaps is None:
+        weights = STRATEGIES[strategy]
+        heaps = [[] for _ in range(N_STRATA)]
+        for entry in range(len(state["tie"])):
+            key = _priority(state, entry, weights, target)
+            if key is not None:
+                heaps[state["stratum"][entry]].append(key)
+        for heap in heaps:
+            heapq.heapify(heap)
+        state["heaps"][(strategy, target)] = heaps
+    return heaps
+
+
+# Function to apply the ratings of one scores file to the items they touch
+def _apply_file(state, path, vectors):
+    old = state["files"].get(path, (None, {}))[1]
+    for entry in set(old) | set(vectors):
+        vector = vectors.get(entry)
+        if entry in old and vector is not None and np.array_equal(old[entry], vector):
+            continue
+        ratings = state["ratings"][entry]
+        was_rated = bool(ratings)
+        if vector is None:
+            ratings.pop(path, None)
+        else:
+            ratings[path] = vector
+        state["rated"][state["stratum"][entry]] += bool(ratings) - was_rated
+        state["version"][entry] += 1
+        _push(state, entry)
+
+
+# Function to read the ratings of one scores file as entry -> dimension vector
+def _read_file(path, input_path):
+    vectors = {}
+    try:
+        df = score_store.read_scores_file(path)
+    except (ValueError, OSError):
+        return vectors
+    for column in DIMENSIONS:
+        df[column] = pd.to_numeric(df.get(column), errors="coerce")
+    for title, vector in zip(df["Title"], df[DIMENSIONS].to_numpy(dtype=float)):
+        rows = alignment_index.find_title(title, input_path)
+        if rows:
+            vectors[rows[0]] = vector
+    return vectors
+
+
+# Function to bring a model's state up to date: rebuilt when the corpus or metric
+# files change, otherwise only the scores files that changed are re-read
+def _refresh(model, input_path, csv_dir, h_evals_dir, seed):
+    state = _states.get(model)
+    if state is None or state["keys"] != _static_keys(input_path, csv_dir):
+        state = _states[model] = _build_state(model, input_path, csv_dir, seed)
+    paths = [
+        path
+        for path in score_store.list_scores_files(h_evals_dir)
+        if score_store.parse_scores_file(path)[1] == model
+    ]
+    for path in paths:
+        key = corpus_store.file_key(path)
+        if state["files"].get(path, (None,))[0] != key:
+            vectors = _read_file(path, input_path)
+            _apply_file(state, path, vectors)
+            state["files"][path] = (key, vectors)
+    for path in set(state["files"]) - set(paths):
+        _apply_file(state, path, {})
+        del state["files"][path]
+    return state
+
+
+# Function to order the strata to draw from: the one furthest behind its share
+# of rated entries first
+def _stratum_order(rated, sizes):
+    return list(np.lexsort((-sizes, rated / np.maximum(sizes, 1))))
+
+
+# Function to pop the best current key of the given strata that the accept
+# callback takes, pushing back everything skipped (returns (stratum, key))
+def _select(state, heaps, strata, accept, weights, target):
+    skipped = []
+    found = None
+    while found is None:
+        best = None
+        for stratum in strata:
+            heap = heaps[stratum]
+            # Drop keys left behind by earlier updates of their entry
+            while heap and heap[0][-1] != state["version"][heap[0][-2]]:
+                heapq.heappop(heap)
+            if heap and (best is None or heap[0] < heaps[best][0]):
+                best = stratum
+        if best is None:
+            break
+        key = heapq.heappop(heaps[best])
+        entry = key[-2]
+        if accept(entry, _limit(state, entry, weights, target)):
+            found = (best, key)
+        else:
+            skipped.append((best, key))
+    for stratum, key in skipped:
+        heapq.heappush(heaps[stratum], key)
+    return found
+
+
+# Function to pop the next key for a strategy: from the most under-covered
+# stratum that still has work, or from all strata when it does not stratify
+def _choose(state, heaps, rated, accept, weights, target):
+    if not weights["stratify"]:
+        return _select(state, heaps, range(N_STRATA), accept, weights, target)
+    for stratum in _stratum_order(rated, state["sizes"]):
+        found = _select(state, heaps, [stratum], accept, weights, target)
+        if found is not None:
+            return found
+    return None
+
+
+# Function to list the entries an annotator should see next, best first, as
+# (entry, rating limit, ratings so far); entries the annotator already rated are
+# left out, and the caller vetoes the rest against its leases
+def candidates(
+    model,
+    strategy="active",
+    target=2,
+    annotator=None,
+    count=CANDIDATES,
+    input_path=INPUT_FILE,
+    csv_dir=CSV_DIR,
+    h_evals_dir=score_store.H_EVALS_DIR,
+    seed=0,
+):
+    weights = STRATEGIES[strategy]
+    own = (
+        score_store.scores_path(annotator, model, h_evals_dir)
+        if annotator is not None
+        else None
+    )
+    found = []
+
+    def take(entry, limit):
+        ratings = state["ratings"][entry]
+        if own in ratings:
+            return False
+        found.append((entry, limit, len(ratings)))
+        return len(found) >= count
+
+    with _lock:
+        state = _refresh(model, input_path, csv_dir, h_evals_dir, seed)
+        heaps = _heaps(state, strategy, target)
+        last = _choose(state, heaps, state["rated"], take, weights, target)
+        # The entries stay queued until their ratings arrive
+        if last is not None:
+            heapq.heappush(heaps[last[0]], last[1])
+    return found
+
+
+# Function to plan the next entries to rate, as if each one were rated once in
+# turn (for a sample file; the live state is left untouched)
+def plan(
+    model,
+    strategy="active",
+    size=100,
+    target=2,
+    input_path=INPUT_FILE,
+    csv_dir=CSV_DIR,
+    h_evals_dir=score_store.H_EVALS_DIR,
+    seed=0,
+):
+    weights = STRATEGIES[strategy]
+    with _lock:
+        state = _refresh(model, input_path, csv_dir, h_evals_dir, seed)
+        heaps = [list(heap) for heap in _heaps(state, strategy, target)]
+        rated = state["rated"].copy()
+        ratings = [len(r) for r in state["ratings"]]
+        picked = []
+        while len(picked) < size:
+            found = _choose(
+                state,
+                heaps,
+                rated,
+                lambda entry, limit: ratings[entry] < limit,
+                weights,
+                target,
+            )
+            if found is None:
+                break
+            stratum, key = found
+            entry = key[-2]
+            picked.append(entry)
+            rated[stratum] += ratings[entry] == 0
+            ratings[entry] += 1
+            # Queue it again one rating further down (a simulated rating carries
+            # no scores, so its disagreement stays as it is)
+            if ratings[entry] < _limit(state, entry, weights, target):
+                heapq.heappush(
+                    heaps[stratum], (_level(weights, ratings[entry]),) + key[1:]
+                )
+        return picked
+
+
+# Function to describe why an entry is a candidate (shown next to a claim)
+def explain(model, entry):
+    with _lock:
+        state = _states.get(model)
+        if state is None or entry >= len(state["tie"]):
+            return None
+        ratings = list(state["ratings"][entry].values())
+        return {
+            "stratum": int(state["stratum"][entry]) + 1,
+            "ratings": len(ratings),
+            "metric_disagreement": round(float(state["metric"][entry]), 3),
+            "annotator_disagreement": round(annotator_disagreement(ratings), 3),
+        }
+
+
+# Function to write a sample file in the layout of random_sample_100.csv
+def write_sample(model, out_path, strategy="active", size=100, target=2):
+    entries = plan(model, strategy, size, target)
+    input_df = corpus_store.load_csv(INPUT_FILE)
+    sample = input_df.iloc[entries][["Title", "Abstract"]].copy()
+    sample.insert(0, "No", [entry + 1 for entry in entries])
+    details = pd.DataFrame([explain(model, entry) for entry in entries])
+    sample = pd.concat([sample.reset_index(drop=True), details], axis=1)
+    sample.to_csv(out_path, index=False)
+    return sample
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the entries to rate next")
+    parser.add_argument("model", help="model name, e.g. gpt-4o")
+    parser.add_argument(
+        "--strategy",
+        choices=[name for name, weights in STRATEGIES.items() if weights],
+        default="active",
+    )
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--target", type=int, default=2)
+    parser.add_argument("--out", default=None, help="csv path for the sample")
+    args = parser.parse_args()
+
+    if args.out:
+        write_sample(args.model, args.out, args.strategy, args.size, args.target)
+        print(args.out)
+    else:
+        for entry in plan(args.model, args.strategy, args.size, args.target):
+            print(entry + 1, explain(args.model, entry))
@@ -0,0 +1,223 @@
+import contextlib
+import csv
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import corpus_store
+import profiling
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+H_EVALS_DIR = "H_Evals"
+
+SCORE_COLUMNS = [
+    "Title",
+    "Semantic/Adequacy Score",
+    "Syntactic/Novelty Score",
+    "Fluency Score",
+    "Overall Score",
+]
+
+# Model names used in H_Evals file names -> column suffixes in abstract_para
+MODEL_SUFFIXES = {
+    "gpt-4o": "gpt4o",
+    "Llama3 70b": "llama3",
+    "gemini 1.5 pro": "gemini",
+}
+
+# Lock files of the scores files (kept out of H_Evals)
+LOCKS_DIR = os.path.join(corpus_store.CACHE_DIR, "locks")
+
+# Number of appends to one file after which it is compacted
+COMPACT_EVERY = 200
+
+_appends = {}
+_appends_lock = threading.Lock()
+
+
+# Function to get the per-user/per-model scores file (same naming as before)
+def scores_path(username, model, h_evals_dir=H_EVALS_DIR):
+    return os.path.join(h_evals_dir, f"{username}_{model}_scores.csv")
+
+
+# Function to split a scores file name into (username, model)
+def parse_scores_file(scores_file):
+    stem = os.path.basename(scores_file)[: -len("_scores.csv")]
+    username, _, model = stem.partition("_")
+    return username, model
+
+
+# Function to get the abstract_para column suffix of a model name
+def model_suffix(model):
+    return MODEL_SUFFIXES.get(model, model.replace(" ", "").replace("-", "").lower())
+
+
+# Function to list every scores file in the H_Evals directory
+def list_scores_files(h_evals_dir=H_EVALS_DIR):
+    if not os.path.exists(h_evals_dir):
+        return []
+    return sorted(
+        os.path.join(h_evals_dir, f)
+        for f in os.listdir(h_evals_dir)
+        if f.endswith("_scores.csv")
+    )
+
+
+# Function to get the lock file of a data file (named after its absolute path,
+# so every process locking the same file uses the same lock)
+def lock_path(path):
+    digest = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(LOCKS_DIR, f"{os.path.basename(path)}.{digest}.lock")
+
+
+# Function to hold an exclusive lock shared by every process writing a file
+@contextlib.contextmanager
+def file_lock(path):
+    os.makedirs(LOCKS_DIR, exist_ok=True)
+    with open(lock_path(path), "a+b") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# Function to append one row to a csv journal, writing the header if needed
+def append_row(path, columns, values):
+    with open(path, "a+b") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        prefix = b""
+        if size > 0:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                prefix = b"\n"
+        f.seek(0, os.SEEK_END)
+        text = _csv_line(values)
+        if size == 0:
+            text = _csv_line(columns) + text
+        f.write(prefix + text.encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# Function to format values as one csv line the way pandas writes it
+def _csv_line(values):
+    out = io.StringIO()
+    csv.writer(out, lineterminator="\n").writerow(values)
+    return out.getvalue()
+
+
+# Function to save the scores of one entry in O(1) (append-only)
+@profiling.timed("score_store.save_scores")
+def save_scores(username, model, title, scores, h_evals_dir=H_EVALS_DIR):
+    os.makedirs(h_evals_dir, exist_ok=True)
+    path = scores_path(username, model, h_evals_dir)
+    values = [title] + [scores[column] for column in SCORE_COLUMNS[1:]]
+    with file_lock(path):
+        append_row(path, SCORE_COLUMNS, values)
+
+    with _appends_lock:
+        _appends[path] = _appends.get(path, 0) + 1
+        should_compact = _appends[path] >= COMPACT_EVERY
+        if should_compact:
+            _appends[path] = 0
+    if should_compact:
+        compact(path)
+
+
+# Function to drop superseded rows, keeping the last score saved per title
+def last_write_wins(df, key="Title"):
+    return df.drop_duplicates(subset=[key], keep="last").reset_index(drop=True)
+
+
+# Function to read a scores file, skipping malformed lines left by hand edits
+def read_scores_file(path):
+    return last_write_wins(pd.read_csv(path, on_bad_lines="skip"))
+
+
+# Function to read the current scores of one user and model
+def read_scores(username, model, h_evals_dir=H_EVALS_DIR):
+    path = scores_path(username, model, h_evals_dir)
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=SCORE_COLUMNS)
+    return read_scores_file(path)
+
+
+# Function to rewrite a journal so it holds one row per title
+@profiling.timed("score_store.compact")
+def compact(path, key="Title"):
+    with file_lock(path):
+        if not os.path.exists(path):
+            return 0
+        try:
+            df = pd.read_csv(path)
+        except pd.errors.ParserError:
+            # Never rewrite a file that cannot be parsed without losing rows
+            return 0
+        compacted = last_write_wins(df, key)
+        if len(compacted) != len(df):
+            tmp_path = path + ".tmp"
+            compacted.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        return len(df) - len(compacted)
+
+
+# Function to compact every scores file in the H_Evals directory
+def compact_all(h_evals_dir=H_EVALS_DIR):
+    removed = 0
+    for path in list_scores_files(h_evals_dir):
+        removed += compact(path)
+    return removed
+
+
+# Function to export the compacted scores of one user and model to a csv file
+def export_csv(username, model, out_path, h_evals_dir=H_EVALS_DIR):
+    read_scores(username, model, h_evals_dir).to_csv(out_path, index=False)
+    return out_path
+
+
+# Function to read one scores file as rows of the merged table (runs in a worker)
+def _merged_rows(path):
+    annotator, model = parse_scores_file(path)
+    df = read_scores_file(path)
+    df.insert(0, "Model", model)
+    df.insert(0, "Annotator", annotator)
+    return df.reindex(columns=["Annotator", "Model"] + SCORE_COLUMNS)
+
+
+# Function to merge every annotator's current scores into one csv
+# (files are read across a process pool and appended one at a time)
+def merge_all(out_path, h_evals_dir=H_EVALS_DIR, workers=None):
+    paths = list_scores_files(h_evals_dir)
+    rows = 0
+    with contextlib.ExitStack() as stack:
+        if workers == 1 or len(paths) <= 1:
+            frames = map(_merged_rows, paths)
+        else:
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            frames = pool.map(_merged_rows, paths)
+        with open(out_path + ".tmp", "w", encoding="utf-8", newline="") as out:
+            out.write(_csv_line(["Annotator", "Model"] + SCORE_COLUMNS))
+            for df in frames:
+                df.to_csv(out, header=False, index=False)
+                rows += len(df)
+    os.replace(out_path + ".tmp", out_path)
+    return len(paths), rows
@@ -0,0 +1,316 @@
+import json
+import os
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import alignment_index
+import corpus_store
+import ngram_kernels
+import profiling
+import token_cache
+
+INPUT_FILE = alignment_index.INPUT_FILE
+SENTENCES_DIR = os.path.join(corpus_store.CACHE_DIR, "sentences")
+
+# Cells on each side of the diagonal searched by the alignment (the diagonal
+# follows the ratio of the sentence counts, and the band widens by the slope so
+# the end cell always stays reachable)
+BAND = 3
+# Subtracted from a bead that merges sentences, so merges need real evidence
+MERGE_PENALTY = 0.1
+# Bump whenever splitting, alignment or the scores change
+VERSION = "1"
+
+# Sentence ends: . ! or ? (optionally closed by quotes or brackets) followed by
+# whitespace and an uppercase letter, digit or opening bracket
+_BOUNDARY_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+# Words that end with a period without ending the sentence
+ABBREVIATIONS = {
+    "al",
+    "approx",
+    "ca",
+    "cf",
+    "dr",
+    "e.g",
+    "eq",
+    "etc",
+    "fig",
+    "figs",
+    "i.e",
+    "mr",
+    "mrs",
+    "ms",
+    "no",
+    "prof",
+    "ref",
+    "refs",
+    "vs",
+}
+
+# Columns describing a sentence pair (the rest are its scores)
+PAIR_COLUMNS = ["Entry", "Source", "Paraphrase", "SourceText", "ParaphraseText"]
+
+# Alignment moves as (source sentences, paraphrase sentences)
+MOVES = [(1, 1), (1, 2), (2, 1), (1, 0), (0, 1)]
+
+# Loaded sentence tables, keyed by model file path
+_tables = {}
+_lock = threading.Lock()
+# Threads building stale tables for the app, keyed by model file path
+_builders = {}
+
+
+# Function to split an abstract into sentences
+def split_sentences(text):
+    if not isinstance(text, str) or not text.strip():
+        return []
+    sentences = []
+    start = 0
+    for boundary in _BOUNDARY_RE.finditer(text):
+        words = text[start : boundary.start()].split()
+        last = words[-1].strip(".!?\"'()[]").lower() if words else ""
+        # Initials ("J. Smith") and known abbreviations do not end a sentence
+        if last in ABBREVIATIONS or (len(last) == 1 and last.isalpha()):
+            continue
+        sentences.append(text[start : boundary.start()].strip())
+        start = boundary.end()
+    sentences.append(text[start:].strip())
+    return [s for s in sentences if s]
+
+
+# Function to compute the similarity of two token bags (unigram Dice coefficient,
+# the same number as the ROUGE-1 F-measure reported for the aligned pairs)
+def similarity(a, b):
+    total = sum(a.values()) + sum(b.values())
+    if not total:
+        return 0.0
+    return 2 * sum((a & b).values()) / total
+
+
+# Function to align source sentences to paraphrase sentences with a banded
+# dynamic program over 1-1, 1-2, 2-1 and skip beads
+# (a bead scores its similarity times the sentences it covers, so merging is
+# only worth it when the merged text matches better than the parts alone)
+def align_sentences(source, paraphrase):
+    m, n = len(source), len(paraphrase)
+    src_bags = [Counter(token_cache.tokenize(s)) for s in source]
+    para_bags = [Counter(token_cache.tokenize(s)) for s in paraphrase]
+    band = BAND + (-(-n // m) if m else n)
+    best = {(0, 0): (0.0, None)}
+    for i in range(m + 1):
+        center = i * n // m if m else 0
+        for j in range(max(center - band, 0), min(center + band, n) + 1):
+            if (i, j) == (0, 0):
+                continue
+            options = []
+            for di, dj in MOVES:
+                previous = best.get((i - di, j - dj))
+                if previous is None:
+                    continue
+                if di and dj:
+                    score = similarity(
+                        sum(src_bags[i - di : i], Counter()),
+                        sum(para_bags[j - dj : j], Counter()),
+                    ) * (di + dj) - MERGE_PENALTY * (di + dj > 2)
+                else:
+                    score = 0.0
+                options.append((previous[0] + score, (di, dj)))
+            if options:
+                best[(i, j)] = max(options)
+
+    # Walk back from the end to recover the beads
+    beads = []
+    i, j = m, n
+    while (i, j) != (0, 0):
+        di, dj = best[(i, j)][1]
+        beads.append((i - di, i, j - dj, j))
+        i, j = i - di, j - dj
+    return beads[::-1]
+
+
+# Function to align every entry of a chunk (runs inside a worker process)
+def align_rows(rows):
+    results = []
+    for entry, source_text, paraphrase_text in rows:
+        source = split_sentences(source_text)
+        paraphrase = split_sentences(paraphrase_text)
+        for s0, s1, p0, p1 in align_sentences(source, paraphrase):
+            results.append(
+                (
+                    entry,
+                    f"{s0 + 1}-{s1}" if s1 - s0 > 1 else str(s1) if s1 > s0 else "",
+                    f"{p0 + 1}-{p1}" if p1 - p0 > 1 else str(p1) if p1 > p0 else "",
+                    " ".join(source[s0:s1]),
+                    " ".join(paraphrase[p0:p1]),
+                )
+            )
+    return results
+
+
+# Function to align and score the sentences of every entry of one model file
+# (or only of the given entry indices)
+def build(
+    model_path, input_path=INPUT_FILE, workers=None, chunk_size=256, entries=None
+):
+    input_df = corpus_store.load_csv(input_path)
+    offsets = np.asarray(alignment_index.get_index(model_path, input_path)["offsets"])
+    paraphrases = corpus_store.load_csv(model_path)["ParaphrasedAbstract"].to_numpy()
+    aligned = np.where(offsets >= 0, paraphrases[np.maximum(offsets, 0)], "")
+    rows = list(zip(range(len(input_df)), input_df["Abstract"], aligned))
+    if entries is not None:
+        rows = [rows[entry] for entry in entries]
+    chunks = [rows[i : i + chunk_size] for i in range(0, len(rows), chunk_size)]
+    if workers == 1 or len(chunks) <= 1:
+        results = [align_rows(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(align_rows, chunks))
+
+    pairs = pd.DataFrame(
+        [pair for chunk in results for pair in chunk],
+        columns=["Entry", "Source", "Paraphrase", "Abstract", "Abstract_para"],
+    )
+    # Every matched sentence pair is scored in one batch by the n-gram kernels
+    matched = (pairs["Source"] != "") & (pairs["Paraphrase"] != "")
+    scores = ngram_kernels.corpus_scores(pairs[matched].reset_index(drop=True))
+    scores.columns = [c[: -len("_para")] for c in scores.columns]
+    scores.index = pairs.index[matched]
+    pairs = pairs.join(scores)
+    pairs["Entry"] += 1
+    return pairs.rename(
+        columns={"Abstract": "SourceText", "Abstract_para": "ParaphraseText"}
+    )
+
+
+# Function to get the path of the stored sentence table of a model file
+# (the keys it was built from are stored next to it as json)
+def table_path(model_path):
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(SENTENCES_DIR, f"{name}.csv")
+
+
+# Function to get the change markers of the files a table depends on
+def _file_keys(model_path, input_path):
+    return [VERSION] + [
+        [os.path.abspath(p)] + list(corpus_store.file_key(p))
+        for p in (input_path, model_path)
+    ]
+
+
+# Function to read the keys a stored table was built from (None if missing)
+def _stored_keys(model_path):
+    keys_path = table_path(model_path) + ".json"
+    if not os.path.exists(keys_path):
+        return None
+    with open(keys_path) as f:
+        return json.load(f)
+
+
+# Function to get the sentence table of a model file, rebuilding it when stale
+# (the build runs outside the lock, so other tables stay readable meanwhile)
+def load(model_path, input_path=INPUT_FILE, workers=None):
+    keys = _file_keys(model_path, input_path)
+    path = table_path(model_path)
+    with _lock:
+        table = _tables.get(model_path)
+        if table is not None and table[0] == keys:
+            return table[1]
+        pairs = None
+        if os.path.exists(path) and _stored_keys(model_path) == keys:
+            pairs = pd.read_csv(path, dtype={c: str for c in PAIR_COLUMNS[1:]})
+            pairs[PAIR_COLUMNS[1:]] = pairs[PAIR_COLUMNS[1:]].fillna("")
+    if pairs is None:
+        with profiling.timer("sentence_alignment.build"):
+            pairs = build(model_path, input_path, workers)
+        with _lock:
+            os.makedirs(SENTENCES_DIR, exist_ok=True)
+            pairs.to_csv(path + ".tmp", index=False)
+            os.replace(path + ".tmp", path)
+            keys_path = path + ".json"
+            with open(keys_path + ".tmp", "w") as f:
+                json.dump(keys, f)
+            os.replace(keys_path + ".tmp", keys_path)
+    with _lock:
+        _tables[model_path] = (keys, pairs)
+    return pairs
+
+
+# Function to get the sentence table without waiting for a build: a stale or
+# missing table is built in a background thread and None returned meanwhile
+def current(model_path, input_path=INPUT_FILE):
+    keys = _file_keys(model_path, input_path)
+    with _lock:
+        table = _tables.get(model_path)
+        if table is not None and table[0] == keys:
+            return table[1]
+        stored = os.path.exists(table_path(model_path)) and (
+            _stored_keys(model_path) == keys
+        )
+        if not stored:
+            builder = _builders.get(model_path)
+            if builder is None or not builder.is_alive():
+                builder = _builders[model_path] = threading.Thread(
+                    target=load,
+                    args=(model_path, input_path),
+                    name="sentence-table",
+                    daemon=True,
+                )
+                builder.start()
+            return None
+    return load(model_path, input_path)
+
+
+# Function to get the aligned sentence pairs of one entry (aligned on its own
+# while the table of the model file is being built)
+def entry_pairs(model_path, entry_index, input_path=INPUT_FILE):
+    pairs = current(model_path, input_path)
+    if pairs is None:
+        return build(model_path, input_path, workers=1, entries=[entry_index])
+    entries = pairs["Entry"].to_numpy()
+    lo = np.searchsorted(entries, entry_index + 1, "left")
+    hi = np.searchsorted(entries, entry_index + 1, "right")
+    return pairs.iloc[lo:hi]
+
+
+# Function to summarize the sentence scores of a model file (None while its
+# table is being built)
+def summary(model_path, input_path=INPUT_FILE):
+    pairs = current(model_path, input_path)
+    if pairs is None:
+        return None
+    matched = pairs.dropna(subset=["rouge1"])
+    metrics = [c for c in matched.columns if c not in PAIR_COLUMNS]
+    stats = matched[metrics].agg(["mean", "std"]).T
+    stats["pairs"] = len(matched)
+    stats["merged_pct"] = round(
+        100
+        * (
+            matched["Source"].str.contains("-")
+            | matched["Paraphrase"].str.contains("-")
+        ).mean(),
+        2,
+    )
+    stats["unmatched"] = len(pairs) - len(matched)
+    return stats.round(4)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Align and score sentences")
+    parser.add_argument(
+        "models",
+        nargs="*",
+        default=["gemini_15_pro.csv", "gpt_4o.csv", "llama3_70b.csv"],
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    for model_path in args.models:
+        pairs = load(model_path, workers=args.workers)
+        print(table_path(model_path), f"{len(pairs)} sentence pairs")
+        print(summary(model_path))
@@ -0,0 +1,201 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import agreement
+import score_store
+import summaries
+
+CSV_DIR = summaries.CSV_DIR
+DIMENSIONS = agreement.DIMENSIONS
+
+N_RESAMPLES = 10000
+CONFIDENCE = agreement.CONFIDENCE
+# Resamples per task sent to a worker process
+CHUNK = 1000
+# Resample x row cells drawn at once inside a task (bounds temporary memory)
+BLOCK_CELLS = 1 << 22
+
+
+# Function to load every numeric metric column of abstract_para as one
+# rows x models table per metric (rows are corpus rows, matched on No)
+def load_metric_tables(csv_dir=CSV_DIR):
+    columns = {}
+    for csv_name in sorted(f for f in os.listdir(csv_dir) if f.endswith(".csv")):
+        path = os.path.join(csv_dir, csv_name)
+        header = pd.read_csv(path, nrows=0).columns
+        suffixes = [c[len("Abstract_") :] for c in header if c.startswith("Abstract_")]
+        wanted = {}
+        for column in header:
+            metric, model = summaries.split_metric_column(column, suffixes)
+            if metric is not None and metric != "Abstract":
+                wanted[column] = (metric, model)
+        df = pd.read_csv(path, usecols=["No"] + list(wanted)).set_index("No")
+        for column, (metric, model) in wanted.items():
+            if pd.api.types.is_numeric_dtype(df[column]):
+                columns.setdefault(metric, {})[model] = df[column]
+    return {metric: pd.DataFrame(models) for metric, models in columns.items()}
+
+
+# Function to load the mean human score of every item as one items x models
+# table per dimension (items are matched across models on their title)
+def load_human_tables(h_evals_dir=score_store.H_EVALS_DIR):
+    scores = agreement.load_human_scores(h_evals_dir)
+    means = scores.groupby(["key", "model"])[DIMENSIONS].mean()
+    return {dimension: means[dimension].unstack("model") for dimension in DIMENSIONS}
+
+
+# Function to turn tables into one matrix of paired differences, one column per
+# (measure, model pair), over the union of their rows (missing pairs masked)
+def paired_differences(tables):
+    index = pd.Index([])
+    for table in tables.values():
+        index = index.union(table.index)
+    tests = []
+    columns = []
+    for measure, table in tables.items():
+        table = table.reindex(index)
+        for model_a, model_b in itertools.combinations(sorted(table.columns), 2):
+            tests.append((measure, model_a, model_b))
+            columns.append(
+                table[model_a].to_numpy(float) - table[model_b].to_numpy(float)
+            )
+    diffs = np.column_stack(columns) if columns else np.zeros((len(index), 0))
+    valid = ~np.isnan(diffs)
+    return tests, np.where(valid, diffs, 0.0), valid.astype(np.float64)
+
+
+# Function to draw paired bootstrap and sign-flip permutation statistics for
+# every test at once (runs in a worker)
+# (each block draws a resamples x rows index matrix, turns it into row counts and
+# gets the resampled means of all tests from one matrix product)
+def _resample_chunk(diffs, valid, n_resamples, seed):
+    rng = np.random.default_rng(seed)
+    n, tests = diffs.shape
+    block = max(BLOCK_CELLS // max(n, 1), 1)
+    weighted = np.concatenate([diffs, valid], axis=1)
+    n_valid = valid.sum(axis=0)
+    boot = []
+    perm = []
+    for start in range(0, n_resamples, block):
+        size = min(block, n_resamples - start)
+        indices = rng.integers(0, n, size=(size, n))
+        indices += np.arange(size)[:, None] * n
+        counts = np.bincount(indices.ravel(), minlength=size * n).reshape(size, n)
+        sums = counts.astype(np.float64) @ weighted
+        with np.errstate(invalid="ignore", divide="ignore"):
+            boot.append(sums[:, :tests] / sums[:, tests:])
+            signs = rng.integers(0, 2, size=(size, n), dtype=np.int8) * 2.0 - 1.0
+            perm.append(signs @ diffs / n_valid)
+    return np.concatenate(boot), np.concatenate(perm)
+
+
+# Function to resample every test, chunked across a process pool
+def resample(diffs, valid, n_resamples=N_RESAMPLES, workers=None, seed=0, chunk=CHUNK):
+    sizes = [min(chunk, n_resamples - s) for s in range(0, n_resamples, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if workers == 1 or len(sizes) == 1:
+        parts = [_resample_chunk(diffs, valid, n, s) for n, s in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(
+                pool.map(
+                    _resample_chunk,
+                    [diffs] * len(sizes),
+                    [valid] * len(sizes),
+                    sizes,
+                    seeds,
+                )
+            )
+    return (
+        np.concatenate([boot for boot, _ in parts]),
+        np.concatenate([perm for _, perm in parts]),
+    )
+
+
+# Function to compare every pair of models on every measure of the tables
+# (paired bootstrap interval and p-value of the mean difference, plus a
+# two-sided sign-flip permutation p-value)
+def significance_table(tables, source, n_resamples=N_RESAMPLES, workers=None, seed=0):
+    tests, diffs, valid = paired_differences(tables)
+    if not tests:
+        return pd.DataFrame()
+    boot, perm = resample(diffs, valid, n_resamples, workers, seed)
+
+    n = valid.sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observed = diffs.sum(axis=0) / n
+    tail = (1 - CONFIDENCE) / 2 * 100
+    low, high = np.nanpercentile(boot, [tail, 100 - tail], axis=0)
+    # Bootstrap p-value: how often the resampled difference, shifted to the null
+    # of no difference, lies as far from zero as the observed one (with the
+    # same +1 as the permutation p-value, so neither is ever reported as 0)
+    tolerance = 1e-12
+    far = np.abs(boot - observed) >= np.abs(observed) - tolerance
+    p_bootstrap = (far.sum(axis=0) + 1) / ((~np.isnan(boot)).sum(axis=0) + 1)
+    p_permutation = ((np.abs(perm) >= np.abs(observed) - tolerance).sum(axis=0) + 1) / (
+        len(perm) + 1
+    )
+
+    rows = []
+    for k, (measure, model_a, model_b) in enumerate(tests):
+        table = tables[measure]
+        pair = table[[model_a, model_b]].dropna()
+        rows.append(
+            {
+                "source": source,
+                "measure": measure,
+                "model_a": model_a,
+                "model_b": model_b,
+                "n": int(n[k]),
+                "mean_a": pair[model_a].mean(),
+                "mean_b": pair[model_b].mean(),
+                "difference": observed[k],
+                "ci_low": low[k],
+                "ci_high": high[k],
+                "p_bootstrap": p_bootstrap[k],
+                "p_permutation": p_permutation[k],
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+# Function to test every metric column and every human dimension
+def run(
+    csv_dir=CSV_DIR,
+    h_evals_dir=score_store.H_EVALS_DIR,
+    n_resamples=N_RESAMPLES,
+    workers=None,
+    seed=0,
+):
+    parts = [
+        significance_table(
+            load_metric_tables(csv_dir), "metric", n_resamples, workers, seed
+        ),
+        significance_table(
+            load_human_tables(h_evals_dir), "human", n_resamples, workers, seed
+        ),
+    ]
+    return pd.concat([part for part in parts if len(part)], ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Model-vs-model significance tests")
+    parser.add_argument("--csv-dir", default=CSV_DIR)
+    parser.add_argument("--h-evals-dir", default=score_store.H_EVALS_DIR)
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="csv path for the results")
+    args = parser.parse_args()
+
+    results = run(
+        args.csv_dir, args.h_evals_dir, args.resamples, args.workers, args.seed
+    )
+    if args.out:
+        results.to_csv(args.out, index=False)
+    print(results.round(4).to_string(index=False))
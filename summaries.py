@@ -0,0 +1,215 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import corpus_store
+import profiling
+import score_store
+
+CSV_DIR = "abstract_para"
+SUMMARY_FILE = os.path.join(corpus_store.CACHE_DIR, "summary.csv")
+SOURCES_FILE = os.path.join(corpus_store.CACHE_DIR, "summary_sources.json")
+
+PERCENTILES = [5, 25, 50, 75, 95]
+HUMAN_SCALE = [1, 2, 3, 4, 5]
+
+# A paraphrase counts as unacceptable below these values (or when T5 CoLA
+# labels it "unacceptable"); human scores of 1-2 are unacceptable
+UNACCEPTABLE_BELOW = {"stsb": 3.0}
+HUMAN_UNACCEPTABLE_MAX = 2
+
+SUMMARY_COLUMNS = (
+    ["source", "kind", "annotator", "metric", "model", "count", "mean", "std"]
+    + [f"p{p}" for p in PERCENTILES]
+    + ["unacceptable_pct"]
+    + [f"n_{v}" for v in HUMAN_SCALE]
+)
+
+_lock = threading.Lock()
+
+
+# Function to split an abstract_para column like "rouge2_llama3" into parts
+def split_metric_column(column, suffixes):
+    for suffix in suffixes:
+        if column.endswith(f"_{suffix}"):
+            return column[: -len(suffix) - 1], suffix
+    return None, None
+
+
+# Function to summarize the metric columns of one abstract_para file
+def summarize_metric_file(path):
+    df = pd.read_csv(path)
+    suffixes = [c[len("Abstract_") :] for c in df.columns if c.startswith("Abstract_")]
+    rows = []
+    for column in df.columns:
+        metric, model = split_metric_column(column, suffixes)
+        if metric is None or column.startswith("Abstract_"):
+            continue
+        values = df[column].dropna()
+        row = {"source": path, "kind": "metric", "metric": metric, "model": model}
+        if pd.api.types.is_numeric_dtype(values):
+            row.update(_numeric_stats(values.to_numpy(dtype=float)))
+            threshold = UNACCEPTABLE_BELOW.get(metric)
+            if threshold is not None and len(values):
+                row["unacceptable_pct"] = 100 * float((values < threshold).mean())
+        else:
+            row["count"] = len(values)
+            if len(values):
+                row["unacceptable_pct"] = 100 * float(
+                    (values.astype(str) == "unacceptable").mean()
+                )
+        rows.append(row)
+    return rows
+
+
+# Function to compute count, mean, std and percentiles of numeric values
+def _numeric_stats(values):
+    if len(values) == 0:
+        return {"count": 0}
+    stats = {
+        "count": len(values),
+        "mean": float(values.mean()),
+        "std": float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+    }
+    for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        stats[f"p{p}"] = float(value)
+    return stats
+
+
+# Function to summarize one annotator's H_Evals file as score histograms
+def summarize_human_file(path):
+    annotator, model = score_store.parse_scores_file(path)
+    df = score_store.read_scores_file(path)
+    rows = []
+    for column in score_store.SCORE_COLUMNS[1:]:
+        if column not in df.columns:
+            continue
+        values = pd.to_numeric(df[column], errors="coerce").dropna()
+        row = {
+            "source": path,
+            "kind": "human",
+            "annotator": annotator,
+            "metric": column,
+            "model": score_store.model_suffix(model),
+        }
+        row.update(_numeric_stats(values.to_numpy(dtype=float)))
+        # Histograms let per-annotator rows be pooled exactly per model
+        for v in HUMAN_SCALE:
+            row[f"n_{v}"] = int((values == v).sum())
+        if len(values):
+            row["unacceptable_pct"] = 100 * float(
+                (values <= HUMAN_UNACCEPTABLE_MAX).mean()
+            )
+        rows.append(row)
+    return rows
+
+
+# Function to list the score files the summary is built from
+def list_sources(csv_dir=CSV_DIR, h_evals_dir=score_store.H_EVALS_DIR):
+    sources = []
+    if os.path.exists(csv_dir):
+        sources += sorted(
+            os.path.join(csv_dir, f) for f in os.listdir(csv_dir) if f.endswith(".csv")
+        )
+    return sources + score_store.list_scores_files(h_evals_dir)
+
+
+# Function to summarize one source file (None if it cannot be parsed)
+def summarize_file(path, h_evals_dir=score_store.H_EVALS_DIR):
+    try:
+        if path.startswith(os.path.join(h_evals_dir, "")):
+            return summarize_human_file(path)
+        return summarize_metric_file(path)
+    except (pd.errors.ParserError, ValueError):
+        return None
+
+
+# Function to replace a file atomically through a temp file unique to this call
+# (app processes refreshing at the same time never share a temp path)
+def _write_atomically(path, write):
+    handle, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + "."
+    )
+    try:
+        with os.fdopen(handle, "w", newline="") as f:
+            write(f)
+        # mkstemp creates the file private to its owner; keep the usual mode
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+# Function to bring the cached summary up to date, re-reading changed files only
+# (changed files can be summarized across a process pool)
+@profiling.timed("summaries.refresh")
+def refresh(csv_dir=CSV_DIR, h_evals_dir=score_store.H_EVALS_DIR, workers=1):
+    with _lock:
+        summary = pd.DataFrame(columns=SUMMARY_COLUMNS)
+        known = {}
+        if os.path.exists(SUMMARY_FILE) and os.path.exists(SOURCES_FILE):
+            summary = pd.read_csv(SUMMARY_FILE)
+            with open(SOURCES_FILE) as f:
+                known = json.load(f)
+
+        current = {}
+        changed = []
+        for path in list_sources(csv_dir, h_evals_dir):
+            current[path] = list(corpus_store.file_key(path))
+            if known.get(path) != current[path]:
+                changed.append(path)
+        if not changed and set(known) == set(current):
+            return summary
+
+        keep = summary["source"].isin(set(current) - set(changed))
+        if workers == 1 or len(changed) <= 1:
+            results = [summarize_file(path, h_evals_dir) for path in changed]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(
+                    pool.map(summarize_file, changed, [h_evals_dir] * len(changed))
+                )
+        rows = []
+        for path, file_rows in zip(changed, results):
+            if file_rows is None:
+                current.pop(path)
+            else:
+                rows += file_rows
+        fresh = pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+        parts = [part for part in (summary[keep], fresh) if len(part)]
+        summary = pd.concat(parts, ignore_index=True) if parts else fresh
+
+        os.makedirs(corpus_store.CACHE_DIR, exist_ok=True)
+        _write_atomically(SUMMARY_FILE, lambda f: summary.to_csv(f, index=False))
+        _write_atomically(SOURCES_FILE, lambda f: json.dump(current, f))
+        return summary
+
+
+# Function to get per-model automatic metric summaries
+def metric_summary(summary):
+    return summary[summary["kind"] == "metric"].drop(
+        columns=["source", "kind", "annotator"] + [f"n_{v}" for v in HUMAN_SCALE]
+    )
+
+
+# Function to pool the annotators' histograms into per-model human summaries
+def human_summary(summary):
+    human = summary[summary["kind"] == "human"]
+    rows = []
+    for (metric, model), group in human.groupby(["metric", "model"]):
+        counts = group[[f"n_{v}" for v in HUMAN_SCALE]].sum().to_numpy(dtype=float)
+        values = np.repeat(np.array(HUMAN_SCALE, dtype=float), counts.astype(int))
+        row = {"metric": metric, "model": model, "annotators": len(group)}
+        row.update(_numeric_stats(values))
+        if len(values):
+            row["unacceptable_pct"] = 100 * float(
+                (values <= HUMAN_UNACCEPTABLE_MAX).mean()
+            )
+        rows.append(row)
+    return pd.DataFrame(rows)
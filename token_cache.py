@@ -0,0 +1,177 @@
+import itertools
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+import columnar_store
+import corpus_store
+
+# Bump whenever normalization or tokenization changes so stored tables rebuild
+TOKENIZER_VERSION = "1"
+
+# Model output files keep their paraphrase in this column
+TEXT_COLUMNS = ["ParaphrasedAbstract"]
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Loaded token tables, keyed by corpus path
+_tables = {}
+_lock = threading.Lock()
+
+
+# Function to split an abstract into lowercase word and punctuation tokens
+def tokenize(text):
+    if not isinstance(text, str):
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+# Function to get the tokens of a text with their character offsets
+# (the same tokens as tokenize, for marking them in the original text)
+def token_spans(text):
+    if not isinstance(text, str):
+        return []
+    return [(m.start(), m.end(), m.group().lower()) for m in _TOKEN_RE.finditer(text)]
+
+
+# Function to turn texts into one flat token id array over a shared vocabulary
+# (token ids are interned in first-seen order)
+def encode(texts):
+    tokenized = [tokenize(text) for text in texts]
+    lengths = np.fromiter((len(tokens) for tokens in tokenized), dtype=np.int64)
+    ids, vocab = pd.factorize(
+        np.fromiter(itertools.chain.from_iterable(tokenized), dtype=object)
+    )
+    return ids.astype(np.int32), lengths, list(vocab)
+
+
+# Function to get the path of the persisted token table of a corpus file
+def cache_path(corpus_file):
+    name = os.path.splitext(os.path.basename(corpus_file))[0]
+    return os.path.join(corpus_store.CACHE_DIR, f"tokens_{name}.npz")
+
+
+# Function to list the text columns of a corpus that get tokenized
+def text_columns(df):
+    return [
+        c
+        for c in df.columns
+        if c in TEXT_COLUMNS or (columnar_store.is_text_column(c) and c != "Title")
+    ]
+
+
+# Function to tokenize every text column of a corpus into one table
+def build(corpus_file):
+    df = corpus_store.load_csv(corpus_file)
+    columns = text_columns(df)
+    texts = [text for column in columns for text in df[column].tolist()]
+    ids, lengths, vocab = encode(texts)
+    lengths = lengths.reshape(len(columns), len(df))
+    return {
+        "key": list(corpus_store.file_key(corpus_file)),
+        "version": TOKENIZER_VERSION,
+        "columns": columns,
+        "ids": ids,
+        "lengths": lengths,
+        "starts": np.concatenate([[0], np.cumsum(lengths)])[:-1].reshape(lengths.shape),
+        "vocab": vocab,
+    }
+
+
+# Function to write a token table as plain arrays (no pickling needed to read)
+def _save(table, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            key=np.array(table["key"], dtype=np.int64),
+            version=np.array(table["version"]),
+            columns=np.array(table["columns"]),
+            ids=table["ids"],
+            lengths=table["lengths"],
+            # Tokens never contain whitespace, so newlines can separate them
+            vocab=np.frombuffer("\n".join(table["vocab"]).encode("utf-8"), np.uint8),
+        )
+    os.replace(path + ".tmp", path)
+
+
+# Function to read a persisted token table (None if missing or stale)
+def _read(path, corpus_file):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if (
+            list(data["key"]) != list(corpus_store.file_key(corpus_file))
+            or str(data["version"]) != TOKENIZER_VERSION
+        ):
+            return None
+        lengths = data["lengths"]
+        vocab = data["vocab"].tobytes().decode("utf-8")
+        return {
+            "key": list(data["key"]),
+            "version": str(data["version"]),
+            "columns": data["columns"].tolist(),
+            "ids": data["ids"],
+            "lengths": lengths,
+            "starts": np.concatenate([[0], np.cumsum(lengths)])[:-1].reshape(
+                lengths.shape
+            ),
+            "vocab": vocab.split("\n") if vocab else [],
+        }
+
+
+# Function to get the token table of a corpus, rebuilding it when stale
+def load(corpus_file):
+    path = os.path.abspath(corpus_file)
+    key = list(corpus_store.file_key(path))
+    with _lock:
+        table = _tables.get(path)
+        if table is not None and table["key"] == key:
+            return table
+        table = _read(cache_path(corpus_file), corpus_file)
+        if table is None:
+            table = build(corpus_file)
+            _save(table, cache_path(corpus_file))
+        _tables[path] = table
+        return table
+
+
+# Function to get the flat token ids and per-row lengths of one column
+def column_ids(table, column, rows=None):
+    k = table["columns"].index(column)
+    starts, lengths = table["starts"][k], table["lengths"][k]
+    if rows is not None:
+        starts, lengths = starts[rows], lengths[rows]
+    if len(lengths) == 0:
+        return np.zeros(0, dtype=np.int64), lengths
+    # Gather every selected row's slice in one indexing operation
+    positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    positions += np.arange(lengths.sum())
+    return table["ids"][positions].astype(np.int64), lengths
+
+
+# Function to get the token ids of one row of one column
+def row_ids(table, column, row):
+    k = table["columns"].index(column)
+    start = table["starts"][k][row]
+    return table["ids"][start : start + table["lengths"][k][row]]
+
+
+# Function to get the tokens of one row of one column as strings
+def row_tokens(table, column, row):
+    vocab = table["vocab"]
+    return [vocab[i] for i in row_ids(table, column, row)]
+
+
+if __name__ == "__main__":
+    import sys
+
+    for corpus_file in sys.argv[1:] or ["cleaned_abstracts_by_row.csv"]:
+        table = load(corpus_file)
+        print(
+            cache_path(corpus_file),
+            f"{len(table['ids'])} tokens, {len(table['vocab'])} types",
+        )
@@ -0,0 +1,239 @@
+import argparse
+import contextlib
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import corpus_store
+
+USERS_CSV = "users.csv"
+DB_FILE = os.environ.get(
+    "PARAWEB_USERS_DB", os.path.join(corpus_store.CACHE_DIR, "users.db")
+)
+# Where the database used to live (moved to DB_FILE on first use)
+OLD_DB_FILE = "users.db"
+
+# Hash cost; raise it on faster machines, lower it if logins queue up.
+# Stored hashes keep their own parameters and are upgraded on the next login.
+SCRYPT_N = int(os.environ.get("PARAWEB_SCRYPT_N", str(2**14)))
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = int(os.environ.get("PARAWEB_PBKDF2_ITERATIONS", "200000"))
+SALT_BYTES = 16
+
+# At most this many hashes run at once, so a burst of logins queues instead of
+# every login slowing down together (hashlib releases the GIL while hashing)
+MAX_CONCURRENT_HASHES = int(
+    os.environ.get("PARAWEB_MAX_CONCURRENT_HASHES", str(os.cpu_count() or 2))
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# username -> stored hash, filled from the database on first lookup and
+# dropped whenever another connection (e.g. the "set" command) changed it
+_users = {}
+# Database -> its data_version when the cached hashes were read
+_versions = {}
+_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(MAX_CONCURRENT_HASHES)
+# One connection per database for the whole process, used under its lock
+# (Streamlit runs every rerun on a new thread, so per-thread connections leak)
+_connections = {}
+_connections_lock = threading.Lock()
+
+
+# Function to hold the process's connection to the user database
+@contextlib.contextmanager
+def connect(db_file=DB_FILE):
+    with _connections_lock:
+        entry = _connections.get(db_file)
+        if entry is None:
+            os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+            if db_file == DB_FILE and not os.path.exists(db_file):
+                # Keep the accounts and passwords of a database from the old place
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(OLD_DB_FILE + suffix):
+                        os.replace(OLD_DB_FILE + suffix, db_file + suffix)
+            connection = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            entry = _connections[db_file] = (connection, threading.RLock())
+    with entry[1]:
+        yield entry[0]
+
+
+# Function to hash a password with a fresh salt
+# (scrypt when OpenSSL provides it, PBKDF2-SHA256 otherwise)
+def hash_password(password, salt=None):
+    salt = salt or secrets.token_bytes(SALT_BYTES)
+    with _hash_slots:
+        if hasattr(hashlib, "scrypt"):
+            digest = hashlib.scrypt(
+                password.encode("utf-8"),
+                salt=salt,
+                n=SCRYPT_N,
+                r=SCRYPT_R,
+                p=SCRYPT_P,
+                maxmem=256 * SCRYPT_N * SCRYPT_R,
+            )
+            return (
+                f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${digest.hex()}"
+            )
+        digest = hashlib.pbkdf2_hmac(
+            "sha256", password.encode("utf-8"), salt, PBKDF2_ITERATIONS
+        )
+        return f"pbkdf2_sha256${PBKDF2_ITERATIONS}${salt.hex()}${digest.hex()}"
+
+
+# Function to check a password against a stored hash in constant time
+def verify_password(password, stored):
+    scheme, *fields = stored.split("$")
+    with _hash_slots:
+        if scheme == "scrypt":
+            n, r, p, salt, expected = fields
+            digest = hashlib.scrypt(
+                password.encode("utf-8"),
+                salt=bytes.fromhex(salt),
+                n=int(n),
+                r=int(r),
+                p=int(p),
+                maxmem=256 * int(n) * int(r),
+            )
+        elif scheme == "pbkdf2_sha256":
+            iterations, salt, expected = fields
+            digest = hashlib.pbkdf2_hmac(
+                "sha256", password.encode("utf-8"), bytes.fromhex(salt), int(iterations)
+            )
+        else:
+            return False
+    return hmac.compare_digest(digest.hex(), expected)
+
+
+# Function to check whether a stored hash uses other than the current settings
+def needs_rehash(stored):
+    if hasattr(hashlib, "scrypt"):
+        return not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+    return not stored.startswith(f"pbkdf2_sha256${PBKDF2_ITERATIONS}$")
+
+
+# Function to get a user's stored hash (None for unknown users)
+def lookup(username, db_file=DB_FILE):
+    with connect(db_file) as connection:
+        # data_version changes when another connection commits (the file's
+        # mtime does not, as writes land in the WAL first)
+        version = connection.execute("PRAGMA data_version").fetchone()[0]
+        with _lock:
+            if _versions.get(db_file) != version:
+                for key in [key for key in _users if key[0] == db_file]:
+                    del _users[key]
+                _versions[db_file] = version
+            if (db_file, username) in _users:
+                return _users[(db_file, username)]
+        row = connection.execute(
+            "SELECT password_hash FROM users WHERE username = ?", (username,)
+        ).fetchone()
+    if row is None:
+        # Not cached, so accounts added by another process are found later
+        return None
+    with _lock:
+        _users[(db_file, username)] = row[0]
+    return row[0]
+
+
+# Function to add a user or change their password
+def set_password(username, password, db_file=DB_FILE):
+    stored = hash_password(password)
+    with connect(db_file) as connection, connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO users (username, password_hash) VALUES (?, ?)",
+            (username, stored),
+        )
+    with _lock:
+        _users[(db_file, username)] = stored
+
+
+# Function to check a login: None for an unknown user, else whether it matched
+def authenticate(username, password, db_file=DB_FILE):
+    stored = lookup(username, db_file)
+    if stored is None:
+        return None
+    if not verify_password(password, stored):
+        return False
+    if needs_rehash(stored):
+        set_password(username, password, db_file)
+    return True
+
+
+# Function to import the plaintext users.csv, hashing passwords in parallel
+# (existing users are only replaced when overwrite is set)
+def import_csv(path=USERS_CSV, db_file=DB_FILE, overwrite=False):
+    users = pd.read_csv(path, dtype={"username": str, "password": str})
+    if not overwrite:
+        with connect(db_file) as connection:
+            known = {row[0] for row in connection.execute("SELECT username FROM users")}
+        users = users[~users["username"].isin(known)]
+    # Hash outside the connection, so logins are not held up meanwhile
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_HASHES) as pool:
+        hashes = list(pool.map(hash_password, users["password"].fillna("")))
+    rows = list(zip(users["username"], hashes))
+    with connect(db_file) as connection, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO users (username, password_hash) VALUES (?, ?)",
+            rows,
+        )
+        connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (f"imported:{os.path.abspath(path)}", repr(corpus_store.file_key(path))),
+        )
+    with _lock:
+        for username, stored in rows:
+            _users[(db_file, username)] = stored
+    return len(rows)
+
+
+# Function to import the accounts added to users.csv since the last import
+# (only missing usernames are hashed; passwords already in the database, e.g.
+# reset with "set", are never replaced here, only by the "import" command)
+def ensure_imported(path=USERS_CSV, db_file=DB_FILE):
+    if not os.path.exists(path):
+        return 0
+    with connect(db_file) as connection:
+        row = connection.execute(
+            "SELECT value FROM meta WHERE key = ?",
+            (f"imported:{os.path.abspath(path)}",),
+        ).fetchone()
+    if row is not None and row[0] == repr(corpus_store.file_key(path)):
+        return 0
+    return import_csv(path, db_file, overwrite=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage annotator accounts")
+    parser.add_argument("--db", default=DB_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="import a users csv")
+    import_parser.add_argument("path", nargs="?", default=USERS_CSV)
+    set_parser = subparsers.add_parser("set", help="add a user or reset a password")
+    set_parser.add_argument("username")
+    set_parser.add_argument("password")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        print(f"{import_csv(args.path, args.db, overwrite=True)} users imported")
+    else:
+        set_password(args.username, args.password, args.db)